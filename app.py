@@ -1,246 +1,258 @@
-import gradio as gr
+import logging
 import os
-import cv2
+import tempfile
 import numpy as np
 
-# Importaciones de tus módulos de procesamiento
-from processing.color_operations import convert_color, hex_to_rgb
-from processing.corrections import (
-    rotate, flip, adjust_brightness_contrast, gamma_correction, equalize_histogram
-)
-from processing.enhancements import apply_filter
-from processing.masks import (
-    apply_threshold, adaptive_threshold, otsu_threshold,
-    bitwise_and, bitwise_or, bitwise_not
-)
-from processing.background_removal import remove_background_hsv, remove_background_lab, grabcut
-from processing.background_change import change_background_color, change_background_image
-from processing.collage import stack_images
-from processing.detection import detect_contours, detect_faces_haar
-from processing.utils import to_bgr # Asegúrate de que utils.py tenga esta función
+from processing import disk_cache, export, frame_store, instrumentation, workers
+from processing.cache import prewarm_resized
+from processing.pipeline import load_image, run_pipeline
+from processing.spec import dump_spec, spec_from_params
 
 IMAGE_DIR = "images"
 BACKGROUND_DIR = "backgrounds"
 
-# Variables globales para almacenar la máscara y la imagen original para la exportación transparente
-background_mask_global = None # Máscara donde el objeto es 255, fondo 0
-processed_foreground_global = None # Imagen con fondo negro (resultado de la eliminación)
-original_image_for_transparent_export_global = None # Almacena la imagen original BGR
-
+# Número de peticiones que la cola de Gradio atiende en paralelo. Es seguro subirlo
+# porque el estado de cada usuario vive en su propia sesión (ver new_session_state).
+CONCURRENCY_COUNT = int(os.environ.get("CONCURRENCY_COUNT", "4"))
+
+# Los rostros se buscan sobre una copia reducida a este lado mayor (en px);
+# las cajas se reescalan a la resolución original.
+FACE_DETECTION_MAX_SIDE = 1024
+
+# Hilos con los que se filtran por bandas las imágenes grandes (ver enhancements.apply_filter)
+FILTER_WORKERS = int(os.environ.get("FILTER_WORKERS", "1"))
+
+# Puerto en el que se sirve /metrics (formato Prometheus) si la instrumentación
+# del pipeline está activa (PIPELINE_METRICS=1). 0 = no servir.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+
+# Si es "1", al arrancar se precargan los fondos redimensionados a los tamaños
+# de las imágenes de IMAGE_DIR (ver prewarm_background_cache).
+PREWARM_BACKGROUNDS = os.environ.get("PREWARM_BACKGROUNDS", "0") == "1"
+
+# Procesos del pool para las etapas pesadas (GrabCut, filtros bilateral/mediana,
+# detección de rostros). 0 = se ejecutan en el hilo de la petición.
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES", "0"))
+WORKER_TIMEOUT = float(os.environ.get("WORKER_TIMEOUT", "120")) # Segundos por tarea
+
+# Si es "1", las imágenes y los fondos se leen desde su almacén de fotogramas
+# (python -m processing.frame_store images/ backgrounds/) y las listas salen de su
+# índice: los archivos nuevos aparecen tras reconstruirlo.
+USE_FRAME_STORE = os.environ.get("FRAME_STORE", "0") == "1"
+# Caché de resultados en disco (processing.disk_cache); vacío = desactivada
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE", "")
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# Vista previa: los cambios de los controles se procesan sobre una copia reducida
+# a este lado mayor (en px). La resolución completa sólo se calcula al pulsar
+# "Procesar Imagen" o cuando, al terminar una vista previa, no llegó otro cambio.
+PREVIEW_MAX_SIDE = int(os.environ.get("PREVIEW_MAX_SIDE", "640"))
+
+
+def new_session_state():
+    """
+    Estado por sesión para la exportación transparente (sustituye a las antiguas
+    variables globales, que se compartían entre todos los usuarios).
+    """
+    return {
+        "original": None,   # Imagen original BGR
+        "mask": None,       # Máscara donde el objeto es 255, fondo 0
+        "foreground": None, # Imagen con fondo negro (resultado de la eliminación)
+        "metrics": [],      # Tiempos por etapa de la última ejecución (si la instrumentación está activa)
+        "generation": 0,    # Se incrementa con cada petición: las vistas previas antiguas se descartan
+        "requested": 0,     # Vistas previas pedidas (al cambiar un control, fuera de la cola)
+        "started": 0,       # Vistas previas que llegaron a ejecutarse o a descartarse
+        "previewed": None,  # Generación de la última vista previa mostrada (pendiente de resolución completa)
+        "pending": None,    # (filename, params) de esa vista previa, para exportar a resolución completa
+    }
+
+
+def _stored_names(folder):
+    store = frame_store.get_store(folder)
+    return store.names() if store is not None else []
 
 def list_images():
     """Lista los archivos de imagen en el directorio de imágenes."""
-    return [f for f in os.listdir(IMAGE_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    return _stored_names(IMAGE_DIR) or [f for f in os.listdir(IMAGE_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
 
 def list_backgrounds():
     """Lista los archivos de imagen en el directorio de fondos."""
-    return [f for f in os.listdir(BACKGROUND_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-
-def load_image(folder, filename):
-    """Carga una imagen desde una carpeta específica."""
-    path = os.path.join(folder, filename)
-    try:
-        img = cv2.imread(path)
-        if img is None:
-            print(f"ADVERTENCIA: No se pudo cargar la imagen desde {path}. ¿Archivo corrupto o formato no soportado?")
-        return img
-    except Exception as e:
-        print(f"ERROR al cargar la imagen {path}: {e}")
-        return None
+    return _stored_names(BACKGROUND_DIR) or [f for f in os.listdir(BACKGROUND_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
+
+
+def prewarm_background_cache():
+    """
+    Precarga la caché de fondos redimensionados: cada fondo de list_backgrounds()
+    a cada tamaño distinto de las imágenes de list_images().
+    """
+    sizes = set()
+    for filename in list_images():
+        image = load_image(IMAGE_DIR, filename)
+        if image is not None:
+            sizes.add((image.shape[1], image.shape[0]))
+    paths = [os.path.join(BACKGROUND_DIR, f) for f in list_backgrounds()]
+    count = prewarm_resized(paths, sorted(sizes))
+    print(f"Caché de fondos precargada: {count} fondos redimensionados.")
+
+
+def build_params(
+    color_space, rotate_angle, flip_mode, brightness, contrast, gamma,
+    filter_type, threshold_type, threshold_value,
+    bitwise_op, background_removal_method, change_bg_mode,
+    bg_color, bg_image_name, bg_feather, collage_mode,
+    detect_contours_flag, detect_faces_flag
+):
+    """Convierte los valores de los controles de la interfaz en los parámetros del pipeline."""
+    return {
+        "image_dir": IMAGE_DIR,
+        "background_dir": BACKGROUND_DIR,
+        "color_space": color_space,
+        "rotate_angle": rotate_angle,
+        "flip_mode": flip_mode,
+        "brightness": brightness,
+        "contrast": contrast,
+        "gamma": gamma,
+        "filter_type": filter_type,
+        "filter_workers": FILTER_WORKERS,
+        "threshold_type": threshold_type,
+        "threshold_value": threshold_value,
+        "bitwise_op": bitwise_op,
+        "background_removal_method": background_removal_method,
+        "change_bg_mode": change_bg_mode,
+        "bg_color": bg_color,
+        "bg_image_name": bg_image_name,
+        "bg_feather": bg_feather,
+        "collage_mode": collage_mode,
+        "detect_contours_flag": detect_contours_flag,
+        "detect_faces_flag": detect_faces_flag,
+        "face_max_side": FACE_DETECTION_MAX_SIDE,
+    }
 
 
 def process_all(
     filename, color_space, rotate_angle, flip_mode, brightness, contrast, gamma,
     filter_type, threshold_type, threshold_value,
     bitwise_op, background_removal_method, change_bg_mode,
-    bg_color, bg_image_name_dropdown_value, collage_mode, # bg_image_name_dropdown_value es el valor del dropdown
-    detect_contours_flag, detect_faces_flag
+    bg_color, bg_image_name_dropdown_value, bg_feather, collage_mode, # bg_image_name_dropdown_value es el valor del dropdown
+    detect_contours_flag, detect_faces_flag, session_state=None
 ):
-    global background_mask_global, processed_foreground_global, original_image_for_transparent_export_global
-
-    image = load_image(IMAGE_DIR, filename)
-    if image is None:
+    """
+    Ejecuta el pipeline completo con los parámetros de la interfaz.
+    Las etapas cuyos parámetros no cambiaron se reutilizan desde la caché de
+    processing.pipeline (p. ej. mover el gamma no vuelve a ejecutar GrabCut).
+    Devuelve también el estado de la sesión actualizado para la exportación.
+    """
+    if session_state is None:
+        session_state = new_session_state()
+    session_state["generation"] = session_state.get("generation", 0) + 1 # Deja obsoletas las vistas previas en curso
+    session_state["previewed"] = session_state["pending"] = None
+    session_state["started"] = session_state.get("requested", 0) # Las que sigan en cola se ejecutarán
+
+    params = build_params(
+        color_space, rotate_angle, flip_mode, brightness, contrast, gamma,
+        filter_type, threshold_type, threshold_value,
+        bitwise_op, background_removal_method, change_bg_mode,
+        bg_color, bg_image_name_dropdown_value, bg_feather, collage_mode,
+        detect_contours_flag, detect_faces_flag
+    )
+    records = []
+    artifacts = run_pipeline(filename, params, records=records)
+    session_state["metrics"] = records
+    if artifacts is None:
         # Retorna imágenes negras y una máscara vacía si no se puede cargar la imagen
         black_image = np.zeros((300, 300, 3), dtype=np.uint8)
         empty_mask = np.zeros((300, 300), dtype=np.uint8)
-        return black_image, black_image, empty_mask
-
-    original_image = image.copy()
-    original_image_for_transparent_export_global = original_image.copy() # Guardar la original para exportación
-
-    current_processed_image = original_image.copy() # Imagen que se va modificando
-    background_mask = None # Esta será la máscara del primer plano (objeto=255, fondo=0)
-
-    # --- 1. Eliminación de fondo y obtención de máscara ---
-    try:
-        if background_removal_method == "HSV":
-            processed_foreground_result, background_mask = remove_background_hsv(original_image)
-        elif background_removal_method == "LAB":
-            processed_foreground_result, background_mask = remove_background_lab(original_image)
-        elif background_removal_method == "GrabCut":
-            processed_foreground_result, background_mask = grabcut(original_image)
-        else: # Si background_removal_method es "None"
-            processed_foreground_result = original_image.copy() # No se elimina el fondo
-            background_mask = np.zeros(original_image.shape[:2], dtype=np.uint8) # Máscara vacía
-        
-        # Actualizar globales para la exportación
-        background_mask_global = background_mask # Máscara del primer plano (objeto=255)
-        processed_foreground_global = processed_foreground_result # Imagen con fondo negro (si se eliminó)
-        
-    except Exception as e:
-        print(f"ERROR en eliminación de fondo ({background_removal_method}): {e}")
-        background_mask_global = np.zeros(original_image.shape[:2], dtype=np.uint8)
-        processed_foreground_global = original_image.copy() # Fallback a original si falla
-
-
-    # --- 2. Cambiar fondo si hay máscara ---
-    if background_mask_global is not None and np.any(background_mask_global): # Asegurarse de que la máscara no esté vacía
-        try:
-            if change_bg_mode == "Color" and bg_color:
-                bgr_color = hex_to_rgb(bg_color)[::-1] # Convertir RGB a BGR
-                current_processed_image = change_background_color(original_image, background_mask_global, bgr_color)
-            elif change_bg_mode == "Image" and bg_image_name_dropdown_value: # Usar el valor del dropdown
-                bg_image = load_image(BACKGROUND_DIR, bg_image_name_dropdown_value)
-                if bg_image is not None:
-                    current_processed_image = change_background_image(original_image, background_mask_global, bg_image)
-                else:
-                    current_processed_image = processed_foreground_global # Fallback a imagen con fondo negro
-            else:
-                current_processed_image = processed_foreground_global
-        except Exception as e:
-            print(f"ERROR en cambio de fondo ({change_bg_mode}): {e}")
-            current_processed_image = processed_foreground_global # Fallback
-    else:
-        if background_removal_method == "None":
-            current_processed_image = original_image.copy()
-        else:
-            current_processed_image = processed_foreground_global
-
-
-    # --- 3. Aplicar transformaciones restantes ---
-    if current_processed_image is not None:
-        if len(current_processed_image.shape) == 2: # Si es escala de grises
-            current_processed_image = cv2.cvtColor(current_processed_image, cv2.COLOR_GRAY2BGR)
-        elif len(current_processed_image.shape) == 4: # Si es RGBA (raro aquí, por si acaso)
-            current_processed_image = cv2.cvtColor(current_processed_image, cv2.COLOR_BGRA2BGR)
-
-    try:
-        if current_processed_image is not None:
-            # Operaciones de color
-            current_processed_image = convert_color(current_processed_image, color_space)
-            if len(current_processed_image.shape) == 2: # Si después de convert_color es GRAYSCALE
-                current_processed_image = cv2.cvtColor(current_processed_image, cv2.COLOR_GRAY2BGR)
-
-            # Correcciones
-            current_processed_image = rotate(current_processed_image, rotate_angle)
-            current_processed_image = flip(current_processed_image, flip_mode)
-            current_processed_image = adjust_brightness_contrast(current_processed_image, brightness, contrast)
-            current_processed_image = gamma_correction(current_processed_image, gamma)
-
-            # Ecualización de histograma (aplicar solo si es escala de grises o convertir temporalmente)
-            if color_space == "GRAYSCALE":
-                current_processed_image = equalize_histogram(current_processed_image)
-                if len(current_processed_image.shape) == 2:
-                    current_processed_image = cv2.cvtColor(current_processed_image, cv2.COLOR_GRAY2BGR)
-            
-            # Filtros
-            if filter_type != "None":
-                current_processed_image = apply_filter(current_processed_image, filter_type)
-                if len(current_processed_image.shape) == 2:
-                    current_processed_image = cv2.cvtColor(current_processed_image, cv2.COLOR_GRAY2BGR)
-
-            # Umbrales (requieren imagen en escala de grises)
-            if threshold_type != "None":
-                if len(current_processed_image.shape) == 3:
-                    gray_for_threshold = cv2.cvtColor(current_processed_image, cv2.COLOR_BGR2GRAY)
-                else:
-                    gray_for_threshold = current_processed_image.copy()
-
-                if threshold_type == "Binary":
-                    current_processed_image = apply_threshold(gray_for_threshold, threshold_value)
-                elif threshold_type == "Adaptive":
-                    current_processed_image = adaptive_threshold(gray_for_threshold)
-                elif threshold_type == "Otsu":
-                    current_processed_image = otsu_threshold(gray_for_threshold)
-                
-                if len(current_processed_image.shape) == 2:
-                    current_processed_image = cv2.cvtColor(current_processed_image, cv2.COLOR_GRAY2BGR)
-
-            # Operaciones bitwise (solo NOT implementado de forma simple aquí)
-            if bitwise_op == "NOT":
-                current_processed_image = bitwise_not(current_processed_image)
-
-            # Detección (contornos y rostros)
-            if detect_contours_flag:
-                current_processed_image = detect_contours(current_processed_image)
-            if detect_faces_flag:
-                current_processed_image = detect_faces_haar(current_processed_image)
-            
-    except Exception as e:
-        print(f"ERROR durante las operaciones de procesamiento: {e}")
-        current_processed_image = original_image.copy()
-
-
-    # --- 4. Collage (se aplica al final, puede cambiar el tamaño de la imagen) ---
-    # Asegurarse de que las imágenes para el collage estén en RGB
-    original_image_rgb = cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB)
-    
-    # current_processed_image está en BGR en este punto, convertir a RGB para el collage
-    processed_rgb_for_collage = current_processed_image
-    if processed_rgb_for_collage is not None:
-        if len(processed_rgb_for_collage.shape) == 2:
-            processed_rgb_for_collage = cv2.cvtColor(processed_rgb_for_collage, cv2.COLOR_GRAY2BGR)
-        processed_rgb_for_collage = cv2.cvtColor(processed_rgb_for_collage, cv2.COLOR_BGR2RGB)
-    else:
-        processed_rgb_for_collage = np.zeros((300, 300, 3), dtype=np.uint8) # Imagen negra si es nula
-
-    if collage_mode == "Original vs Procesada (Horizontal)":
-        current_processed_image = stack_images([original_image_rgb, processed_rgb_for_collage], cols=2)
-    elif collage_mode == "Original vs Procesada (Vertical)":
-        current_processed_image = stack_images([original_image_rgb, processed_rgb_for_collage], cols=1)
-    elif collage_mode == "Procesada (Horizontal)":
-        current_processed_image = stack_images([processed_rgb_for_collage, processed_rgb_for_collage], cols=2)
-    elif collage_mode == "Procesada (Vertical)":
-        current_processed_image = stack_images([processed_rgb_for_collage, processed_rgb_for_collage], cols=1)
-
-
-    # Convertir a RGB para mostrar en Gradio y retornar también la máscara para depuración
-    display_mask = background_mask_global # La máscara del primer plano
-    if display_mask is None:
-        display_mask = np.zeros(original_image.shape[:2], dtype=np.uint8) # Máscara vacía si no hay
-    if len(display_mask.shape) == 3: # Si por alguna razón la máscara tiene 3 canales
-        display_mask = cv2.cvtColor(display_mask, cv2.COLOR_BGR2GRAY)
-    
-    if current_processed_image is not None:
-        if len(current_processed_image.shape) == 3 and current_processed_image.shape[2] == 3:
-            return original_image_rgb, cv2.cvtColor(current_processed_image, cv2.COLOR_BGR2RGB), display_mask
-        elif len(current_processed_image.shape) == 2:
-            return original_image_rgb, cv2.cvtColor(current_processed_image, cv2.COLOR_GRAY2RGB), display_mask
-    
-    print("ADVERTENCIA: Formato de imagen final inesperado o imagen nula. Devolviendo imagen original y máscara vacía.")
-    return original_image_rgb, cv2.cvtColor(original_image, cv2.COLOR_BGR2RGB), np.zeros(original_image.shape[:2], dtype=np.uint8)
-
-
-def export_transparent_object():
-    global original_image_for_transparent_export_global, background_mask_global
-    
-    if original_image_for_transparent_export_global is None or background_mask_global is None:
+        return black_image, black_image, empty_mask, session_state
+
+    # Actualizar el estado de la sesión para la exportación
+    session_state["original"] = artifacts["original"] # Imagen original BGR
+    session_state["mask"] = artifacts["mask"] # Máscara del primer plano (objeto=255)
+    session_state["foreground"] = artifacts["foreground"] # Imagen con fondo negro (si se eliminó)
+
+    return (*artifacts["display"], session_state)
+
+
+def _skip_update(session_state):
+    """Salidas que dejan la interfaz como está (petición obsoleta)."""
+    import gradio as gr
+    return gr.update(), gr.update(), gr.update(), session_state
+
+
+def request_preview(session_state):
+    """
+    Se ejecuta fuera de la cola (queue=False) en cuanto cambia un control, antes
+    de que la vista previa correspondiente espere su turno: así una vista previa
+    sabe, al empezar, si detrás de ella ya hay otra más reciente.
+    """
+    if session_state is None:
+        return
+    session_state["generation"] = session_state.get("generation", 0) + 1
+    session_state["requested"] = session_state.get("requested", 0) + 1
+
+
+def process_preview(filename, *control_values):
+    """
+    Vista previa de un cambio de los controles sobre la copia reducida de la
+    imagen. Si mientras esperaba en la cola se pidió otra más reciente, se
+    descarta sin procesar: esa otra llegará con los valores actuales. No toca el
+    estado de exportación.
+    """
+    session_state = control_values[-1]
+    if session_state is None:
+        session_state = new_session_state()
+    session_state["started"] = session_state.get("started", 0) + 1
+    if session_state["started"] < session_state.get("requested", 0):
+        return _skip_update(session_state)
+    generation = session_state["generation"]
+
+    params = build_params(*control_values[:-1])
+    records = []
+    artifacts = run_pipeline(filename, dict(params, preview_max_side=PREVIEW_MAX_SIDE), records=records)
+    session_state["metrics"] = records
+    if artifacts is None or session_state["generation"] != generation:
+        return _skip_update(session_state) # Imagen ilegible o ya llegó otro cambio
+
+    session_state["previewed"] = generation
+    session_state["pending"] = (filename, params)
+    return (*artifacts["display"], session_state)
+
+
+def render_if_idle(filename, *control_values):
+    """
+    Se encadena tras cada vista previa: si mientras se calculaba no hubo más
+    cambios (ni quedan vistas previas en cola), la sustituye por el resultado a
+    resolución completa. No espera: la quietud se detecta por la generación.
+    """
+    session_state = control_values[-1]
+    if session_state is None or session_state.get("previewed") != session_state.get("generation"):
+        return _skip_update(session_state) # Vista previa descartada o ya sustituida
+    if session_state.get("started", 0) < session_state.get("requested", 0):
+        return _skip_update(session_state)
+    return process_all(filename, *control_values)
+
+
+def export_transparent_object(session_state=None, export_format="PNG", crop=False, png_compression=export.DEFAULT_PNG_COMPRESSION):
+    if session_state and session_state.get("pending"):
+        # Lo último que se mostró es una vista previa: se exporta a resolución completa
+        filename, params = session_state["pending"]
+        artifacts = run_pipeline(filename, params)
+        if artifacts is not None:
+            session_state["original"] = artifacts["original"]
+            session_state["mask"] = artifacts["mask"]
+            session_state["foreground"] = artifacts["foreground"]
+
+    original_image = session_state["original"] if session_state else None
+    foreground_mask = session_state["mask"] if session_state else None
+
+    if original_image is None or foreground_mask is None:
         print("ERROR: No se ha procesado una imagen con eliminación de fondo o no hay máscara disponible para exportar el objeto transparente.")
         return None
 
     try:
-        bgr_image = original_image_for_transparent_export_global.copy()
-        alpha_channel = background_mask_global.copy() # Esta es la máscara del objeto (foreground)
-
-        if alpha_channel.shape[:2] != bgr_image.shape[:2]:
-            alpha_channel = cv2.resize(alpha_channel, (bgr_image.shape[1], bgr_image.shape[0]))
-            _, alpha_channel = cv2.threshold(alpha_channel, 127, 255, cv2.THRESH_BINARY)
-
-        rgba_image = cv2.cvtColor(bgr_image, cv2.COLOR_BGR2BGRA)
-        rgba_image[:, :, 3] = alpha_channel # El objeto será opaco (255), el fondo transparente (0)
-
-        save_path = "objeto_transparente.png"
-        cv2.imwrite(save_path, rgba_image)
+        # BGRA en un solo buffer y archivo único por exportación (usuarios concurrentes
+        # no se pisan). Gradio sirve el archivo al volver: se escribe en el hilo de la petición.
+        save_path = export.save_transparent(original_image, foreground_mask, fmt=export_format.lower(),
+                                            crop=crop, compression=int(png_compression))
         print(f"Objeto transparente guardado en: {save_path}")
         return save_path
     except Exception as e:
@@ -248,12 +260,34 @@ def export_transparent_object():
         return None
 
 
+def export_spec(filename, *control_values):
+    """
+    Guarda los controles actuales como especificación JSON, la misma que acepta
+    'python -m processing.batch --spec' para procesar un directorio entero.
+    """
+    params = build_params(*control_values[:-1]) # El último valor es el estado de la sesión
+    params.pop("image_dir")
+    try:
+        fd, save_path = tempfile.mkstemp(prefix="especificacion_", suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(dump_spec(params, spec_from_params(params)))
+        return save_path
+    except Exception as e:
+        print(f"ERROR al exportar la especificación: {e}")
+        return None
+
+
 def main_interface():
+    # Gradio sólo se importa al construir la interfaz: el resto del módulo (y
+    # processing/) se puede importar sin él, p. ej. en lotes o en pruebas
+    import gradio as gr
+
     image_list = list_images()
     bg_list = list_backgrounds()
 
     with gr.Blocks() as demo:
         gr.Markdown("## 🖼️ Aplicación Completa de Procesamiento de Imágenes")
+        session_state = gr.State(new_session_state()) # Estado propio de cada sesión
 
         with gr.Row():
             with gr.Column():
@@ -277,11 +311,12 @@ def main_interface():
                     bitwise_op = gr.Radio(["None", "AND", "OR", "NOT"], label="Operación bitwise", value="None")
 
                 with gr.Accordion("Eliminación y Cambio de Fondo", open=True):
-                    background_removal_method = gr.Radio(["None", "HSV", "LAB", "GrabCut"], label="Eliminación de fondo", value="None")
+                    background_removal_method = gr.Radio(["None", "HSV", "LAB", "HSV (auto)", "LAB (auto)", "GrabCut", "GrabCut (multiescala)"], label="Eliminación de fondo", value="None")
                     
                     change_bg_mode = gr.Radio(["None", "Color", "Image"], label="Cambio de fondo", value="None")
                     bg_color = gr.ColorPicker(label="Color fondo")
                     bg_image_name = gr.Dropdown(label="Imagen fondo (cambio)", choices=bg_list, visible=False) # Este es el dropdown que se muestra/oculta
+                    bg_feather = gr.Slider(0, 25, value=0, step=1, label="Suavizado del borde (px)")
 
                 with gr.Accordion("Collage y Detección", open=True): # Abrir por defecto para que sea visible
                     collage_mode = gr.Radio([
@@ -295,22 +330,31 @@ def main_interface():
                     detect_faces_flag = gr.Checkbox(label="Detectar rostros (Haar cascades)")
 
                 process_button = gr.Button("Procesar Imagen")
-                download_btn = gr.Button("Descargar recorte PNG transparente")
+                with gr.Accordion("Exportación del recorte transparente", open=False):
+                    export_format = gr.Radio(["PNG", "WebP"], label="Formato (WebP sin pérdida)", value="PNG")
+                    export_crop = gr.Checkbox(label="Recortar al objeto")
+                    png_compression = gr.Slider(0, 9, value=export.DEFAULT_PNG_COMPRESSION, step=1, label="Compresión PNG")
+                download_btn = gr.Button("Descargar recorte transparente")
+                spec_btn = gr.Button("Exportar especificación (JSON para lotes)")
 
 
             with gr.Column():
                 output_original = gr.Image(label="Imagen Original", type="numpy", height=400) # Re-añadido
                 output_image = gr.Image(label="Resultado", type="numpy", height=400)
                 mask_display = gr.Image(label="Máscara de Primer Plano (Objeto Blanco, Fondo Negro)", type="numpy", height=200)
-                download_file_output = gr.File(label="Objeto Recortado (PNG Transparente)", file_count="single", visible=False)
+                download_file_output = gr.File(label="Objeto Recortado (Transparente)", file_count="single", visible=False)
+                spec_file_output = gr.File(label="Especificación del pipeline (JSON)", file_count="single", visible=False)
+                # Tiempos por etapa, sólo con la instrumentación activa (PIPELINE_METRICS=1)
+                metrics_display = gr.Markdown(visible=instrumentation.enabled)
 
 
         inputs = [
             image_selector, color_space, rotate_angle, flip_mode, brightness, contrast, gamma,
             filter_type, threshold_type, threshold_value, bitwise_op, background_removal_method,
-            change_bg_mode, bg_color, bg_image_name, collage_mode,
-            detect_contours_flag, detect_faces_flag
+            change_bg_mode, bg_color, bg_image_name, bg_feather, collage_mode,
+            detect_contours_flag, detect_faces_flag, session_state
         ]
+        outputs = [output_original, output_image, mask_display, session_state]
 
         # Lógica para mostrar/ocultar el selector de imagen de fondo
         def toggle_bg_image_selector(change_bg):
@@ -318,25 +362,56 @@ def main_interface():
 
         change_bg_mode.change(fn=toggle_bg_image_selector, inputs=change_bg_mode, outputs=bg_image_name)
 
-        # Conectar el botón de procesar a la función principal
-        process_button.click(
+        # Los cambios de los inputs muestran una vista previa a resolución reducida
+        # y, si los controles quedan quietos, el resultado a resolución completa
+        # (render_if_idle). Cada cambio se anota primero fuera de la cola
+        # (request_preview) para que las vistas previas superadas que aún esperan
+        # turno se descarten sin ocupar a un worker; Gradio sólo cancela las que
+        # ya se están ejecutando.
+        for inp in inputs[:-1]: # El estado de sesión no tiene evento .change
+            inp.change(fn=request_preview, inputs=session_state, outputs=None, queue=False)
+
+        preview_events = []
+        idle_events = []
+        for inp in inputs[:-1]:
+            preview_event = inp.change(
+                fn=process_preview,
+                inputs=inputs,
+                outputs=outputs
+            )
+            preview_events.append(preview_event)
+            idle_events.append(preview_event.then(
+                fn=render_if_idle,
+                inputs=inputs,
+                outputs=outputs
+            ))
+
+        # Cualquier cambio nuevo cancela las vistas previas y los renderizados
+        # completos que se estén ejecutando
+        for inp in inputs[:-1]:
+            inp.change(fn=None, inputs=None, outputs=None, cancels=preview_events + idle_events)
+
+        # El botón de procesar calcula la resolución completa y cancela las vistas previas pendientes
+        process_event = process_button.click(
             fn=process_all,
             inputs=inputs,
-            outputs=[output_original, output_image, mask_display] # Actualizados los outputs
+            outputs=outputs,
+            cancels=preview_events + idle_events
         )
+        events = preview_events + idle_events + [process_event]
 
-        # Conectar los cambios de los inputs a la función principal para actualización en tiempo real
-        for inp in inputs:
-            inp.change(
-                fn=process_all, # Ahora llama a process_all directamente
-                inputs=inputs,
-                outputs=[output_original, output_image, mask_display] # Actualizados los outputs
-            )
+        if instrumentation.enabled:
+            for event in events:
+                event.then(
+                    lambda state: instrumentation.format_records(state["metrics"]),
+                    inputs=session_state,
+                    outputs=metrics_display
+                )
 
         # Lógica para la descarga del objeto transparente
         download_btn.click(
             fn=export_transparent_object,
-            inputs=[],
+            inputs=[session_state, export_format, export_crop, png_compression],
             outputs=download_file_output
         ).then(
             lambda file_path: gr.update(visible=file_path is not None),
@@ -344,6 +419,17 @@ def main_interface():
             outputs=download_file_output
         )
 
+        # Exportar los controles actuales como especificación para processing.batch
+        spec_btn.click(
+            fn=export_spec,
+            inputs=inputs,
+            outputs=spec_file_output
+        ).then(
+            lambda file_path: gr.update(visible=file_path is not None),
+            inputs=spec_file_output,
+            outputs=spec_file_output
+        )
+
     return demo
 
 if __name__ == "__main__":
@@ -355,8 +441,26 @@ if __name__ == "__main__":
         print(f"Advertencia: No se encontraron imágenes en el directorio '{BACKGROUND_DIR}'.")
         print("Por favor, añade algunas imágenes de fondo a esta carpeta si planeas usar la función de cambio de fondo por imagen.")
 
+    if USE_FRAME_STORE:
+        frame_store.use_store(IMAGE_DIR)
+        frame_store.use_store(BACKGROUND_DIR)
+    if RESULT_CACHE_DIR:
+        disk_cache.use_cache(RESULT_CACHE_DIR, RESULT_CACHE_BYTES)
+        print(f"Caché de resultados en disco: {RESULT_CACHE_DIR}")
+    if PREWARM_BACKGROUNDS:
+        prewarm_background_cache()
+    if WORKER_PROCESSES:
+        workers.start_pool(WORKER_PROCESSES, max_pending=2 * CONCURRENCY_COUNT, timeout=WORKER_TIMEOUT)
+        print(f"Pool de {WORKER_PROCESSES} procesos para las etapas pesadas.")
+    if instrumentation.enabled:
+        logging.basicConfig(level=logging.INFO, format="%(message)s") # Una línea JSON por ejecución
+    if instrumentation.enabled and METRICS_PORT:
+        instrumentation.serve_metrics(METRICS_PORT)
+        print(f"Métricas del pipeline en http://127.0.0.1:{METRICS_PORT}/metrics")
+
     try:
         demo = main_interface()
+        demo.queue(concurrency_count=CONCURRENCY_COUNT)
         demo.launch()
         print("\n¡Aplicación Gradio lanzada exitosamente!")
         print("Accede a ella en tu navegador usando la URL que aparece arriba (normalmente http://127.0.0.1:7860).")
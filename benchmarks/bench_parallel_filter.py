@@ -0,0 +1,63 @@
+"""
+Escalado de enhancements.apply_filter por bandas de filas con 1..N hilos.
+
+Durante la medición el pool de hilos interno de OpenCV se limita a uno
+(cv2.setNumThreads(1)): así "1 hilo" es de verdad un hilo y las bandas no
+compiten con los hilos de OpenCV. Al terminar se restaura.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.bench_parallel_filter [--megapixels 24] [--max-workers 8] [--repeat 3]
+"""
+import argparse
+import os
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.run_benchmarks import synthetic_image
+from processing.enhancements import apply_filter, FILTER_HALO
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--filters", nargs="*", default=["bilateral", "median", "gaussian", "sharpen"])
+    args = parser.parse_args(argv)
+
+    image = synthetic_image(args.megapixels)
+    print(f"Imagen {image.shape[1]}x{image.shape[0]}, {os.cpu_count()} CPUs")
+    worker_counts = sorted({1, 2, 4, 8, 16, 32, args.max_workers} & set(range(1, args.max_workers + 1)))
+
+    opencv_threads = cv2.getNumThreads()
+    cv2.setNumThreads(1)
+    try:
+        for filter_type in args.filters:
+            if FILTER_HALO.get(filter_type) is None:
+                print(f"{filter_type}: no se puede paralelizar por bandas, se omite")
+                continue
+            reference = apply_filter(image, filter_type)
+            base = best_time(lambda: apply_filter(image, filter_type), args.repeat)
+            row = [f"{filter_type:10s} 1 hilo {base:7.3f}s"]
+            for workers in worker_counts[1:]:
+                assert np.array_equal(apply_filter(image, filter_type, workers=workers), reference)
+                elapsed = best_time(lambda: apply_filter(image, filter_type, workers=workers), args.repeat)
+                row.append(f"{workers} hilos {elapsed:7.3f}s (x{base / elapsed:.2f})")
+            print(" | ".join(row))
+    finally:
+        cv2.setNumThreads(opencv_threads)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Presupuesto de arranque: mide con `python -X importtime` lo que cuesta importar
+la aplicación y los módulos de processing/ en un intérprete nuevo, y falla si
+alguno supera su presupuesto o arrastra módulos que deberían cargarse sólo al
+usarse (Gradio, http.server, multiprocessing).
+
+Cada módulo se mide en un proceso aparte (sin cachés de importación calientes
+salvo los .pyc) y se toma el mínimo de --repeat ejecuciones.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.check_startup
+    python -m benchmarks.check_startup --scale 2 --output arranque.json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+# Presupuesto en segundos del import acumulado de cada módulo (cv2 y numpy
+# suponen la mayor parte); --scale lo ajusta a máquinas más lentas
+BUDGETS = {
+    "processing.pipeline": 0.40,
+    "processing.batch": 0.45,
+    "processing.video": 0.40,
+    "app": 0.50,
+}
+
+# Módulos que ninguno de los anteriores debe importar al arrancar, salvo las
+# excepciones de ALLOWED (los lotes usan siempre un ProcessPoolExecutor)
+LAZY_MODULES = ("gradio", "http.server", "multiprocessing")
+ALLOWED = {"processing.batch": ("multiprocessing",)}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s*(\S+)")
+
+
+def measure(module):
+    """
+    Importa `module` en un intérprete nuevo con -X importtime.
+    Returns:
+        tuple: (segundos acumulados del import, módulos de LAZY_MODULES cargados,
+                [(módulo, segundos acumulados)] de las dependencias más caras)
+    """
+    code = (f"import sys, {module}\n"
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                               capture_output=True, text=True, check=True)
+    timings = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            timings[match.group(3)] = int(match.group(2)) / 1e6
+    loaded = [name for name in completed.stdout.strip().split(",") if name and name not in ALLOWED.get(module, ())]
+    heaviest = sorted(timings.items(), key=lambda item: item[1], reverse=True)[1:6]
+    return timings.get(module, 0.0), loaded, heaviest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Comprueba el tiempo de importación frente a un presupuesto.")
+    parser.add_argument("--repeat", type=int, default=3, help="Ejecuciones por módulo (se toma el mínimo)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplicador de los presupuestos")
+    parser.add_argument("--output", help="Archivo JSON donde guardar las mediciones")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    report = {}
+    for module, budget in BUDGETS.items():
+        budget *= args.scale
+        runs = [measure(module) for _ in range(args.repeat)]
+        seconds = min(run[0] for run in runs)
+        loaded, heaviest = runs[-1][1], runs[-1][2]
+        ok = seconds <= budget and not loaded
+        failures += not ok
+        report[module] = {"seconds": seconds, "budget": budget, "lazy_modules_loaded": loaded}
+        print(f"{'OK   ' if ok else 'FALLO'} {module:<22} {seconds * 1000:7.1f} ms (presupuesto {budget * 1000:.0f} ms)")
+        if loaded:
+            print(f"      importa al arrancar: {', '.join(loaded)}")
+        if seconds > budget:
+            print("      más caros: " + ", ".join(f"{name} {secs * 1000:.0f} ms" for name, secs in heaviest))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Mediciones guardadas en {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+Benchmarks de las funciones públicas de processing/ y del pipeline completo.
+
+Cada caso se ejecuta sobre imágenes sintéticas de varios tamaños y se mide:
+- tiempo de pared (mínimo y mediana de --repeat ejecuciones),
+- pico de memoria y memoria retenida según tracemalloc en una ejecución aparte
+  (incluye los arrays de NumPy que devuelve OpenCV; no los buffers internos de OpenCV),
+- asignaciones: bloques de memoria que siguen vivos tras la ejecución y, en los casos
+  del pipeline, bytes reservados por cada etapa (instrumentation con memory=True).
+  tracemalloc no cuenta las asignaciones transitorias, sólo su efecto en el pico.
+
+Los casos del pipeline vacían las cachés (imágenes decodificadas y etapas) antes de
+cada ejecución: todas las repeticiones miden una carga en frío.
+
+Uso (desde la raíz del repositorio):
+    python -m benchmarks.run_benchmarks --sizes 0.3 2 12 50 --output resultados.json
+    python -m benchmarks.run_benchmarks --compare base.json --output nuevo.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from processing.background_change import change_background_color, change_background_image, composite
+from processing.background_removal import (
+    remove_background_hsv, remove_background_lab, remove_background_auto, grabcut, grabcut_multiscale,
+    segment_batch
+)
+from processing.collage import stack_images
+from processing.color_operations import convert_color
+from processing.corrections import (
+    rotate, flip, adjust_brightness_contrast, gamma_correction, equalize_histogram, apply_point_ops
+)
+from processing.detection import detect_contours, detect_faces_haar
+from processing.enhancements import apply_filter, FILTER_HALO
+from processing.masks import (
+    apply_threshold, adaptive_threshold, otsu_threshold, bitwise_and, bitwise_or, bitwise_not
+)
+from processing import instrumentation
+from processing.cache import image_cache, background_cache, preview_cache
+from processing.pipeline import run_pipeline, stage_cache
+
+DEFAULT_SIZES = [0.3, 2, 12, 50]
+
+# Casos muy lentos: sólo se ejecutan hasta este tamaño salvo con --no-limits
+SLOW_MAX_MEGAPIXELS = 2
+
+
+def synthetic_image(megapixels, seed=0):
+    """Imagen BGR de ~`megapixels` MP: fondo verde con degradado, un objeto elíptico y ruido."""
+    height = int((megapixels * 1e6 / 1.5) ** 0.5)
+    width = int(height * 1.5)
+    image = np.empty((height, width, 3), np.uint8)
+    image[:] = (40, 180, 60)
+    image[..., 1] = np.linspace(140, 220, width, dtype=np.uint8)[None, :]
+    cv2.ellipse(image, (width // 2, height // 2), (width // 5, height // 3), 0, 0, 360, (30, 60, 200), -1)
+    noise = np.random.default_rng(seed).integers(0, 16, (height, width, 3), dtype=np.uint8)
+    cv2.add(image, noise, dst=image)
+    return image
+
+
+def thumbnail_stack(image, count=64, side=128):
+    """Pila (count, side, side, 3) de miniaturas de la imagen, como un lote de fotos de producto."""
+    thumbnail = cv2.resize(image, (side, side), interpolation=cv2.INTER_AREA)
+    return np.repeat(thumbnail[None], count, axis=0)
+
+
+def foreground_mask(image):
+    return remove_background_hsv(image)[1]
+
+
+class Case:
+    """
+    - before: función sin argumentos que se llama antes de cada ejecución, fuera
+      del tiempo medido (p. ej. para vaciar cachés).
+    - pipeline: func acepta records=lista para los registros por etapa.
+    """
+
+    def __init__(self, name, setup, func, slow=False, before=None, pipeline=False):
+        self.name = name
+        self.setup = setup  # imagen -> argumentos
+        self.func = func
+        self.slow = slow
+        self.before = before
+        self.pipeline = pipeline
+
+
+def clear_caches():
+    for cache in (image_cache, background_cache, preview_cache, stage_cache):
+        cache.clear()
+
+
+def build_cases(work_dir):
+    cases = []
+    same = lambda image: (image,)
+    with_mask = lambda image: (image, foreground_mask(image))
+    gray = lambda image: (cv2.cvtColor(image, cv2.COLOR_BGR2GRAY),)
+
+    for filter_type in FILTER_HALO:
+        cases.append(Case(f"apply_filter[{filter_type}]", same,
+                          lambda image, f=filter_type: apply_filter(image, f),
+                          slow=filter_type == "bilateral"))
+    for color_space in ["HSV", "LAB", "GRAYSCALE"]:
+        cases.append(Case(f"convert_color[{color_space}]", same, lambda image, c=color_space: convert_color(image, c)))
+    cases += [
+        Case("rotate", same, lambda image: rotate(image, 30)),
+        Case("flip", same, lambda image: flip(image, "horizontal")),
+        Case("adjust_brightness_contrast", same, lambda image: adjust_brightness_contrast(image, 30, 20)),
+        Case("gamma_correction", same, lambda image: gamma_correction(image, 1.5)),
+        Case("apply_point_ops", same, lambda image: apply_point_ops(
+            image, (("brightness_contrast", (30, 20)), ("gamma", (1.5,)), ("invert", ())))),
+        Case("equalize_histogram", same, equalize_histogram),
+        Case("apply_threshold", gray, lambda image: apply_threshold(image, 128)),
+        Case("adaptive_threshold", gray, adaptive_threshold),
+        Case("otsu_threshold", gray, otsu_threshold),
+        Case("bitwise_and", lambda image: (image, image), bitwise_and),
+        Case("bitwise_or", lambda image: (image, image), bitwise_or),
+        Case("bitwise_not", same, bitwise_not),
+        Case("remove_background_hsv", same, remove_background_hsv),
+        Case("remove_background_lab", same, remove_background_lab),
+        Case("remove_background_auto[HSV]", same, lambda image: remove_background_auto(image, "HSV")),
+        Case("remove_background_auto[LAB]", same, lambda image: remove_background_auto(image, "LAB")),
+        Case("segment_batch[64 miniaturas]", lambda image: (thumbnail_stack(image),), segment_batch),
+        Case("remove_background_hsv[64 miniaturas]", lambda image: (thumbnail_stack(image),),
+             lambda stack: [remove_background_hsv(thumbnail) for thumbnail in stack]),
+        Case("grabcut", same, grabcut, slow=True),
+        Case("grabcut_multiscale", same, grabcut_multiscale),
+        Case("change_background_color", with_mask, lambda image, mask: change_background_color(image, mask, (255, 255, 255))),
+        Case("change_background_image", lambda image: (image, foreground_mask(image), image[::2, ::2].copy()),
+             change_background_image),
+        Case("composite[soft]", with_mask, lambda image, mask: composite(image, mask, (255, 255, 255), soft=True)),
+        Case("stack_images", lambda image: ([image, image, image, image],), lambda images: stack_images(images, cols=2)),
+        Case("detect_contours", lambda image: (image.copy(),), detect_contours),
+        Case("detect_faces_haar", lambda image: (image.copy(),), detect_faces_haar, slow=True),
+    ]
+
+    def pipeline_setup(image):
+        path = os.path.join(work_dir, f"bench_{image.shape[1]}x{image.shape[0]}.png")
+        if not os.path.exists(path):
+            cv2.imwrite(path, image)
+        return (os.path.basename(path),)
+
+    def pipeline(filename, records=None, **params):
+        params = dict(params, image_dir=work_dir)
+        return run_pipeline(filename, params, records=records)
+
+    def pipeline_case(name, **params):
+        return Case(name, pipeline_setup, lambda filename, records=None: pipeline(filename, records, **params),
+                    before=clear_caches, pipeline=True)
+
+    cases += [
+        pipeline_case("process_all[default]"),
+        pipeline_case("process_all[hsv+color+filters]", background_removal_method="HSV", change_bg_mode="Color",
+                      bg_color="#ffffff", brightness=20, contrast=10, gamma=1.2, filter_type="gaussian",
+                      detect_contours_flag=True),
+        pipeline_case("process_all[hsv auto+color]", background_removal_method="HSV (auto)",
+                      change_bg_mode="Color", bg_color="#ffffff"),
+    ]
+    return cases
+
+
+def stage_allocations(case, args_):
+    """Bytes reservados por cada etapa en una ejecución instrumentada del pipeline."""
+    previous = (instrumentation.enabled, instrumentation.track_memory)
+    records = []
+    if case.before:
+        case.before()
+    instrumentation.enable(memory=True)
+    try:
+        case.func(*args_, records=records)
+    finally:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        instrumentation.enabled, instrumentation.track_memory = previous
+    return {record["stage"]: record["allocated_bytes"] for record in records}
+
+
+def measure(case, args_, repeat):
+    times = []
+    for _ in range(repeat):
+        if case.before:
+            case.before()
+        start = time.perf_counter()
+        case.func(*args_)
+        times.append(time.perf_counter() - start)
+
+    if case.before:
+        case.before()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    before = tracemalloc.take_snapshot()
+    result = case.func(*args_)
+    current, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    entry = {
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "repeat": repeat,
+        "peak_bytes": peak - baseline,
+        "retained_bytes": current - baseline,
+        "retained_blocks": sum(max(0, stat.count_diff) for stat in after.compare_to(before, "lineno")),
+    }
+    if case.pipeline:
+        entry["stage_allocated_bytes"] = stage_allocations(case, args_)
+    return entry
+
+
+def run(sizes, repeat, only=None, no_limits=False, progress=print):
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        cases = build_cases(work_dir)
+        if only:
+            cases = [case for case in cases if re.search(only, case.name)]
+        for megapixels in sizes:
+            image = synthetic_image(megapixels)
+            for case in cases:
+                if case.slow and megapixels > SLOW_MAX_MEGAPIXELS and not no_limits:
+                    continue
+                entry = {"name": case.name, "megapixels": megapixels, "shape": list(image.shape)}
+                try:
+                    entry.update(measure(case, case.setup(image), repeat))
+                except Exception as e:
+                    entry["error"] = str(e)
+                results.append(entry)
+                if progress:
+                    progress(format_entry(entry))
+    return results
+
+
+def format_entry(entry):
+    label = f"{entry['name']:36s} {entry['megapixels']:>5} MP"
+    if "error" in entry:
+        return f"{label}  ERROR: {entry['error']}"
+    return (f"{label}  {entry['min_s'] * 1000:10.2f} ms (mediana {entry['median_s'] * 1000:.2f})"
+            f"  pico {entry['peak_bytes'] / 2**20:8.1f} MiB  bloques {entry['retained_blocks']}")
+
+
+def metadata():
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+
+def compare(old_results, new_results, threshold):
+    """Imprime la comparación con una ejecución anterior y devuelve el número de regresiones."""
+    old = {(r["name"], r["megapixels"]): r for r in old_results if "error" not in r}
+    regressions = 0
+    for entry in new_results:
+        previous = old.get((entry["name"], entry["megapixels"]))
+        if previous is None or "error" in entry:
+            continue
+        ratio = entry["min_s"] / previous["min_s"] if previous["min_s"] else float("inf")
+        memory_ratio = (entry["peak_bytes"] / previous["peak_bytes"]) if previous["peak_bytes"] else 1.0
+        flag = ""
+        if ratio > 1 + threshold or memory_ratio > 1 + threshold:
+            flag = "  <-- REGRESIÓN"
+            regressions += 1
+        print(f"{entry['name']:36s} {entry['megapixels']:>5} MP  tiempo x{ratio:.2f}  memoria x{memory_ratio:.2f}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de processing/ sobre imágenes sintéticas.")
+    parser.add_argument("--sizes", type=float, nargs="+", default=DEFAULT_SIZES, help="Tamaños en megapíxeles")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones para medir el tiempo")
+    parser.add_argument("--only", help="Expresión regular para filtrar casos por nombre")
+    parser.add_argument("--no-limits", action="store_true", help=f"Ejecutar los casos lentos también por encima de {SLOW_MAX_MEGAPIXELS} MP")
+    parser.add_argument("--output", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Empeoramiento relativo considerado regresión (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.only, args.no_limits)
+    document = {"meta": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(document, f, indent=2)
+        print(f"Resultados guardados en {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+        regressions = compare(previous["results"], results, args.threshold)
+        print(f"{regressions} regresiones (umbral {args.threshold:.0%}).")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
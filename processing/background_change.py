@@ -1,44 +1,90 @@
 import cv2
 import numpy as np
 
-def change_background_color(image, foreground_mask, bg_color):
+# Filas por bloque al mezclar con máscaras suaves: acota los temporales de 16 bits
+BLEND_ROWS = 256
+
+
+def feather_mask(foreground_mask, radius):
+    """
+    Suaviza el borde de una máscara binaria para obtener una máscara alfa (0-255).
+    - radius: radio del difuminado en px (0 = sin suavizado).
+    """
+    if radius <= 0:
+        return foreground_mask
+    ksize = 2 * int(radius) + 1
+    return cv2.GaussianBlur(foreground_mask, (ksize, ksize), 0)
+
+
+def composite(image, foreground_mask, background, out=None, soft=False):
+    """
+    Compone el objeto de `image` sobre un fondo escribiendo directamente en `out`,
+    sin crear imágenes intermedias del tamaño completo.
+    - image: imagen BGR original.
+    - foreground_mask: máscara de un canal donde el objeto es 255 y el fondo 0.
+      Con soft=False se binariza con umbral 127; con soft=True se usa como alfa (0-255).
+    - background: imagen BGR del mismo tamaño que `image` o color BGR (tupla).
+    - out: buffer de salida preasignado (mismo tamaño y tipo que `image`); si es None se crea uno.
+    """
+    if out is None:
+        out = np.empty_like(image)
+    is_color = not isinstance(background, np.ndarray)
+
+    if soft:
+        # En imágenes de 16 bits el producto por alfa no cabe en 16 bits
+        work = np.uint32 if image.dtype == np.uint16 else np.uint16
+        if is_color:
+            background = np.array(background, dtype=work).reshape(1, 1, -1)
+        # Mezcla entera por bloques de filas: out = (img*a + bg*(255-a) + 127) / 255
+        for r0 in range(0, image.shape[0], BLEND_ROWS):
+            r1 = r0 + BLEND_ROWS
+            alpha = foreground_mask[r0:r1, :, None].astype(work)
+            bg = background if is_color else background[r0:r1].astype(work)
+            blended = image[r0:r1].astype(work) * alpha
+            blended += bg * (255 - alpha)
+            blended += 127
+            blended //= 255
+            out[r0:r1] = blended
+        return out
+
+    if is_color:
+        out[:] = background
+    else:
+        np.copyto(out, background)
+    _, binary_mask = cv2.threshold(foreground_mask, 127, 255, cv2.THRESH_BINARY)
+    cv2.copyTo(image, binary_mask, out) # Copia el objeto sólo donde la máscara es 255
+    return out
+
+
+def change_background_color(image, foreground_mask, bg_color, out=None, feather=0):
     """
     Cambia el fondo a un color sólido.
     - image: imagen BGR original.
     - foreground_mask: máscara binaria donde el objeto es 255 y el fondo es 0.
     - bg_color: tupla BGR, ejemplo (0,0,255) rojo.
+    - out: buffer de salida opcional (ver composite).
+    - feather: radio en px para suavizar el borde del objeto (0 = borde duro).
     """
     if image is None or foreground_mask is None or bg_color is None:
         return image
 
-    # Asegurarse de que la máscara sea binaria (0 o 255) y de un solo canal
+    # Asegurarse de que la máscara sea de un solo canal
     if len(foreground_mask.shape) == 3:
         foreground_mask = cv2.cvtColor(foreground_mask, cv2.COLOR_BGR2GRAY)
-    _, foreground_mask = cv2.threshold(foreground_mask, 127, 255, cv2.THRESH_BINARY)
-
-    # Obtener la máscara del fondo (donde el fondo es 255 y el objeto es 0)
-    background_mask = cv2.bitwise_not(foreground_mask)
-
-    # Crear una imagen con el nuevo color de fondo del mismo tamaño que la imagen original
-    new_bg_image = np.full(image.shape, bg_color, dtype=np.uint8)
 
-    # Extraer el objeto de la imagen original usando la máscara del primer plano
-    object_extracted = cv2.bitwise_and(image, image, mask=foreground_mask)
+    if feather > 0:
+        return composite(image, feather_mask(foreground_mask, feather), tuple(bg_color), out, soft=True)
+    return composite(image, foreground_mask, tuple(bg_color), out)
 
-    # Extraer la parte del nuevo fondo que estará en el área del fondo original
-    new_background_area = cv2.bitwise_and(new_bg_image, new_bg_image, mask=background_mask)
 
-    # Combinar el objeto extraído con el nuevo fondo
-    result = cv2.add(object_extracted, new_background_area)
-    return result
-
-
-def change_background_image(image, foreground_mask, new_background):
+def change_background_image(image, foreground_mask, new_background, out=None, feather=0):
     """
     Cambia el fondo a una imagen.
     - image: imagen original BGR.
     - foreground_mask: máscara binaria donde el objeto es 255 y el fondo es 0.
     - new_background: imagen BGR para el nuevo fondo.
+    - out: buffer de salida opcional (ver composite).
+    - feather: radio en px para suavizar el borde del objeto (0 = borde duro).
     """
     if image is None or foreground_mask is None or new_background is None:
         return image
@@ -47,20 +93,10 @@ def change_background_image(image, foreground_mask, new_background):
     if new_background.shape[:2] != image.shape[:2]:
         new_background = cv2.resize(new_background, (image.shape[1], image.shape[0]))
 
-    # Asegurarse de que la máscara sea binaria (0 o 255) y de un solo canal
+    # Asegurarse de que la máscara sea de un solo canal
     if len(foreground_mask.shape) == 3:
         foreground_mask = cv2.cvtColor(foreground_mask, cv2.COLOR_BGR2GRAY)
-    _, foreground_mask = cv2.threshold(foreground_mask, 127, 255, cv2.THRESH_BINARY)
-
-    # Obtener la máscara del fondo (donde el fondo es 255 y el objeto es 0)
-    background_mask = cv2.bitwise_not(foreground_mask)
-
-    # Extraer el objeto de la imagen original usando la máscara del primer plano
-    object_extracted = cv2.bitwise_and(image, image, mask=foreground_mask)
-
-    # Extraer la parte de la imagen de fondo que estará en el área del fondo original
-    new_background_area = cv2.bitwise_and(new_background, new_background, mask=background_mask)
 
-    # Combinar el objeto extraído con el nuevo fondo
-    result = cv2.add(object_extracted, new_background_area)
-    return result
+    if feather > 0:
+        return composite(image, feather_mask(foreground_mask, feather), new_background, out, soft=True)
+    return composite(image, foreground_mask, new_background, out)
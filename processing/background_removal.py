@@ -1,6 +1,202 @@
+import time
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
+from processing.color_operations import as_stack, convert_color_batch
+
+# Rangos predeterminados del fondo (verde) para cada espacio de color
+DEFAULT_RANGES = {
+    "HSV": ((35, 40, 40), (85, 255, 255)),
+    "LAB": ((20, 120, 120), (255, 140, 140)),
+}
+
+
+# Estimación automática: margen añadido a cada extremo del rango estimado, por canal
+AUTO_RANGE_MARGIN = {
+    "HSV": (4, 20, 20),
+    "LAB": (10, 8, 8),
+}
+HUE_BINS = 180 # El tono de OpenCV va de 0 a 179 y es circular
+# Sólo cuentan como fondo las muestras del pico principal de cada canal: lo que
+# queda por debajo de esta fracción de la moda es del objeto que toca el borde
+PEAK_FRACTION = 0.05
+PEAK_SMOOTHING = 5 # Ancho (bins) del suavizado del histograma antes de buscar el pico
+
+
+@lru_cache(maxsize=64)
+def _bounds(values):
+    """Array de límites para cv2.inRange, creado una vez por rango."""
+    array = np.array(values)
+    array.flags.writeable = False
+    return array
+
+
+def _in_range(converted, color_space, lower, upper, dst=None):
+    """
+    cv2.inRange con los límites cacheados. En HSV, si el tono inferior es mayor
+    que el superior el rango da la vuelta (p. ej. rojos: 170..10).
+    """
+    lower, upper = tuple(lower), tuple(upper)
+    if color_space != "HSV" or lower[0] <= upper[0]:
+        return cv2.inRange(converted, _bounds(lower), _bounds(upper), dst=dst)
+    high = cv2.inRange(converted, _bounds(lower), _bounds((HUE_BINS - 1,) + upper[1:]))
+    low = cv2.inRange(converted, _bounds((0,) + lower[1:]), _bounds(upper))
+    return cv2.bitwise_or(high, low, dst=dst)
+
+
+def _border_pixels(image, border, max_samples):
+    """
+    Píxeles de una franja del borde de la imagen (fracción `border` de cada lado),
+    submuestreados con un paso fijo hasta unas `max_samples` muestras, como (K, 1, 3).
+    """
+    h, w = image.shape[:2]
+    bh, bw = max(1, int(h * border)), max(1, int(w * border))
+    strips = [image[:bh], image[h - bh:], image[bh:h - bh, :bw], image[bh:h - bh, w - bw:]]
+    total = sum(strip.shape[0] * strip.shape[1] for strip in strips)
+    step = max(1, int(np.sqrt(total / max_samples)))
+    samples = [strip[::step, ::step].reshape(-1, 3) for strip in strips if strip.size]
+    return np.ascontiguousarray(np.concatenate(samples)[:, None, :])
+
+
+def _percentile_range(values, bins, low_pct, high_pct):
+    """Percentiles de un canal uint8 a partir de su histograma (sin ordenar las muestras)."""
+    cumulative = np.cumsum(np.bincount(values, minlength=bins))
+    total = cumulative[-1]
+    low = int(np.searchsorted(cumulative, total * low_pct / 100.0))
+    high = int(np.searchsorted(cumulative, total * high_pct / 100.0))
+    return low, high
+
+
+def _hue_range(hue, low_pct, high_pct, margin):
+    """
+    Rango de tono teniendo en cuenta que es circular: se gira el histograma para
+    que el mayor hueco sin muestras quede en el corte 179/0, se calculan los
+    percentiles y se deshace el giro. Devuelve (inferior, superior), que puede
+    dar la vuelta (inferior > superior).
+    """
+    histogram = np.bincount(hue, minlength=HUE_BINS)
+    if histogram.all():
+        best_start, best_length = int(np.argmin(histogram)), 1 # Sin huecos: el tono menos frecuente
+    else:
+        best_start, best_length, run = 0, 0, 0
+        for i, is_empty in enumerate(np.concatenate([histogram == 0, histogram == 0])): # Dos vueltas: huecos que cruzan el 0
+            run = run + 1 if is_empty else 0
+            if run > best_length:
+                best_start, best_length = i - run + 1, min(run, HUE_BINS)
+    shift = (best_start + best_length // 2) % HUE_BINS # El centro del hueco pasa a ser el 0
+
+    rotated = ((hue.astype(np.int32) - shift) % HUE_BINS).astype(np.uint8)
+    low, high = _percentile_range(rotated, HUE_BINS, low_pct, high_pct)
+    low, high = max(0, low - margin), min(HUE_BINS - 1, high + margin)
+    if high - low >= HUE_BINS - 1:
+        return 0, HUE_BINS - 1 # El fondo tiene todos los tonos
+    return (low + shift) % HUE_BINS, (high + shift) % HUE_BINS
+
+
+def _peak_interval(values, bins, circular, fraction):
+    """
+    Intervalo (inferior, superior) del pico principal del histograma de un canal:
+    desde la moda se amplía mientras el histograma suavizado no baje de `fraction`
+    veces el máximo. En un canal circular el intervalo puede dar la vuelta.
+    """
+    histogram = np.bincount(values, minlength=bins).astype(np.float64)
+    kernel = np.ones(PEAK_SMOOTHING) / PEAK_SMOOTHING
+    if circular:
+        pad = PEAK_SMOOTHING // 2
+        smoothed = np.convolve(np.concatenate([histogram[-pad:], histogram, histogram[:pad]]), kernel, "valid")
+    else:
+        smoothed = np.convolve(histogram, kernel, "same")
+    peak = int(np.argmax(smoothed))
+    floor = smoothed[peak] * fraction
+    low = high = peak
+    for _ in range(bins - 1):
+        if not circular and low == 0:
+            break
+        if smoothed[(low - 1) % bins] < floor:
+            break
+        low -= 1
+    for _ in range(bins - 1 - (peak - low)):
+        if not circular and high == bins - 1:
+            break
+        if smoothed[(high + 1) % bins] < floor:
+            break
+        high += 1
+    if high - low >= bins - 1:
+        return 0, bins - 1
+    return low % bins, high % bins
+
+
+def _in_interval(values, low, high):
+    if low <= high:
+        return (values >= low) & (values <= high)
+    return (values >= low) | (values <= high) # Intervalo circular que da la vuelta
+
+
+def estimate_background_range(image, color_space="HSV", border=0.05, max_samples=20000,
+                              low_pct=2, high_pct=98, margin=None):
+    """
+    Estima el rango de color del fondo a partir de una franja del borde de la
+    imagen (donde en una foto de estudio casi todo es fondo).
+    El objeto puede tocar el borde (p. ej. una persona cortada por abajo): sólo
+    se usan las muestras que caen en el pico principal del histograma de los tres
+    canales, y el rango se calcula con los percentiles de esas muestras.
+    Args:
+        image (np.ndarray): Imagen BGR original.
+        color_space (str): "HSV" o "LAB".
+        border (float): Ancho de la franja como fracción de cada lado.
+        max_samples (int): Número aproximado de píxeles muestreados.
+        low_pct, high_pct (float): Percentiles que delimitan el rango por canal.
+        margin (tuple): Margen por canal; por defecto AUTO_RANGE_MARGIN.
+    Returns:
+        tuple: (inferior, superior) listos para remove_background_hsv/lab o
+        segment_batch. En HSV el tono puede dar la vuelta (inferior > superior).
+    """
+    if color_space not in DEFAULT_RANGES:
+        raise ValueError(f"Espacio de color no soportado para segmentar: {color_space}")
+    if margin is None:
+        margin = AUTO_RANGE_MARGIN[color_space]
+    pixels = _border_pixels(image, border, max_samples)
+    converted = cv2.cvtColor(pixels, cv2.COLOR_BGR2HSV if color_space == "HSV" else cv2.COLOR_BGR2LAB)
+    channels = converted.reshape(-1, 3)
+    background = np.ones(len(channels), dtype=bool)
+    for c in range(3):
+        circular = color_space == "HSV" and c == 0
+        low, high = _peak_interval(channels[:, c], HUE_BINS if circular else 256, circular, PEAK_FRACTION)
+        background &= _in_interval(channels[:, c], low, high)
+    if background.any():
+        channels = channels[background]
+
+    lower, upper = [], []
+    for c in range(3):
+        if color_space == "HSV" and c == 0:
+            low, high = _hue_range(channels[:, 0], low_pct, high_pct, margin[0])
+        else:
+            low, high = _percentile_range(channels[:, c], 256, low_pct, high_pct)
+            low, high = max(0, low - margin[c]), min(255, high + margin[c])
+        lower.append(low)
+        upper.append(high)
+    return tuple(lower), tuple(upper)
+
+
+def remove_background_auto(image, color_space="HSV", **estimate_kwargs):
+    """
+    Elimina el fondo con segmentación HSV o LAB usando el rango estimado del borde
+    (ver estimate_background_range).
+    Returns:
+        tuple: (Imagen con fondo negro, Máscara del primer plano, (inferior, superior))
+        El rango se puede reutilizar en el resto de imágenes de un lote.
+    """
+    if image is None: return None, None, None
+    lower, upper = estimate_background_range(image, color_space, **estimate_kwargs)
+    if color_space == "HSV":
+        result, mask = remove_background_hsv(image, lower, upper)
+    else:
+        result, mask = remove_background_lab(image, lower, upper)
+    return result, mask, (lower, upper)
+
+
 def remove_background_hsv(image, lower_hsv=None, upper_hsv=None):
     """
     Elimina el fondo usando segmentación HSV.
@@ -15,12 +211,11 @@ def remove_background_hsv(image, lower_hsv=None, upper_hsv=None):
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
     # Usar rangos predeterminados si no se proporcionan
-    if lower_hsv is None: lower_hsv = [35, 40, 40]
-    if upper_hsv is None: upper_hsv = [85, 255, 255]
+    if lower_hsv is None: lower_hsv = DEFAULT_RANGES["HSV"][0]
+    if upper_hsv is None: upper_hsv = DEFAULT_RANGES["HSV"][1]
 
-    lower = np.array(lower_hsv)
-    upper = np.array(upper_hsv)
-    mask = cv2.inRange(hsv, lower, upper) # Máscara donde el fondo es 255
+    # Si el tono inferior es mayor que el superior, el rango de tono da la vuelta (rojos)
+    mask = _in_range(hsv, "HSV", lower_hsv, upper_hsv) # Máscara donde el fondo es 255
 
     # Invertir máscara para conservar objeto (foreground)
     inv_mask = cv2.bitwise_not(mask) # Máscara donde el objeto es 255
@@ -43,12 +238,10 @@ def remove_background_lab(image, lower_lab=None, upper_lab=None):
     lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
 
     # Usar rangos predeterminados si no se proporcionan
-    if lower_lab is None: lower_lab = [20, 120, 120]
-    if upper_lab is None: upper_lab = [255, 140, 140]
+    if lower_lab is None: lower_lab = DEFAULT_RANGES["LAB"][0]
+    if upper_lab is None: upper_lab = DEFAULT_RANGES["LAB"][1]
 
-    lower = np.array(lower_lab)
-    upper = np.array(upper_lab)
-    mask = cv2.inRange(lab, lower, upper) # Máscara donde el fondo es 255
+    mask = _in_range(lab, "LAB", lower_lab, upper_lab) # Máscara donde el fondo es 255
 
     # Invertir máscara para conservar objeto
     inv_mask = cv2.bitwise_not(mask) # Máscara donde el objeto es 255
@@ -57,6 +250,38 @@ def remove_background_lab(image, lower_lab=None, upper_lab=None):
     return result, inv_mask
 
 
+def segment_batch(images, color_space="HSV", lower=None, upper=None, out=None, work=None):
+    """
+    Máscaras de primer plano de una pila de imágenes del mismo tamaño (p. ej.
+    miniaturas de producto) con la misma segmentación que remove_background_hsv/lab,
+    pero con una sola conversión de color e inRange para toda la pila.
+    Args:
+        images: array (N, H, W, 3) BGR o lista de imágenes del mismo tamaño.
+        color_space (str): "HSV" o "LAB".
+        lower, upper: límites del rango del fondo; por defecto DEFAULT_RANGES
+                      (p. ej. el rango de estimate_background_range de una imagen del lote).
+        out (np.ndarray): buffer (N, H, W) uint8 para las máscaras.
+        work (np.ndarray): buffer (N, H, W, 3) uint8 para la conversión de color.
+        Pasar `out` y `work` permite reutilizarlos entre lotes sin reservar memoria.
+    Returns:
+        np.ndarray: máscaras (N, H, W), objeto=255 y fondo=0.
+    """
+    if color_space not in DEFAULT_RANGES:
+        raise ValueError(f"Espacio de color no soportado para segmentar: {color_space}")
+    stack = as_stack(images)
+    n, h, w = stack.shape[:3]
+    if lower is None: lower = DEFAULT_RANGES[color_space][0]
+    if upper is None: upper = DEFAULT_RANGES[color_space][1]
+    if out is None:
+        out = np.empty((n, h, w), np.uint8)
+
+    converted = convert_color_batch(stack, color_space, out=work)
+    flat_mask = out.reshape(n * h, w)
+    _in_range(converted.reshape(n * h, w, 3), color_space, lower, upper, dst=flat_mask) # Fondo=255
+    cv2.bitwise_not(flat_mask, dst=flat_mask) # Objeto=255
+    return out
+
+
 def grabcut(image, iter_count=5, rect=None):
     """
     Aplica GrabCut para segmentación de fondo.
@@ -83,3 +308,88 @@ def grabcut(image, iter_count=5, rect=None):
     result = cv2.bitwise_and(image, image, mask=mask2)
 
     return result, mask2
+
+
+def grabcut_multiscale(image, max_side=512, iter_count=5, refine_iter=2, band=None, rect=None):
+    """
+    GrabCut de grueso a fino: segmenta una copia reducida y refina a resolución
+    completa sólo una banda estrecha alrededor del borde del objeto.
+    Args:
+        image (np.ndarray): Imagen BGR original.
+        max_side (int): Lado mayor (px) de la copia reducida donde se ejecuta GrabCut.
+        iter_count (int): Iteraciones de GrabCut a baja resolución.
+        refine_iter (int): Iteraciones del refinado con GC_INIT_WITH_MASK (0 = sin refinado).
+        band (int): Semiancho (px) de la banda incierta a resolución completa.
+                    Por defecto se deriva del factor de escala.
+        rect (tuple): Rectángulo (x, y, w, h) a resolución completa; por defecto el
+                      mismo margen de 10 px que grabcut.
+    Returns:
+        tuple: (Imagen con fondo negro, Máscara del primer plano, tiempos por fase en segundos)
+    """
+    if image is None: return None, None, {}
+    timings = {}
+    start = time.perf_counter()
+    h, w = image.shape[:2]
+    if rect is None:
+        rect = (10, 10, w-20, h-20)
+
+    scale = min(1.0, max_side / float(max(h, w)))
+    if scale >= 1.0:
+        # La imagen ya es pequeña: GrabCut normal
+        result, mask = grabcut(image, iter_count, rect)
+        timings["coarse"] = time.perf_counter() - start
+        timings["total"] = timings["coarse"]
+        return result, mask, timings
+
+    # --- Fase 1: reducir ---
+    t = time.perf_counter()
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_rect = tuple(max(1, int(round(v * scale))) for v in rect)
+    timings["downscale"] = time.perf_counter() - t
+
+    # --- Fase 2: GrabCut a baja resolución ---
+    t = time.perf_counter()
+    _, small_mask = grabcut(small, iter_count, small_rect)
+    timings["coarse"] = time.perf_counter() - t
+
+    # --- Fase 3: ampliar la máscara y calcular la banda incierta ---
+    t = time.perf_counter()
+    mask = cv2.resize(small_mask, (w, h), interpolation=cv2.INTER_LINEAR)
+    _, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+    if band is None:
+        band = max(3, int(np.ceil(2.0 / scale)))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2*band+1, 2*band+1))
+    sure_fg = cv2.erode(mask, kernel)
+    maybe_fg = cv2.dilate(mask, kernel)
+    timings["upsample"] = time.perf_counter() - t
+
+    # --- Fase 4: refinar la banda a resolución completa ---
+    t = time.perf_counter()
+    uncertain = cv2.subtract(maybe_fg, sure_fg)
+    if refine_iter > 0 and np.any(uncertain):
+        # Limitar GrabCut al rectángulo que contiene la banda (con margen para tener fondo seguro)
+        x, y, bw, bh = cv2.boundingRect(uncertain)
+        x0, y0 = max(0, x - band), max(0, y - band)
+        x1, y1 = min(w, x + bw + band), min(h, y + bh + band)
+
+        gc_mask = np.full((y1-y0, x1-x0), cv2.GC_BGD, np.uint8)
+        gc_mask[sure_fg[y0:y1, x0:x1] > 0] = cv2.GC_FGD
+        band_roi = uncertain[y0:y1, x0:x1] > 0
+        gc_mask[band_roi & (mask[y0:y1, x0:x1] > 0)] = cv2.GC_PR_FGD
+        gc_mask[band_roi & (mask[y0:y1, x0:x1] == 0)] = cv2.GC_PR_BGD
+
+        bgdModel = np.zeros((1,65), np.float64)
+        fgdModel = np.zeros((1,65), np.float64)
+        try:
+            cv2.grabCut(image[y0:y1, x0:x1], gc_mask, None, bgdModel, fgdModel, refine_iter, cv2.GC_INIT_WITH_MASK)
+            refined = np.where((gc_mask==cv2.GC_FGD) | (gc_mask==cv2.GC_PR_FGD), 255, 0).astype('uint8')
+            mask = mask.copy()
+            mask[y0:y1, x0:x1] = refined
+        except cv2.error as e:
+            # Por ejemplo si en la región no queda fondo seguro: nos quedamos con la máscara ampliada
+            print(f"ADVERTENCIA: no se pudo refinar GrabCut a resolución completa: {e}")
+    timings["refine"] = time.perf_counter() - t
+
+    result = cv2.bitwise_and(image, image, mask=mask)
+    timings["total"] = time.perf_counter() - start
+    return result, mask, timings
@@ -0,0 +1,288 @@
+"""
+Procesamiento por lotes sin interfaz gráfica.
+
+Ejecuta el mismo pipeline que process_all sobre todas las imágenes de un
+directorio (o de un patrón glob) repartiendo el trabajo en un pool de procesos.
+
+Uso:
+    python -m processing.batch ENTRADA SALIDA [--spec parametros.json]
+                               [--workers N] [--chunksize K] [--max-in-flight M] [--reuse-range]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+
+from processing.background_removal import estimate_background_range
+from processing import disk_cache, export, frame_store
+from processing.cache import image_cache
+from processing.pipeline import DEFAULT_PARAMS, run_pipeline, stage_cache
+from processing.spec import load_spec_file, validate_spec
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# En los workers cada imagen se procesa una sola vez: no tiene sentido guardar
+# muchos resultados intermedios, sólo los fondos/imágenes que se repiten.
+WORKER_STAGE_CACHE_ENTRIES = 1
+WORKER_STAGE_CACHE_BYTES = 256 * 1024 * 1024
+WORKER_IMAGE_CACHE_BYTES = 128 * 1024 * 1024
+
+
+def load_spec(path):
+    """
+    Carga los parámetros del pipeline desde un archivo JSON (o YAML si PyYAML está instalado).
+    Las claves son las mismas que acepta process_all (ver pipeline.DEFAULT_PARAMS);
+    la clave opcional "ops" es una especificación de processing.spec que sustituye
+    a las transformaciones derivadas de esos parámetros.
+    """
+    spec = load_spec_file(path)
+    spec.pop("version", None)
+    unknown = sorted(set(spec) - set(DEFAULT_PARAMS))
+    if unknown:
+        raise ValueError(f"Parámetros desconocidos en {path}: {', '.join(unknown)}")
+    if spec.get("ops") is not None:
+        spec["ops"] = validate_spec(spec["ops"]) # Validar una sola vez antes de repartir el trabajo
+    return spec
+
+
+def find_inputs(source):
+    """Devuelve las rutas de imagen de un directorio o de un patrón glob, ordenadas."""
+    if os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    return sorted(p for p in paths if os.path.isfile(p) and p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+def output_path(input_path, output_dir, extension):
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, name + extension)
+
+
+def split_duplicate_outputs(paths):
+    """
+    Separa las entradas cuyo nombre de salida coincide con el de otra (p. ej.
+    foto.jpg y foto.png, o el mismo nombre en dos carpetas de un patrón glob):
+    se sobrescribirían entre sí. Todas las del grupo se devuelven como errores.
+    Returns:
+        tuple: (rutas sin conflicto, lista de (entrada, None, mensaje de error))
+    """
+    groups = {}
+    for path in paths:
+        groups.setdefault(os.path.splitext(os.path.basename(path))[0], []).append(path)
+    unique, errors = [], []
+    for path in paths:
+        group = groups[os.path.splitext(os.path.basename(path))[0]]
+        if len(group) == 1:
+            unique.append(path)
+        else:
+            others = ", ".join(other for other in group if other != path)
+            errors.append((path, None, f"el archivo de salida coincide con el de {others}; renombra una de ellas"))
+    return unique, errors
+
+
+def fix_background_range(path, params):
+    """
+    Con "HSV (auto)"/"LAB (auto)", estima el rango del fondo una sola vez sobre
+    `path` y devuelve parámetros que lo reutilizan en todo el lote (método fijo
+    con "bg_range"). Con cualquier otro método devuelve `params` sin cambios.
+    """
+    method = params.get("background_removal_method")
+    if method not in ("HSV (auto)", "LAB (auto)"):
+        return params
+    image = cv2.imread(path)
+    if image is None:
+        return params
+    color_space = method.split()[0]
+    return dict(params, background_removal_method=color_space,
+                bg_range=estimate_background_range(image, color_space))
+
+
+def _init_worker(frame_store_dirs=(), result_cache=None):
+    stage_cache.max_entries = WORKER_STAGE_CACHE_ENTRIES
+    stage_cache.max_bytes = WORKER_STAGE_CACHE_BYTES
+    image_cache.max_bytes = WORKER_IMAGE_CACHE_BYTES
+    for folder in frame_store_dirs:
+        frame_store.use_store(folder) # Todos los workers comparten las páginas del mismo archivo
+    if result_cache is not None:
+        disk_cache.use_cache(*result_cache) # Escrituras atómicas: los workers comparten el directorio
+
+
+def process_file(path, params, output_dir, extension=".png", save_mask=False, transparent=None, pending=None):
+    """
+    Procesa una imagen y escribe el resultado en `output_dir`.
+    Con transparent (opciones de export.export_transparent, p. ej. {"fmt": "webp",
+    "crop": True}) escribe también el objeto recortado con fondo transparente en
+    segundo plano; si se pasa la lista `pending` se añade allí la escritura
+    pendiente en lugar de esperarla.
+    Returns:
+        tuple: (ruta de entrada, ruta de salida o None, mensaje de error o None)
+    """
+    file_params = dict(params)
+    file_params["image_dir"] = os.path.dirname(path)
+    artifacts = run_pipeline(os.path.basename(path), file_params)
+    if artifacts is None:
+        return path, None, "no se pudo cargar la imagen"
+
+    _, result_rgb, mask = artifacts["display"]
+    result = artifacts["result"]
+    if result is not None and result.dtype == np.uint16:
+        output = result # Sin collage y con keep_16bit: se escribe con su profundidad (PNG/TIFF)
+    else:
+        output = cv2.cvtColor(result_rgb, cv2.COLOR_RGB2BGR)
+    out_path = output_path(path, output_dir, extension)
+    if not cv2.imwrite(out_path, output):
+        return path, None, f"no se pudo escribir {out_path}"
+    if save_mask:
+        cv2.imwrite(output_path(path, output_dir, "_mask.png"), mask)
+    if transparent is not None:
+        options = dict(transparent)
+        fmt = options.setdefault("fmt", "png")
+        future = export.export_transparent(artifacts["original"], artifacts["mask"],
+                                           path=output_path(path, output_dir, "_objeto." + fmt), **options)
+        if pending is None:
+            future.result()
+        else:
+            pending.append((path, future))
+    return path, out_path, None
+
+
+def _process_chunk(paths, params, output_dir, extension, save_mask, transparent=None):
+    results = []
+    pending = [] # Las exportaciones se escriben mientras se procesa la imagen siguiente
+    for path in paths:
+        try:
+            results.append(process_file(path, params, output_dir, extension, save_mask, transparent, pending))
+        except Exception as e:
+            results.append((path, None, str(e)))
+    failed = {}
+    for path, future in pending:
+        try:
+            future.result()
+        except Exception as e:
+            failed[path] = f"no se pudo exportar el objeto transparente: {e}"
+    if failed:
+        results = [(result[0], None, failed[result[0]]) if result[0] in failed else result for result in results]
+    return results
+
+
+def run_batch(paths, params, output_dir, workers=None, chunksize=4, max_in_flight=None,
+              extension=".png", save_mask=False, progress=None, frame_store_dirs=(), result_cache=None,
+              transparent=None):
+    """
+    Procesa `paths` en un ProcessPoolExecutor. Como mucho hay `max_in_flight`
+    bloques de `chunksize` imágenes pendientes a la vez, así la memoria no crece
+    con el tamaño del lote; cada worker escribe sus resultados directamente a disco.
+    Las carpetas de `frame_store_dirs` se leen desde su almacén de fotogramas
+    (processing.frame_store) en lugar de decodificar cada archivo.
+    Con result_cache=(directorio, bytes máximos) los resultados se guardan en la
+    caché de disco (processing.disk_cache) y una nueva ejecución igual los reutiliza.
+    Con transparent se exporta además el objeto transparente (ver process_file).
+    Las entradas que escribirían el mismo archivo de salida no se procesan y se
+    devuelven como errores (ver split_duplicate_outputs).
+    Returns:
+        list: tuplas (entrada, salida, error) en el orden en que terminan.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths, duplicates = split_duplicate_outputs(paths)
+    for result in duplicates:
+        if progress:
+            progress(result)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+    chunks = [paths[i:i + chunksize] for i in range(0, len(paths), chunksize)]
+
+    results = list(duplicates)
+    pending = set()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(tuple(frame_store_dirs), result_cache)) as executor:
+        for chunk in chunks:
+            if len(pending) >= max_in_flight:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results.extend(_collect(future, progress))
+            pending.add(executor.submit(_process_chunk, chunk, params, output_dir, extension, save_mask, transparent))
+        for future in pending:
+            results.extend(_collect(future, progress))
+    return results
+
+
+def _collect(future, progress):
+    chunk_results = future.result()
+    if progress is not None:
+        for result in chunk_results:
+            progress(result)
+    return chunk_results
+
+
+def _print_progress(result):
+    path, out_path, error = result
+    if error:
+        print(f"ERROR {path}: {error}")
+    else:
+        print(f"{path} -> {out_path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesa por lotes un directorio de imágenes con el pipeline de la aplicación.")
+    parser.add_argument("input", help="Directorio de entrada o patrón glob (p. ej. 'fotos/*.jpg')")
+    parser.add_argument("output", help="Directorio de salida")
+    parser.add_argument("--spec", help="Archivo JSON/YAML con los parámetros de process_all y/o una lista 'ops'")
+    parser.add_argument("--workers", type=int, default=None, help="Número de procesos (por defecto, núcleos de CPU)")
+    parser.add_argument("--chunksize", type=int, default=4, help="Imágenes por tarea enviada a cada proceso")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="Tareas pendientes como máximo (por defecto 2 x workers)")
+    parser.add_argument("--format", default="png", help="Extensión de las imágenes de salida (png, jpg, ...)")
+    parser.add_argument("--save-mask", action="store_true", help="Guardar también la máscara de primer plano")
+    parser.add_argument("--reuse-range", action="store_true",
+                        help="Con 'HSV (auto)'/'LAB (auto)', estimar el rango del fondo en la primera imagen y usarlo en todas")
+    parser.add_argument("--frame-store", action="store_true",
+                        help="Leer las imágenes desde el almacén de fotogramas de su carpeta (python -m processing.frame_store)")
+    parser.add_argument("--keep-16bit", action="store_true",
+                        help="Procesar las imágenes de 16 bits sin reducirlas y escribirlas en 16 bits (sin collage)")
+    parser.add_argument("--result-cache", metavar="DIR",
+                        help="Directorio de la caché de resultados en disco (reutiliza ejecuciones anteriores iguales)")
+    parser.add_argument("--result-cache-bytes", type=int, default=disk_cache.DEFAULT_MAX_BYTES,
+                        help="Tamaño máximo de la caché de resultados")
+    parser.add_argument("--transparent", choices=export.EXPORT_FORMATS,
+                        help="Exportar también el objeto con fondo transparente (<nombre>_objeto.png/.webp)")
+    parser.add_argument("--crop", action="store_true", help="Recortar el objeto transparente al rectángulo de la máscara")
+    parser.add_argument("--png-compression", type=int, default=export.DEFAULT_PNG_COMPRESSION,
+                        help="Nivel de compresión PNG del objeto transparente (0-9)")
+    parser.add_argument("--png-strategy", choices=sorted(export.PNG_STRATEGIES), default="default",
+                        help="Estrategia de zlib para el PNG del objeto transparente")
+    args = parser.parse_args(argv)
+
+    params = load_spec(args.spec) if args.spec else {}
+    if args.keep_16bit:
+        params["keep_16bit"] = True
+    paths = find_inputs(args.input)
+    if not paths:
+        print(f"No se encontraron imágenes en '{args.input}'.")
+        return 1
+    if args.reuse_range:
+        params = fix_background_range(paths[0], params)
+        if params.get("bg_range") is not None:
+            print(f"Rango de fondo estimado en {paths[0]}: {params['bg_range'][0]} - {params['bg_range'][1]}")
+
+    start = time.perf_counter()
+    results = run_batch(paths, params, args.output, workers=args.workers, chunksize=args.chunksize,
+                        max_in_flight=args.max_in_flight, extension="." + args.format.lstrip("."),
+                        save_mask=args.save_mask, progress=_print_progress,
+                        frame_store_dirs=sorted({os.path.dirname(p) for p in paths}) if args.frame_store else (),
+                        result_cache=(args.result_cache, args.result_cache_bytes) if args.result_cache else None,
+                        transparent=None if args.transparent is None else {
+                            "fmt": args.transparent, "crop": args.crop,
+                            "compression": args.png_compression, "strategy": args.png_strategy})
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for _, _, error in results if error)
+    print(f"{len(results) - errors}/{len(results)} imágenes procesadas en {elapsed:.1f}s ({errors} errores).")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
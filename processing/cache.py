@@ -0,0 +1,179 @@
+import os
+import threading
+from collections import OrderedDict
+
+import cv2
+
+from processing import frame_store
+
+# Límite por defecto de la caché de imágenes decodificadas (en bytes)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+class ImageCache:
+    """
+    Caché LRU de imágenes decodificadas, acotada por el total de bytes.
+    Cada entrada guarda una "versión" (por ejemplo mtime y tamaño del archivo);
+    si la versión pedida no coincide, la entrada se descarta como obsoleta.
+    Las imágenes se entregan como arrays de solo lectura para que nadie
+    modifique por accidente la copia compartida.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (version, imagen)
+        self._lock = threading.Lock()
+
+    def get(self, key, version=None):
+        """Devuelve la imagen cacheada para `key` o None si no existe o está obsoleta."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            cached_version, image = entry
+            if cached_version != version:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image, version=None):
+        """Guarda la imagen (marcada como solo lectura) y expulsa las entradas más antiguas."""
+        image.flags.writeable = False
+        if image.nbytes > self.max_bytes:
+            return image  # Demasiado grande para la caché, no se guarda
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, image)
+            self.current_bytes += image.nbytes
+            while self.current_bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _remove(self, key):
+        _, image = self._entries.pop(key)
+        self.current_bytes -= image.nbytes
+
+
+def file_signature(path):
+    """Firma barata de un archivo: (mtime en ns, tamaño). Lanza OSError si no existe."""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+image_cache = ImageCache()
+
+
+def imread_cached(path, flags=cv2.IMREAD_COLOR, cache=None):
+    """
+    Equivalente a cv2.imread con caché: sólo decodifica si el archivo no está en caché
+    o si cambió en disco (mtime/tamaño). Si la carpeta tiene un almacén de fotogramas
+    activo (ver processing.frame_store) y está al día, devuelve una vista mapeada
+    en memoria sin decodificar. Devuelve un array de solo lectura o None.
+    """
+    if flags == cv2.IMREAD_COLOR:
+        image = frame_store.lookup(path)
+        if image is not None:
+            return image
+    if cache is None:
+        cache = image_cache
+    try:
+        version = file_signature(path)
+    except OSError:
+        return None
+
+    key = (os.path.abspath(path), flags)
+    image = cache.get(key, version)
+    if image is not None:
+        return image
+
+    image = cv2.imread(path, flags)
+    if image is None:
+        return None
+    return cache.put(key, image, version)
+
+
+# Fondos ya redimensionados al tamaño de las imágenes sobre las que se componen
+background_cache = ImageCache(max_bytes=256 * 1024 * 1024)
+
+
+def resized_cached(path, size, interpolation=cv2.INTER_LINEAR, cache=None):
+    """
+    Devuelve la imagen `path` redimensionada a size=(ancho, alto), cacheada por
+    ruta, tamaño e interpolación. Si la imagen ya tiene ese tamaño se devuelve
+    la decodificada tal cual. Devuelve un array de solo lectura o None.
+    """
+    if cache is None:
+        cache = background_cache
+    try:
+        version = file_signature(path)
+    except OSError:
+        return None
+
+    key = (os.path.abspath(path), tuple(size), interpolation)
+    image = cache.get(key, version)
+    if image is not None:
+        return image
+
+    image = imread_cached(path)
+    if image is None:
+        return None
+    if (image.shape[1], image.shape[0]) == tuple(size):
+        return image
+    resized = cv2.resize(image, tuple(size), interpolation=interpolation)
+    return cache.put(key, resized, version)
+
+
+def prewarm_resized(paths, sizes, interpolation=cv2.INTER_LINEAR, cache=None):
+    """Precarga en caché cada imagen de `paths` redimensionada a cada tamaño (ancho, alto) de `sizes`."""
+    count = 0
+    for path in paths:
+        for size in sizes:
+            if resized_cached(path, size, interpolation, cache) is not None:
+                count += 1
+    return count
+
+
+# Copias reducidas de las imágenes base para la vista previa de la interfaz
+preview_cache = ImageCache(max_bytes=128 * 1024 * 1024)
+
+
+def downscaled_cached(path, max_side, cache=None):
+    """
+    Devuelve la imagen `path` reducida (INTER_AREA) para que su lado mayor no
+    supere `max_side`, cacheada en `preview_cache`. Las imágenes que ya caben se
+    devuelven tal cual. Devuelve un array de solo lectura o None.
+    """
+    if cache is None:
+        cache = preview_cache
+    image = imread_cached(path)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = max_side / max(height, width)
+    if scale >= 1:
+        return image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return resized_cached(path, size, cv2.INTER_AREA, cache)
@@ -1,24 +1,234 @@
+"""
+Collages y hojas de contactos.
+
+La disposición se calcula primero (un rectángulo por imagen), después se reserva
+un único lienzo y cada imagen se redimensiona directamente dentro de su vista
+(ROI) del lienzo: cada píxel se escribe una sola vez.
+
+Uso (hoja de contactos de una carpeta, por páginas dentro de un presupuesto de memoria):
+    python -m processing.collage images/ hoja.png [--cols 20] [--cell 160] [--max-bytes 268435456]
+"""
+import argparse
+import os
+import sys
+
 import cv2
 import numpy as np
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Presupuesto por defecto de cada página de una hoja de contactos (en bytes)
+DEFAULT_SHEET_BYTES = 256 * 1024 * 1024
+
+
+def fit_rect(image_size, cell):
+    """
+    Rectángulo (x, y, ancho, alto) donde cabe una imagen de tamaño (ancho, alto)
+    dentro de la celda (x, y, ancho, alto) conservando la proporción, centrado.
+    """
+    iw, ih = image_size
+    x, y, cw, ch = cell
+    scale = min(cw / iw, ch / ih)
+    w, h = max(1, round(iw * scale)), max(1, round(ih * scale))
+    return (x + (cw - w) // 2, y + (ch - h) // 2, w, h)
+
+
+def grid_layout(count, cols, cell_size, padding=0):
+    """
+    Celdas de una cuadrícula de `cols` columnas con celdas de cell_size=(ancho, alto).
+    Returns:
+        tuple: ((ancho, alto) del lienzo, lista de celdas (x, y, ancho, alto))
+    """
+    cw, ch = cell_size
+    rows = -(-count // cols)
+    cells = [(padding + (i % cols) * (cw + padding), padding + (i // cols) * (ch + padding), cw, ch)
+             for i in range(count)]
+    return (padding + cols * (cw + padding), padding + rows * (ch + padding)), cells
+
+
+def justified_layout(sizes, width, row_height, padding=0):
+    """
+    Filas justificadas: las imágenes de cada fila conservan su proporción y la
+    fila se escala para ocupar exactamente `width`. La última fila no se estira.
+    Args:
+        sizes: lista de (ancho, alto) de las imágenes.
+        width (int): ancho del lienzo.
+        row_height (int): alto aproximado de las filas.
+    Returns:
+        tuple: ((ancho, alto) del lienzo, lista de rectángulos (x, y, ancho, alto))
+    """
+    rects = []
+    y = padding
+    row = []
+    for i, (iw, ih) in enumerate(sizes):
+        row.append(iw / ih)
+        available = width - padding * (len(row) + 1)
+        is_last = i == len(sizes) - 1
+        if sum(row) * row_height < available and not is_last:
+            continue
+        # Alto con el que la fila ocupa justo el ancho disponible (sin estirar la última)
+        height = available / sum(row)
+        if is_last and height > row_height:
+            height = row_height
+        height = max(1, round(height))
+        x = padding
+        for j, aspect in enumerate(row):
+            w = max(1, round(aspect * height))
+            if j == len(row) - 1 and not (is_last and height == row_height):
+                w = max(1, width - padding - x) # Absorber el redondeo en la última imagen
+            rects.append((x, y, w, height))
+            x += w + padding
+        y += height + padding
+        row = []
+    return (width, y), rects
+
+
+def render(images, rects, canvas_size, channels=3, dtype=np.uint8, background=0, out=None,
+           interpolation=None):
+    """
+    Dibuja cada imagen redimensionada dentro de su rectángulo de un único lienzo.
+    `images` puede ser un iterable (p. ej. un generador que carga del disco): cada
+    imagen sólo se necesita mientras se copia. Con interpolation=None se usa
+    INTER_AREA al reducir e INTER_LINEAR al ampliar.
+    """
+    width, height = canvas_size
+    shape = (height, width) if channels == 1 else (height, width, channels)
+    if out is None:
+        out = np.empty(shape, dtype)
+    out[...] = background
+    for image, (x, y, w, h) in zip(images, rects):
+        if image is None:
+            continue
+        if image.shape[2:] != out.shape[2:]:
+            raise ValueError("Todas las imágenes del collage deben tener el mismo número de canales")
+        view = out[y:y + h, x:x + w]
+        method = interpolation
+        if method is None:
+            method = cv2.INTER_AREA if w < image.shape[1] else cv2.INTER_LINEAR
+        if image.dtype == out.dtype:
+            cv2.resize(image, (w, h), dst=view, interpolation=method) # Directamente en el lienzo
+        else:
+            view[...] = cv2.resize(image, (w, h), interpolation=method)
+    return out
+
+
+def _canvas_format(images):
+    first = images[0]
+    return (1 if first.ndim == 2 else first.shape[2]), np.result_type(*[img.dtype for img in images])
+
+
+def build_collage(images, layout="grid", cols=2, cell_size=(300, 300), width=1200, row_height=200,
+                  padding=0, background=0, keep_aspect=True):
+    """
+    Collage de una lista de imágenes con un solo lienzo.
+    Args:
+        layout (str): "grid" (celdas iguales de `cell_size`, `cols` columnas) o
+                      "justified" (filas de alto ~`row_height` que ocupan `width`).
+        keep_aspect (bool): en "grid", encajar cada imagen en su celda sin deformarla.
+    Returns:
+        np.ndarray: el collage.
+    """
+    if not images:
+        raise ValueError("La lista de imágenes está vacía")
+    channels, dtype = _canvas_format(images)
+    if layout == "justified":
+        sizes = [(img.shape[1], img.shape[0]) for img in images]
+        canvas_size, rects = justified_layout(sizes, width, row_height, padding)
+    elif layout == "grid":
+        canvas_size, rects = grid_layout(len(images), cols, cell_size, padding)
+        if keep_aspect:
+            rects = [fit_rect((img.shape[1], img.shape[0]), cell) for img, cell in zip(images, rects)]
+    else:
+        raise ValueError(f"Disposición de collage desconocida: {layout}")
+    return render(images, rects, canvas_size, channels, dtype, background)
+
+
 def stack_images(images, cols=2, size=(300, 300)):
+    """
+    Cuadrícula de `cols` columnas con todas las imágenes forzadas a `size`
+    (deformándolas) y celdas vacías en negro. Mismo resultado que la versión
+    anterior con hstack/vstack, pero escribiendo cada imagen una sola vez.
+    """
     if not images:
         raise ValueError("La lista de imágenes está vacía")
+    channels, dtype = _canvas_format(images)
+    canvas_size, rects = grid_layout(len(images), cols, size)
+    return render(images, rects, canvas_size, channels, dtype, interpolation=cv2.INTER_LINEAR)
+
+
+def _load_thumbnail(path, cell_size):
+    """
+    Decodifica `path` a la menor escala reducida de OpenCV (1/8, 1/4, 1/2) que
+    siga cubriendo la celda: como mucho dos decodificaciones por imagen.
+    """
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_8)
+    if image is None or (image.shape[1] >= cell_size[0] and image.shape[0] >= cell_size[1]):
+        return image
+    width, height = image.shape[1] * 8, image.shape[0] * 8 # Tamaño aproximado del original
+    for flag, factor in ((cv2.IMREAD_REDUCED_COLOR_4, 4), (cv2.IMREAD_REDUCED_COLOR_2, 2)):
+        if width // factor >= cell_size[0] and height // factor >= cell_size[1]:
+            return cv2.imread(path, flag)
+    return cv2.imread(path, cv2.IMREAD_COLOR)
+
+
+def sheet_capacity(cols, cell_size, padding=4, max_bytes=DEFAULT_SHEET_BYTES):
+    """Imágenes por página de hoja de contactos para que el lienzo BGR no supere `max_bytes`."""
+    cw, ch = cell_size
+    line_bytes = (cols * (cw + padding) + padding) * 3 # Una línea de píxeles del lienzo
+    rows_per_page = max(1, (max_bytes // line_bytes - padding) // (ch + padding))
+    return rows_per_page * cols
+
+
+def contact_sheets(paths, cols=20, cell_size=(160, 160), padding=4, max_bytes=DEFAULT_SHEET_BYTES,
+                   background=255):
+    """
+    Genera hojas de contactos (BGR) de `paths` en páginas cuyo lienzo no supera
+    `max_bytes`. Las imágenes se decodifican de una en una al dibujarlas, así que
+    la memoria queda acotada por la página aunque haya miles de archivos.
+    """
+    per_page = sheet_capacity(cols, cell_size, padding, max_bytes)
+    for start in range(0, len(paths), per_page):
+        page = paths[start:start + per_page]
+        canvas_size, cells = grid_layout(len(page), cols, cell_size, padding)
+        canvas = np.empty((canvas_size[1], canvas_size[0], 3), np.uint8)
+        canvas[...] = background
+        for path, cell in zip(page, cells):
+            image = _load_thumbnail(path, cell_size)
+            if image is None:
+                print(f"ADVERTENCIA: No se pudo cargar la imagen {path}, se deja la celda vacía.")
+                continue
+            x, y, w, h = fit_rect((image.shape[1], image.shape[0]), cell)
+            cv2.resize(image, (w, h), dst=canvas[y:y + h, x:x + w], interpolation=cv2.INTER_AREA)
+        yield canvas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Hoja de contactos de una carpeta de imágenes.")
+    parser.add_argument("input", help="Carpeta de imágenes")
+    parser.add_argument("output", help="Archivo de salida; con varias páginas se numera (hoja_001.png, ...)")
+    parser.add_argument("--cols", type=int, default=20)
+    parser.add_argument("--cell", type=int, default=160, help="Lado de cada celda en px")
+    parser.add_argument("--padding", type=int, default=4)
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_SHEET_BYTES, help="Memoria máxima del lienzo de cada página")
+    args = parser.parse_args(argv)
+
+    paths = sorted(os.path.join(args.input, f) for f in os.listdir(args.input)
+                   if f.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        print(f"No se encontraron imágenes en '{args.input}'.")
+        return 1
+
+    cell_size = (args.cell, args.cell)
+    pages = -(-len(paths) // sheet_capacity(args.cols, cell_size, args.padding, args.max_bytes))
+    base, extension = os.path.splitext(args.output)
+    written = []
+    for number, sheet in enumerate(contact_sheets(paths, args.cols, cell_size, args.padding, args.max_bytes), 1):
+        path = args.output if pages == 1 else f"{base}_{number:03d}{extension}"
+        cv2.imwrite(path, sheet)
+        written.append(path)
+    print(f"{len(paths)} imágenes en {len(written)} página(s): {', '.join(written)}")
+    return 0
+
 
-    # Redimensionar todas las imágenes
-    resized_images = [cv2.resize(img, size) for img in images]
-
-    # Calcular filas necesarias
-    rows = []
-    for i in range(0, len(resized_images), cols):
-        row_imgs = resized_images[i:i+cols]
-        # Si faltan imágenes para completar la fila, agregar imágenes negras
-        if len(row_imgs) < cols:
-            blank_img = np.zeros_like(row_imgs[0])
-            row_imgs += [blank_img] * (cols - len(row_imgs))
-        row = np.hstack(row_imgs)
-        rows.append(row)
-
-    # Apilar filas verticalmente
-    collage = np.vstack(rows)
-    return collage
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,12 @@
 import cv2
+import numpy as np
+
+# Códigos de conversión desde BGR (RGB no convierte: la imagen ya está en BGR)
+COLOR_CONVERSIONS = {
+    "HSV": cv2.COLOR_BGR2HSV,
+    "LAB": cv2.COLOR_BGR2LAB,
+    "GRAYSCALE": cv2.COLOR_BGR2GRAY,
+}
 
 def convert_color(image, color_space):
     if color_space == "RGB":
@@ -13,6 +21,40 @@ def convert_color(image, color_space):
         return image
 
 
+def as_stack(images):
+    """
+    Devuelve las imágenes como un único array contiguo (N, H, W, C).
+    Un array que ya lo es se devuelve sin copiar; una lista se copia una vez.
+    """
+    if isinstance(images, np.ndarray):
+        return np.ascontiguousarray(images)
+    return np.stack(images)
+
+
+def convert_color_batch(images, color_space, out=None):
+    """
+    convert_color para una pila de imágenes del mismo tamaño en una sola llamada:
+    la pila (N, H, W, 3) se ve como una imagen (N*H, W, 3), sin copias.
+    Args:
+        images: array (N, H, W, 3) BGR o lista de imágenes del mismo tamaño.
+        color_space (str): "RGB", "HSV", "LAB" o "GRAYSCALE".
+        out (np.ndarray): buffer de salida ya reservado y contiguo, (N, H, W, 3)
+                          o (N, H, W) para GRAYSCALE. Se reutiliza entre llamadas.
+    Returns:
+        np.ndarray: la pila convertida (`out` si se indicó).
+    """
+    stack = as_stack(images)
+    code = COLOR_CONVERSIONS.get(color_space)
+    if code is None:
+        return stack  # No conversión, ya está en BGR
+    n, h, w = stack.shape[:3]
+    shape = (n, h, w) if color_space == "GRAYSCALE" else (n, h, w, 3)
+    if out is None:
+        out = np.empty(shape, np.uint8)
+    cv2.cvtColor(stack.reshape(n * h, w, -1), code, dst=out.reshape((n * h, w) + shape[3:]))
+    return out
+
+
 def split_channels(image):
     return cv2.split(image)
 
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
@@ -35,10 +37,10 @@ def resize(image, width=None, height=None):
         dim = (width, height)
     return cv2.resize(image, dim, interpolation=cv2.INTER_AREA)
 
-def adjust_brightness_contrast(image, brightness=0, contrast=0):
+def _brightness_contrast_weighted(image, brightness=0, contrast=0):
     """
-    brightness: [-255,255]
-    contrast: [-127,127]
+    Implementación original con cv2.addWeighted (hasta dos pasadas sobre la imagen).
+    Se usa para construir la tabla de 8 bits y para imágenes de otra profundidad.
     """
     if brightness != 0:
         if brightness > 0:
@@ -59,20 +61,155 @@ def adjust_brightness_contrast(image, brightness=0, contrast=0):
 
     return image
 
+def adjust_brightness_contrast(image, brightness=0, contrast=0):
+    """
+    brightness: [-255,255]
+    contrast: [-127,127]
+    En imágenes de 8 bits se aplica con una sola pasada de cv2.LUT y en las de
+    16 bits con una tabla de 65536 entradas (los parámetros usan la escala de 8 bits).
+    """
+    if brightness == 0 and contrast == 0:
+        return image
+    if image.dtype == np.uint16:
+        return np.take(brightness_contrast_table16(brightness, contrast), image)
+    if image.dtype != np.uint8:
+        return _brightness_contrast_weighted(image, brightness, contrast)
+    return cv2.LUT(image, brightness_contrast_table(brightness, contrast))
+
 def gamma_correction(image, gamma=1.0):
+    if image.dtype == np.uint16:
+        return np.take(gamma_table16(gamma), image)
+    return cv2.LUT(image, gamma_table(gamma))
+
+
+# --- Operaciones puntuales como tablas de 256 entradas ---
+# Una operación puntual sólo depende del valor de cada píxel, así que en 8 bits
+# equivale a una tabla. Las tablas se cachean por parámetros y una cadena de
+# operaciones se compone en una única tabla que se aplica con un solo cv2.LUT.
+
+_RAMP = np.arange(256, dtype=np.uint8).reshape(1, 256)
+
+def _freeze_table(table):
+    table = np.ascontiguousarray(table, dtype=np.uint8).reshape(256)
+    table.flags.writeable = False # Las tablas se comparten desde la caché
+    return table
+
+@lru_cache(maxsize=256)
+def brightness_contrast_table(brightness=0, contrast=0):
+    # Se obtiene aplicando addWeighted a la rampa 0..255: mismo redondeo y saturación
+    return _freeze_table(_brightness_contrast_weighted(_RAMP, brightness, contrast))
+
+@lru_cache(maxsize=256)
+def gamma_table(gamma=1.0):
     invGamma = 1.0 / gamma
-    table = np.array([(i / 255.0) ** invGamma * 255
-                      for i in np.arange(0, 256)]).astype("uint8")
+    return _freeze_table((np.arange(256) / 255.0) ** invGamma * 255)
+
+@lru_cache(maxsize=1)
+def invert_table():
+    # Equivalente a masks.bitwise_not
+    return _freeze_table(255 - np.arange(256))
+
+@lru_cache(maxsize=256)
+def threshold_table(thresh_value=128, max_value=255):
+    # Equivalente a masks.apply_threshold (cv2.THRESH_BINARY) sobre escala de grises
+    _, table = cv2.threshold(_RAMP, thresh_value, max_value, cv2.THRESH_BINARY)
+    return _freeze_table(table)
+
+# --- Las mismas tablas para imágenes de 16 bits (65536 entradas) ---
+# Cada operación se evalúa sobre la rampa 0..65535 llevada a la escala continua
+# 0-255 de los parámetros, y el resultado se vuelve a escalar a 16 bits.
+
+_RAMP16 = np.arange(65536, dtype=np.float32).reshape(1, 65536) / 257.0
+_IDENTITY16 = np.arange(65536, dtype=np.uint16)
+
+def _freeze_table16(values_0_255):
+    table = np.rint(np.clip(values_0_255, 0, 255) * 257.0).astype(np.uint16).reshape(65536)
+    table.flags.writeable = False
+    return table
+
+@lru_cache(maxsize=64)
+def brightness_contrast_table16(brightness=0, contrast=0):
+    return _freeze_table16(_brightness_contrast_weighted(_RAMP16, brightness, contrast))
+
+@lru_cache(maxsize=64)
+def gamma_table16(gamma=1.0):
+    return _freeze_table16((_RAMP16 / 255.0) ** (1.0 / gamma) * 255)
+
+@lru_cache(maxsize=1)
+def invert_table16():
+    return _freeze_table16(255 - _RAMP16)
+
+@lru_cache(maxsize=64)
+def threshold_table16(thresh_value=128, max_value=255):
+    return _freeze_table16(np.where(_RAMP16 > thresh_value, max_value, 0))
+
+POINT_OP_TABLES = {
+    "brightness_contrast": brightness_contrast_table,
+    "gamma": gamma_table,
+    "invert": invert_table,
+    "threshold": threshold_table,
+}
+POINT_OP_TABLES16 = {
+    "brightness_contrast": brightness_contrast_table16,
+    "gamma": gamma_table16,
+    "invert": invert_table16,
+    "threshold": threshold_table16,
+}
+
+@lru_cache(maxsize=256)
+def compose_point_ops(ops, bits=8):
+    """
+    Compone una cadena de operaciones puntuales en una sola tabla.
+    ops: tupla de (nombre, tupla de parámetros), p. ej.
+         (("brightness_contrast", (20, 10)), ("gamma", (1.5,)), ("invert", ()))
+    bits: 8 (tabla de 256 entradas) o 16 (tabla de 65536 entradas).
+    """
+    tables = POINT_OP_TABLES16 if bits == 16 else POINT_OP_TABLES
+    table = np.arange(1 << bits, dtype=np.uint16 if bits == 16 else np.uint8)
+    for name, params in ops:
+        builder = tables.get(name)
+        if builder is None:
+            raise ValueError(f"Operación puntual no válida: {name}. Usa una de: {', '.join(POINT_OP_TABLES)}")
+        table = builder(*params)[table]
+    if bits == 16:
+        table.flags.writeable = False
+        return table
+    return _freeze_table(table)
+
+def apply_point_ops(image, ops):
+    """
+    Aplica una cadena de operaciones puntuales con una sola tabla: cv2.LUT en
+    imágenes de 8 bits y np.take en las de 16 bits.
+    """
+    if image.dtype == np.uint16:
+        table = compose_point_ops(tuple(ops), bits=16)
+        if np.array_equal(table, _IDENTITY16):
+            return image
+        return np.take(table, image)
+    table = compose_point_ops(tuple(ops))
+    if np.array_equal(table, _RAMP[0]):
+        return image # La cadena completa es la identidad
     return cv2.LUT(image, table)
 
+def _equalize_hist16(channel):
+    # Igual que cv2.equalizeHist (sólo 8 bits) con un histograma de 65536 niveles
+    cdf = np.cumsum(np.bincount(channel.ravel(), minlength=65536))
+    cdf_min = cdf[np.flatnonzero(cdf)[0]]
+    total = cdf[-1]
+    if total == cdf_min:
+        return channel.copy() # Imagen de un solo valor
+    table = np.rint((cdf - cdf_min) * (65535.0 / (total - cdf_min))).clip(0, 65535).astype(np.uint16)
+    return np.take(table, channel)
+
 def equalize_histogram(image):
+    equalize = _equalize_hist16 if image.dtype == np.uint16 else cv2.equalizeHist
     # Si la imagen es de un canal (escala de grises)
     if len(image.shape) == 2:
-        return cv2.equalizeHist(image)
+        return equalize(image)
     # Si la imagen tiene 3 canales (color)
     elif len(image.shape) == 3 and image.shape[2] == 3:
         channels = cv2.split(image)
-        eq_channels = [cv2.equalizeHist(ch) for ch in channels]
+        eq_channels = [equalize(ch) for ch in channels]
         return cv2.merge(eq_channels)
     else:
         # En otro caso, devolver la imagen sin cambios
@@ -1,19 +1,82 @@
+import threading
+
 import cv2
 import numpy as np
 
+from processing.utils import to_uint8
+
+HAAR_FACE_CASCADE = "haarcascade_frontalface_default.xml"
+
+# Un clasificador por hilo: CascadeClassifier no es seguro para usar desde
+# varios hilos a la vez, pero cargar el XML en cada llamada es muy costoso.
+_thread_local = threading.local()
+
+
+def _draw_color(image, bgr):
+    # Los colores se dan en la escala de 8 bits; en imágenes de 16 bits se escalan
+    return tuple(c * 257 for c in bgr) if image.dtype == np.uint16 else bgr
+
+
 def detect_contours(image):
-    # Convertir a gris para detectar contornos
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    # Convertir a gris para detectar contornos (Canny sólo admite 8 bits)
+    gray = to_uint8(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY))
     edges = cv2.Canny(gray, 100, 200)
     contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
     # Dibujar contornos en la imagen original
-    cv2.drawContours(image, contours, -1, (0, 255, 0), 2)
+    cv2.drawContours(image, contours, -1, _draw_color(image, (0, 255, 0)), 2)
     return image
 
-def detect_faces_haar(image):
-    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+def get_cascade(name=HAAR_FACE_CASCADE):
+    """
+    Devuelve el clasificador Haar `name` cargado una sola vez por hilo.
+    """
+    cascades = getattr(_thread_local, "cascades", None)
+    if cascades is None:
+        cascades = _thread_local.cascades = {}
+    cascade = cascades.get(name)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + name)
+        if cascade.empty():
+            raise RuntimeError(f"No se pudo cargar el clasificador Haar '{name}'")
+        cascades[name] = cascade
+    return cascade
+
+def find_faces_haar(image, max_side=None, scale_factor=1.1, min_neighbors=4):
+    """
+    Detecta rostros y devuelve sus cajas en coordenadas de la imagen original.
+    - max_side: si se indica y la imagen es mayor, la detección se hace sobre
+      una copia reducida cuyo lado mayor mide `max_side` px y las cajas se
+      reescalan a la resolución completa.
+    Returns:
+        list: cajas como diccionarios {"x", "y", "w", "h"}.
+    """
+    gray = to_uint8(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image)
+    scale = 1.0
+    if max_side and max(gray.shape[:2]) > max_side:
+        scale = max_side / max(gray.shape[:2])
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    faces = get_cascade().detectMultiScale(gray, scale_factor, min_neighbors)
+    boxes = []
     for (x, y, w, h) in faces:
-        cv2.rectangle(image, (x, y), (x+w, y+h), (255, 0, 0), 2)
+        boxes.append({
+            "x": int(round(x / scale)),
+            "y": int(round(y / scale)),
+            "w": int(round(w / scale)),
+            "h": int(round(h / scale)),
+        })
+    return boxes
+
+def detect_faces_haar(image, max_side=None, return_boxes=False):
+    """
+    Dibuja los rostros detectados sobre la imagen.
+    - max_side: detectar sobre una versión reducida (ver find_faces_haar).
+    - return_boxes: si es True devuelve (imagen, cajas) en lugar de sólo la imagen.
+    """
+    boxes = find_faces_haar(image, max_side=max_side)
+    for box in boxes:
+        x, y, w, h = box["x"], box["y"], box["w"], box["h"]
+        cv2.rectangle(image, (x, y), (x+w, y+h), _draw_color(image, (255, 0, 0)), 2)
+    if return_boxes:
+        return image, boxes
     return image
@@ -0,0 +1,231 @@
+"""
+Caché persistente en disco de resultados del pipeline, direccionada por contenido.
+
+La clave de cada entrada es un sha256 de:
+- el contenido de las imágenes de entrada (no su nombre ni su fecha),
+- los parámetros normalizados (JSON con las claves ordenadas),
+- la versión del código (hash de las fuentes de processing/), para que un cambio
+  en los algoritmos invalide los resultados antiguos sin borrarlos a mano.
+
+Cada entrada es un archivo .npz con uno o varios arrays. Las escrituras son
+atómicas (archivo temporal + os.replace), así que varios procesos de un lote
+pueden compartir el directorio. El tamaño total está acotado: al superarlo se
+borran las entradas usadas hace más tiempo (cada acierto actualiza su mtime).
+
+Uso:
+    python -m processing.disk_cache .result_cache [--clear]
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+
+import numpy as np
+
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+ENTRY_EXTENSION = ".npz"
+
+_code_version = None
+_digests = {} # ruta absoluta -> (firma, sha256 del contenido)
+_digests_lock = threading.Lock()
+
+
+def code_version():
+    """Hash de las fuentes de processing/: cambia con cualquier cambio de código."""
+    global _code_version
+    if _code_version is None:
+        sha = hashlib.sha256()
+        folder = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(folder, "*.py"))):
+            with open(path, "rb") as f:
+                sha.update(f.read())
+        _code_version = sha.hexdigest()[:16]
+    return _code_version
+
+
+def file_digest(path):
+    """
+    sha256 del contenido de `path`. Se recalcula sólo si el archivo cambió
+    (mtime/tamaño) desde la última vez. Lanza OSError si no existe.
+    """
+    st = os.stat(path)
+    signature = (st.st_mtime_ns, st.st_size)
+    path = os.path.abspath(path)
+    with _digests_lock:
+        entry = _digests.get(path)
+    if entry is not None and entry[0] == signature:
+        return entry[1]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    with _digests_lock:
+        _digests[path] = (signature, digest)
+    return digest
+
+
+def _normalize(value):
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def make_key(*parts):
+    """Clave de una entrada: sha256 de las partes normalizadas y de la versión del código."""
+    payload = json.dumps([code_version(), _normalize(list(parts))], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Directorio de entradas .npz acotado a `max_bytes` con expulsión LRU.
+    Los errores de disco se tratan como fallos de caché: nunca interrumpen el pipeline.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.current_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        # Subcarpetas por los dos primeros caracteres: evita directorios enormes
+        return os.path.join(self.directory, key[:2], key + ENTRY_EXTENSION)
+
+    def _entries(self):
+        """(ruta, tamaño, mtime) de cada entrada en disco."""
+        entries = []
+        for path in glob.glob(os.path.join(self.directory, "*", "*" + ENTRY_EXTENSION)):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue # Borrada por otro proceso
+            entries.append((path, st.st_size, st.st_mtime_ns))
+        return entries
+
+    def get(self, key):
+        """Arrays guardados con `key` (dict nombre -> array de solo lectura) o None."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path) # Marca de uso reciente para la expulsión LRU
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, ValueError) as e:
+            print(f"ADVERTENCIA: entrada de caché ilegible {path} ({e}), se descarta.")
+            self._discard(path)
+            with self._lock:
+                self.misses += 1
+            return None
+        for array in arrays.values():
+            array.flags.writeable = False
+        with self._lock:
+            self.hits += 1
+        return arrays
+
+    def put(self, key, arrays):
+        """Guarda `arrays` (dict nombre -> array) de forma atómica y expulsa si hace falta."""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, **arrays)
+                size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, path) # Los lectores ven la entrada completa o ninguna
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        except OSError as e:
+            print(f"ADVERTENCIA: no se pudo escribir en la caché {path}: {e}")
+            return
+        with self._lock:
+            self.current_bytes += size
+            over = self.current_bytes > self.max_bytes
+        if over:
+            self.evict()
+
+    def evict(self):
+        """Borra las entradas menos usadas hasta quedar por debajo de `max_bytes`."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._discard(path):
+                    total -= size
+            self.current_bytes = total
+
+    def _discard(self, path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                self._discard(path)
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"bytes": self.current_bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_cache = None
+
+
+def use_cache(directory, max_bytes=DEFAULT_MAX_BYTES):
+    """Activa la caché global que usa el pipeline. Devuelve la DiskCache."""
+    global _cache
+    _cache = DiskCache(directory, max_bytes)
+    return _cache
+
+
+def get_cache():
+    """Caché global activa, o None si no se activó (el pipeline no usa el disco)."""
+    return _cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Estado de la caché de resultados en disco.")
+    parser.add_argument("directory", help="Directorio de la caché")
+    parser.add_argument("--clear", action="store_true", help="Borrar todas las entradas")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        print(f"'{args.directory}' no es una carpeta.")
+        return 1
+    cache = DiskCache(args.directory)
+    entries = len(cache._entries())
+    if args.clear:
+        cache.clear()
+        print(f"{entries} entradas borradas de {args.directory}.")
+    else:
+        print(f"{args.directory}: {entries} entradas, {cache.current_bytes / 2**20:.1f} MiB "
+              f"(versión del código {code_version()})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
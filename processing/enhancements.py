@@ -1,16 +1,80 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import cv2
 import numpy as np
 
-def apply_filter(image, filter_type="median"):
+from processing.utils import to_uint8
+
+# Radio (px) de la vecindad que usa cada filtro: es el margen ("halo") que necesita
+# un trozo de imagen para que el resultado en su interior sea idéntico al de la
+# imagen completa. None = el filtro no es local (Canny propaga la histéresis).
+FILTER_HALO = {
+    "blur": 2,
+    "gaussian": 2,
+    "bilateral": 4,
+    "median": 2,
+    "sharpen": 1,
+    "sobel": 2,
+    "laplacian": 1,
+    "canny": None,
+    "emboss": 1,
+    "custom": 1,
+}
+
+# Por debajo de este tamaño repartir en bandas no compensa el coste de los hilos
+PARALLEL_MIN_PIXELS = 1_000_000
+
+_executors = {}  # número de hilos -> ThreadPoolExecutor compartido
+
+_DEPTHS = {np.dtype(np.float32): cv2.CV_32F, np.dtype(np.float64): cv2.CV_64F}
+
+
+def _gradient(compute, image, output_dtype=None):
+    """
+    Calcula un gradiente (Sobel/Laplaciano) sin pasar por float64:
+    - 8 bits: en CV_16S (cabe sin desbordar) y cv2.convertScaleAbs a uint8.
+    - 16 bits: en CV_32F y valor absoluto saturado a uint16.
+    - output_dtype float32/float64: el gradiente con signo en esa profundidad
+      (float64 era la salida anterior de apply_filter).
+    """
+    if output_dtype is not None and np.dtype(output_dtype) in _DEPTHS:
+        return compute(image, _DEPTHS[np.dtype(output_dtype)])
+    if image.dtype == np.uint8:
+        return cv2.convertScaleAbs(compute(image, cv2.CV_16S))
+    gradient = np.abs(compute(image, cv2.CV_32F), dtype=np.float32)
+    if image.dtype == np.uint16:
+        return np.clip(gradient, 0, 65535, out=gradient).astype(np.uint16)
+    return gradient
+
+
+def _bilateral(image):
+    if image.dtype == np.uint16:
+        # bilateralFilter no admite 16 bits: en float32 con sigmaColor en la misma escala
+        filtered = cv2.bilateralFilter(image.astype(np.float32), 9, 75 * 257, 75)
+        return np.clip(filtered, 0, 65535, out=filtered).astype(np.uint16)
+    return cv2.bilateralFilter(image, 9, 75, 75)
+
+
+def apply_filter(image, filter_type="median", workers=1, output_dtype=None):
+    """
+    Aplica el filtro `filter_type` a la imagen (8 o 16 bits por canal).
+    - workers: con más de 1, las imágenes grandes se dividen en bandas de filas
+      (con el solapamiento que necesita el filtro, ver FILTER_HALO) que se filtran
+      en paralelo en un pool de hilos; OpenCV libera el GIL y el resultado es
+      idéntico al de una sola llamada.
+    - output_dtype: sólo para "sobel" y "laplacian". Por defecto el resultado es
+      la magnitud del gradiente con la misma profundidad que la entrada; con
+      np.float32/np.float64 se devuelve el gradiente con signo.
+    """
     filters = {
         "blur": lambda img: cv2.blur(img, (5, 5)),
         "gaussian": lambda img: cv2.GaussianBlur(img, (5, 5), 0),
-        "bilateral": lambda img: cv2.bilateralFilter(img, 9, 75, 75),
+        "bilateral": _bilateral,
         "median": lambda img: cv2.medianBlur(img, 5),
         "sharpen": lambda img: cv2.filter2D(img, -1, np.array([[-1,-1,-1],[-1,9,-1],[-1,-1,-1]])),
-        "sobel": lambda img: cv2.Sobel(img, cv2.CV_64F, 1, 0, ksize=5),
-        "laplacian": lambda img: cv2.Laplacian(img, cv2.CV_64F),
-        "canny": lambda img: cv2.Canny(img, 100, 200),
+        "sobel": lambda img: _gradient(lambda i, depth: cv2.Sobel(i, depth, 1, 0, ksize=5), img, output_dtype),
+        "laplacian": lambda img: _gradient(lambda i, depth: cv2.Laplacian(i, depth), img, output_dtype),
+        "canny": lambda img: cv2.Canny(to_uint8(img), 100, 200), # Canny sólo admite 8 bits
         "emboss": lambda img: cv2.filter2D(img, -1, np.array([[ -2, -1, 0], [ -1, 1, 1], [ 0, 1, 2]])),
         "custom": lambda img: cv2.filter2D(img, -1, np.ones((3, 3), np.float32) / 9)
     }
@@ -18,4 +82,36 @@ def apply_filter(image, filter_type="median"):
     if func is None:
         print(f"Filtro '{filter_type}' no reconocido, devolviendo imagen original.")
         return image
-    return func(image)
+    halo = FILTER_HALO.get(filter_type)
+    if workers <= 1 or halo is None or image.shape[0] * image.shape[1] < PARALLEL_MIN_PIXELS:
+        return func(image)
+    return _apply_in_bands(image, func, halo, workers)
+
+
+def _get_executor(workers):
+    executor = _executors.get(workers)
+    if executor is None:
+        executor = _executors.setdefault(workers, ThreadPoolExecutor(max_workers=workers))
+    return executor
+
+
+def _apply_in_bands(image, func, halo, workers):
+    """Filtra la imagen por bandas de filas en paralelo y las ensambla en un único array."""
+    height = image.shape[0]
+    band_height = -(-height // workers) # División con redondeo hacia arriba
+    bands = []
+    for y0 in range(0, height, band_height):
+        y1 = min(height, y0 + band_height)
+        r0, r1 = max(0, y0 - halo), min(height, y1 + halo)
+        bands.append((y0, y1, r0, r1))
+
+    executor = _get_executor(workers)
+    futures = [executor.submit(func, image[r0:r1]) for (_, _, r0, r1) in bands]
+
+    out = None
+    for (y0, y1, r0, _), future in zip(bands, futures):
+        band = future.result()
+        if out is None:
+            out = np.empty((height,) + band.shape[1:], dtype=band.dtype)
+        out[y0:y1] = band[y0 - r0:y1 - r0] # Descartar las filas de solapamiento
+    return out
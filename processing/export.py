@@ -0,0 +1,166 @@
+"""
+Exportación del objeto recortado con fondo transparente (PNG o WebP sin pérdida).
+
+- El buffer BGRA se reserva una sola vez y se rellena directamente desde la
+  imagen y la máscara, sin copias ni conversiones intermedias.
+- Opcionalmente se recorta al rectángulo que contiene la máscara: con objetos
+  pequeños el archivo y el tiempo de codificación bajan mucho.
+- Cada exportación va a un archivo propio. export_transparent codifica y escribe
+  en un hilo en segundo plano (cv2.imencode libera el GIL) para solaparlo con el
+  procesamiento siguiente, p. ej. en los lotes; save_transparent lo hace en el
+  hilo que llama, para quien necesita el archivo enseguida.
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from processing.utils import to_uint8
+
+EXPORT_FORMATS = ("png", "webp")
+PNG_STRATEGIES = {
+    "default": cv2.IMWRITE_PNG_STRATEGY_DEFAULT,
+    "filtered": cv2.IMWRITE_PNG_STRATEGY_FILTERED,
+    "huffman": cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+    "rle": cv2.IMWRITE_PNG_STRATEGY_RLE,
+    "fixed": cv2.IMWRITE_PNG_STRATEGY_FIXED,
+}
+DEFAULT_PNG_COMPRESSION = 1 # 0-9, el mismo valor por defecto que cv2.imwrite (el más rápido)
+WEBP_LOSSLESS_QUALITY = 101 # En OpenCV, calidad > 100 significa WebP sin pérdida
+
+
+def mask_bbox(mask, margin=0):
+    """
+    Rectángulo (x, y, ancho, alto) que contiene los píxeles no nulos de la
+    máscara, ampliado `margin` px sin salirse de la imagen. None si está vacía.
+    """
+    x, y, w, h = cv2.boundingRect(mask)
+    if w == 0 or h == 0:
+        return None
+    height, width = mask.shape[:2]
+    x0, y0 = max(0, x - margin), max(0, y - margin)
+    x1, y1 = min(width, x + w + margin), min(height, y + h + margin)
+    return (x0, y0, x1 - x0, y1 - y0)
+
+
+def compose_bgra(image, mask, crop=False, margin=0, out=None):
+    """
+    Imagen BGRA con la máscara como canal alfa, en un único buffer.
+    Args:
+        image: imagen BGR (uint8 o uint16; en 16 bits el alfa se escala a 0-65535).
+        mask: máscara de un canal (objeto 255, fondo 0). Si su tamaño no coincide
+              con la imagen se redimensiona y se vuelve a binarizar.
+        crop (bool): recortar al rectángulo de la máscara (más `margin` px).
+        out: buffer (alto, ancho, 4) ya reservado del tamaño del resultado.
+    Returns:
+        np.ndarray: la imagen BGRA.
+    """
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    if mask.ndim == 3:
+        mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
+    if mask.shape[:2] != image.shape[:2]:
+        mask = cv2.resize(mask, (image.shape[1], image.shape[0]))
+        _, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+
+    if crop:
+        bbox = mask_bbox(mask, margin)
+        if bbox is not None:
+            x, y, w, h = bbox
+            image, mask = image[y:y + h, x:x + w], mask[y:y + h, x:x + w]
+
+    if out is None:
+        out = np.empty(image.shape[:2] + (4,), image.dtype)
+    out[..., :3] = image
+    alpha = out[..., 3]
+    alpha[...] = mask # El objeto será opaco, el fondo transparente
+    if out.dtype == np.uint16:
+        alpha *= 257 # Alfa en la escala de 16 bits
+    return out
+
+
+def encode_params(fmt="png", compression=DEFAULT_PNG_COMPRESSION, strategy="default"):
+    """Parámetros de cv2.imencode para el formato de exportación."""
+    if fmt == "png":
+        if strategy not in PNG_STRATEGIES:
+            raise ValueError(f"Estrategia PNG no válida: {strategy}. Usa una de: {', '.join(PNG_STRATEGIES)}")
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(compression), cv2.IMWRITE_PNG_STRATEGY, PNG_STRATEGIES[strategy]]
+    if fmt == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, WEBP_LOSSLESS_QUALITY]
+    raise ValueError(f"Formato de exportación no válido: {fmt}. Usa uno de: {', '.join(EXPORT_FORMATS)}")
+
+
+def unique_path(directory=None, prefix="objeto_transparente_", fmt="png"):
+    """Ruta nueva y reservada (el archivo se crea vacío) para que dos exportaciones no se pisen."""
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix="." + fmt, dir=directory)
+    os.close(fd)
+    return path
+
+
+def write_image(path, image, fmt="png", compression=DEFAULT_PNG_COMPRESSION, strategy="default"):
+    """Codifica y escribe `image` en `path`. Devuelve `path`; lanza OSError si falla."""
+    if fmt == "webp" and image.dtype != np.uint8:
+        image = to_uint8(image) # WebP sólo admite 8 bits
+    ok, data = cv2.imencode("." + fmt, image, encode_params(fmt, compression, strategy))
+    if not ok:
+        raise OSError(f"No se pudo codificar la imagen como {fmt}")
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path) # Quien espere el archivo lo ve completo o no lo ve
+    return path
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+        return _writer
+
+
+def _prepare(image, mask, directory, fmt, crop, margin, compression, strategy, path):
+    encode_params(fmt, compression, strategy) # Validar antes de componer
+    bgra = compose_bgra(image, mask, crop, margin)
+    if path is None:
+        path = unique_path(directory, fmt=fmt)
+    return path, bgra
+
+
+def save_transparent(image, mask, directory=None, fmt="png", crop=False, margin=0,
+                     compression=DEFAULT_PNG_COMPRESSION, strategy="default", path=None):
+    """
+    Compone el objeto transparente y lo escribe en el hilo actual (para quien
+    necesita el archivo enseguida, como la interfaz). Mismos argumentos que
+    export_transparent. Returns: la ruta escrita.
+    """
+    path, bgra = _prepare(image, mask, directory, fmt, crop, margin, compression, strategy, path)
+    return write_image(path, bgra, fmt, compression, strategy)
+
+
+def export_transparent(image, mask, directory=None, fmt="png", crop=False, margin=0,
+                       compression=DEFAULT_PNG_COMPRESSION, strategy="default", path=None):
+    """
+    Compone el objeto transparente y lo escribe en segundo plano.
+    Args:
+        image, mask: imagen BGR y máscara del objeto (ver compose_bgra).
+        directory (str): carpeta de salida (por defecto la temporal del sistema).
+        fmt (str): "png" o "webp" (sin pérdida).
+        crop (bool): recortar al rectángulo de la máscara (más `margin` px).
+        compression (int): nivel de compresión PNG (0-9).
+        strategy (str): estrategia de zlib para PNG (ver PNG_STRATEGIES).
+        path (str): ruta de salida fija; por defecto una nueva y única (unique_path).
+    Returns:
+        concurrent.futures.Future: se resuelve con la ruta escrita.
+    """
+    path, bgra = _prepare(image, mask, directory, fmt, crop, margin, compression, strategy, path)
+    return _get_writer().submit(write_image, path, bgra, fmt, compression, strategy)
@@ -0,0 +1,254 @@
+"""
+Almacén de fotogramas decodificados para las bibliotecas images/ y backgrounds/.
+
+Cada imagen de una carpeta se decodifica una sola vez y sus píxeles (uint8) se
+guardan seguidos en un archivo binario; un índice JSON indica para cada nombre
+su posición, forma y la firma (mtime, tamaño) del archivo original. Al leer, el
+archivo se mapea en memoria y cada imagen es una vista sin copia: varios procesos
+comparten las mismas páginas a través de la caché de páginas del sistema.
+
+La reconstrucción es incremental: sólo se decodifican los archivos nuevos o
+modificados, que se añaden al final; el espacio de los que cambiaron o se
+borraron se recupera compactando (--compact o cuando supera la mitad del archivo).
+
+Uso:
+    python -m processing.frame_store images/ backgrounds/ [--compact]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+
+STORE_DIRNAME = ".frame_store"
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+ALIGNMENT = 64 # Cada imagen empieza en un múltiplo de 64 bytes
+
+
+def _signature(path):
+    # Misma firma que cache.file_signature (sin importar cache, que usa este módulo)
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _empty_index():
+    return {"version": INDEX_VERSION, "generation": 0, "data_bytes": 0, "frames": {}}
+
+
+def _data_filename(generation):
+    # Cada compactación escribe un archivo nuevo: los lectores con el índice
+    # anterior siguen leyendo el archivo viejo hasta que recargan
+    return f"frames-{generation}.bin"
+
+
+def _read_index(index_path):
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return _empty_index()
+    if index.get("version") != INDEX_VERSION:
+        return _empty_index()
+    return index
+
+
+def _write_index(index_path, index):
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path) # Los lectores ven el índice viejo o el nuevo, nunca uno a medias
+
+
+def _list_folder(folder):
+    return sorted(f for f in os.listdir(folder)
+                  if f.lower().endswith(IMAGE_EXTENSIONS) and os.path.isfile(os.path.join(folder, f)))
+
+
+def _append(data_file, image):
+    """Escribe la imagen alineada al final del archivo y devuelve su offset."""
+    offset = -(-data_file.seek(0, os.SEEK_END) // ALIGNMENT) * ALIGNMENT
+    data_file.seek(offset)
+    data_file.write(np.ascontiguousarray(image).tobytes())
+    return offset
+
+
+def rebuild(folder, store_dir=None, compact=False, progress=None):
+    """
+    Actualiza el almacén de `folder`: decodifica sólo los archivos nuevos o
+    modificados, quita del índice los borrados y compacta si se pide o si el
+    espacio sin usar supera la mitad del archivo.
+    Returns:
+        dict: {"added", "updated", "removed", "kept", "compacted"}
+    """
+    store_dir = store_dir or os.path.join(folder, STORE_DIRNAME)
+    index_path = os.path.join(store_dir, INDEX_FILENAME)
+    os.makedirs(store_dir, exist_ok=True)
+    index = _read_index(index_path)
+    data_path = os.path.join(store_dir, _data_filename(index["generation"]))
+    if not os.path.exists(data_path):
+        index["frames"] = {} # Sin datos el índice no sirve
+    frames = index["frames"]
+    names = _list_folder(folder)
+    stats = {"added": 0, "updated": 0, "removed": 0, "kept": 0, "compacted": False}
+
+    for name in set(frames) - set(names):
+        del frames[name]
+        stats["removed"] += 1
+
+    live_bytes = sum(int(np.prod(entry["shape"])) for entry in frames.values())
+    data_bytes = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+    old_data_path = None
+    if compact or data_bytes > 2 * live_bytes + ALIGNMENT * len(frames):
+        index["generation"] += 1
+        old_data_path, data_path = data_path, os.path.join(store_dir, _data_filename(index["generation"]))
+        _compact(old_data_path, data_path, frames)
+        stats["compacted"] = True
+
+    with open(data_path, "r+b" if os.path.exists(data_path) else "w+b") as data_file:
+        for name in names:
+            path = os.path.join(folder, name)
+            signature = _signature(path)
+            entry = frames.get(name)
+            if entry is not None and entry["signature"] == signature:
+                stats["kept"] += 1
+                continue
+            image = cv2.imread(path, cv2.IMREAD_COLOR)
+            if image is None:
+                if progress:
+                    progress(f"ADVERTENCIA: no se pudo decodificar {path}, se omite")
+                continue
+            frames[name] = {"offset": _append(data_file, image), "shape": list(image.shape),
+                            "signature": signature}
+            stats["updated" if entry is not None else "added"] += 1
+            if progress:
+                progress(f"{path}: {image.shape[1]}x{image.shape[0]}")
+        data_file.flush()
+        index["data_bytes"] = data_file.seek(0, os.SEEK_END)
+
+    _write_index(index_path, index)
+    if old_data_path is not None and os.path.exists(old_data_path):
+        os.remove(old_data_path) # Los lectores que aún lo tengan mapeado conservan sus páginas
+    return stats
+
+
+def _compact(old_data_path, data_path, frames):
+    """Copia a un archivo nuevo sólo las imágenes del índice (actualiza los offsets)."""
+    with open(data_path, "wb") as data_file:
+        if not frames or not os.path.exists(old_data_path):
+            return
+        source = np.memmap(old_data_path, dtype=np.uint8, mode="r")
+        for entry in frames.values():
+            nbytes = int(np.prod(entry["shape"]))
+            entry["offset"] = _append(data_file, source[entry["offset"]:entry["offset"] + nbytes])
+        del source
+
+
+class FrameStore:
+    """
+    Lector de un almacén: mapea el archivo de datos una vez y entrega cada imagen
+    como una vista de solo lectura. Si el índice cambia en disco (reconstrucción)
+    se vuelve a cargar en el siguiente acceso.
+    """
+
+    def __init__(self, folder, store_dir=None):
+        self.folder = folder
+        self.store_dir = store_dir or os.path.join(folder, STORE_DIRNAME)
+        self.index_path = os.path.join(self.store_dir, INDEX_FILENAME)
+        self._index_signature = None
+        self._frames = {}
+        self._data = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            signature = _signature(self.index_path)
+        except OSError:
+            self._frames, self._data, self._index_signature = {}, None, None
+            return
+        if signature == self._index_signature:
+            return
+        index = _read_index(self.index_path)
+        data_path = os.path.join(self.store_dir, _data_filename(index["generation"]))
+        data = None
+        if index["frames"] and os.path.exists(data_path):
+            data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        self._frames, self._data, self._index_signature = index["frames"], data, signature
+
+    def names(self):
+        """Nombres indexados, ordenados (sin listar la carpeta)."""
+        with self._lock:
+            self._refresh()
+            return sorted(self._frames)
+
+    def get(self, name, check=True):
+        """
+        Vista (alto, ancho, 3) BGR de solo lectura de la imagen `name`, o None si
+        no está en el almacén. Con check=True se compara la firma del archivo
+        original y se devuelve None si cambió desde la última reconstrucción.
+        """
+        with self._lock:
+            self._refresh()
+            entry = self._frames.get(name)
+            data = self._data
+        if entry is None or data is None:
+            return None
+        if check:
+            try:
+                if _signature(os.path.join(self.folder, name)) != entry["signature"]:
+                    return None
+            except OSError:
+                return None
+        offset, shape = entry["offset"], tuple(entry["shape"])
+        return data[offset:offset + int(np.prod(shape))].view(np.ndarray).reshape(shape)
+
+
+_stores = {} # carpeta absoluta -> FrameStore
+_stores_lock = threading.Lock()
+
+
+def use_store(folder, store_dir=None):
+    """Activa la lectura desde el almacén de `folder` (ver lookup). Devuelve el FrameStore."""
+    store = FrameStore(folder, store_dir)
+    with _stores_lock:
+        _stores[os.path.abspath(folder)] = store
+    return store
+
+
+def get_store(folder):
+    return _stores.get(os.path.abspath(folder))
+
+
+def lookup(path):
+    """Imagen de `path` desde un almacén activo, o None si no hay almacén o no está al día."""
+    if not _stores:
+        return None
+    folder, name = os.path.split(os.path.abspath(path))
+    store = _stores.get(folder)
+    return store.get(name) if store is not None else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decodifica una vez las imágenes de una carpeta en un almacén mapeable en memoria.")
+    parser.add_argument("folders", nargs="+", help="Carpetas de imágenes (p. ej. images/ backgrounds/)")
+    parser.add_argument("--compact", action="store_true", help="Recuperar el espacio de imágenes modificadas o borradas")
+    parser.add_argument("--quiet", action="store_true", help="No listar cada imagen decodificada")
+    args = parser.parse_args(argv)
+
+    for folder in args.folders:
+        if not os.path.isdir(folder):
+            print(f"'{folder}' no es una carpeta.")
+            return 1
+        stats = rebuild(folder, compact=args.compact, progress=None if args.quiet else print)
+        print(f"{folder}: {stats['added']} nuevas, {stats['updated']} actualizadas, "
+              f"{stats['removed']} eliminadas, {stats['kept']} sin cambios"
+              + (" (compactado)" if stats["compacted"] else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+Instrumentación opcional del pipeline: tiempo, forma/tipo del resultado y
+memoria por etapa.
+
+Desactivada por defecto (coste casi nulo: run_pipeline sólo comprueba
+`enabled`). Se activa con la variable de entorno PIPELINE_METRICS=1 o con
+enable(). Los datos se publican como:
+- logs estructurados (una línea JSON por ejecución en el logger "processing.pipeline"),
+- métricas en formato de texto de Prometheus (metrics_text / write_metrics / serve_metrics),
+- la lista de registros de la ejecución, para mostrarla en la interfaz.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+logger = logging.getLogger("processing.pipeline")
+
+enabled = os.environ.get("PIPELINE_METRICS", "0") == "1"
+track_memory = os.environ.get("PIPELINE_METRICS_MEMORY", "0") == "1"
+
+_lock = threading.Lock()
+_totals = {}  # etapa -> {"count", "seconds", "cache_hits", "output_bytes", "allocated_bytes"}
+
+
+def enable(memory=False):
+    """
+    Activa la instrumentación. Con memory=True también mide la memoria reservada
+    por cada etapa con tracemalloc (más costoso, y aproximado con peticiones concurrentes).
+    """
+    global enabled, track_memory
+    enabled = True
+    track_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+if track_memory and not tracemalloc.is_tracing():
+    tracemalloc.start() # Igual que enable(memory=True) cuando se activa por entorno
+
+
+def disable():
+    global enabled, track_memory
+    enabled = False
+    track_memory = False
+
+
+def _describe(value):
+    """Forma, tipo y bytes del artefacto principal de una etapa."""
+    if isinstance(value, tuple):
+        value = value[1] if len(value) > 1 else value[0] # En "display" el resultado es el segundo
+    if isinstance(value, np.ndarray):
+        return list(value.shape), str(value.dtype), int(value.nbytes)
+    return None, None, 0
+
+
+class StageTimer:
+    """Mide una etapa: se crea justo antes de ejecutarla y se cierra con finish()."""
+
+    def __init__(self, stage_name):
+        self.stage_name = stage_name
+        self.start = time.perf_counter()
+        self.memory_start = None
+        if track_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+
+    def finish(self, previous, artifacts, cached):
+        seconds = time.perf_counter() - self.start
+        allocated = None
+        if self.memory_start is not None:
+            allocated = max(0, tracemalloc.get_traced_memory()[1] - self.memory_start)
+
+        # El resultado de la etapa es el primer artefacto nuevo o reemplazado
+        output = None
+        for name, value in artifacts.items():
+            if previous.get(name) is not value and not isinstance(value, bool):
+                output = value
+                break
+        shape, dtype, nbytes = _describe(output)
+        return {
+            "stage": self.stage_name,
+            "seconds": seconds,
+            "cached": cached,
+            "shape": shape,
+            "dtype": dtype,
+            "output_bytes": nbytes,
+            "allocated_bytes": allocated,
+        }
+
+
+def publish(filename, records):
+    """Acumula los registros de una ejecución y los emite como log estructurado."""
+    with _lock:
+        for record in records:
+            totals = _totals.setdefault(record["stage"], {
+                "count": 0, "seconds": 0.0, "cache_hits": 0, "output_bytes": 0, "allocated_bytes": 0,
+            })
+            totals["count"] += 1
+            totals["seconds"] += record["seconds"]
+            totals["cache_hits"] += 1 if record["cached"] else 0
+            totals["output_bytes"] += record["output_bytes"]
+            totals["allocated_bytes"] += record["allocated_bytes"] or 0
+    logger.info(json.dumps({
+        "event": "pipeline_run",
+        "filename": filename,
+        "total_seconds": sum(record["seconds"] for record in records),
+        "stages": records,
+    }))
+
+
+def format_records(records):
+    """Tabla legible de una ejecución (para la interfaz o la consola)."""
+    lines = ["| Etapa | Tiempo (ms) | Caché | Salida | MiB |", "|---|---|---|---|---|"]
+    for r in records:
+        shape = "x".join(str(d) for d in r["shape"]) if r["shape"] else "-"
+        lines.append(f"| {r['stage']} | {r['seconds'] * 1000:.2f} | {'sí' if r['cached'] else 'no'} "
+                     f"| {shape} {r['dtype'] or ''} | {r['output_bytes'] / 2**20:.2f} |")
+    total = sum(r["seconds"] for r in records)
+    lines.append(f"| **total** | {total * 1000:.2f} | | | |")
+    return "\n".join(lines)
+
+
+def metrics_text():
+    """Métricas acumuladas en formato de texto de Prometheus."""
+    with _lock:
+        totals = {stage: dict(values) for stage, values in _totals.items()}
+    metrics = [
+        ("pipeline_stage_runs_total", "counter", "Ejecuciones de cada etapa (incluidos aciertos de caché)", "count"),
+        ("pipeline_stage_seconds_total", "counter", "Tiempo acumulado por etapa en segundos", "seconds"),
+        ("pipeline_stage_cache_hits_total", "counter", "Aciertos de caché por etapa", "cache_hits"),
+        ("pipeline_stage_output_bytes_total", "counter", "Bytes de los resultados producidos por etapa", "output_bytes"),
+        ("pipeline_stage_allocated_bytes_total", "counter", "Bytes reservados por etapa (tracemalloc)", "allocated_bytes"),
+    ]
+    lines = []
+    for name, kind, help_text, field in metrics:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for stage, values in sorted(totals.items()):
+            lines.append(f'{name}{{stage="{stage}"}} {values[field]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    """Vuelca las métricas a un archivo (p. ej. para el textfile collector de node_exporter)."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(metrics_text())
+    os.replace(tmp_path, path)
+
+
+def reset():
+    with _lock:
+        _totals.clear()
+
+
+def serve_metrics(port, host="0.0.0.0"):
+    """Sirve /metrics en un hilo en segundo plano y devuelve el servidor."""
+    # http.server sólo se importa si se sirven métricas (acelera el arranque)
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Sin un log por cada scrape
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,613 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from processing import disk_cache, instrumentation
+from processing.cache import imread_cached, file_signature, resized_cached, downscaled_cached
+from processing.color_operations import hex_to_rgb
+from processing.background_removal import (
+    remove_background_hsv, remove_background_lab, remove_background_auto, grabcut, grabcut_multiscale
+)
+from processing.background_change import change_background_color, change_background_image
+from processing.collage import build_collage, fit_rect, stack_images
+from processing.spec import compile_spec, spec_from_params
+from processing.utils import to_uint8, match_depth
+from processing.workers import offload
+
+IMAGE_DIR = "images"
+BACKGROUND_DIR = "backgrounds"
+
+# Límite por defecto de la caché de resultados por etapa (en bytes)
+DEFAULT_STAGE_CACHE_BYTES = 512 * 1024 * 1024
+
+# Parámetros de process_all con sus valores por defecto (los mismos que la interfaz)
+DEFAULT_PARAMS = {
+    "image_dir": IMAGE_DIR,
+    "background_dir": BACKGROUND_DIR,
+    "color_space": "RGB",
+    "rotate_angle": 0,
+    "flip_mode": "horizontal",
+    "brightness": 0,
+    "contrast": 0,
+    "gamma": 1.0,
+    "filter_type": "None",
+    "filter_workers": 1, # Hilos para filtrar por bandas las imágenes grandes
+    "threshold_type": "None",
+    "threshold_value": 128,
+    "bitwise_op": "None",
+    "background_removal_method": "None",
+    "grabcut_max_side": 512, # Lado mayor de trabajo para "GrabCut (multiescala)"
+    "bg_range": None, # (inferior, superior) fijo para "HSV"/"LAB", p. ej. el estimado por "HSV (auto)"
+    "change_bg_mode": "None",
+    "bg_color": None,
+    "bg_image_name": None,
+    "bg_feather": 0, # Radio (px) para suavizar el borde del objeto al cambiar el fondo
+    "collage_mode": "None",
+    "collage_keep_aspect": True, # False = celdas de 300x300 deformando las imágenes (el aspecto anterior)
+    "detect_contours_flag": False,
+    "detect_faces_flag": False,
+    "face_max_side": None, # Lado mayor de la imagen reducida para detectar rostros (None = resolución completa)
+    "ops": None, # Especificación explícita de transformaciones (ver processing.spec)
+    "preview_max_side": None, # Si se indica, se procesa una copia reducida a este lado mayor (vista previa)
+    "keep_16bit": False, # Conservar la profundidad de las imágenes de 16 bits (la vista previa siempre es de 8 bits)
+}
+
+
+def load_image(folder, filename, keep_16bit=False):
+    """
+    Carga una imagen desde una carpeta específica.
+    Usa la caché de imágenes decodificadas: el array devuelto es de solo lectura.
+    Con keep_16bit=True las imágenes de 16 bits se cargan sin reducirlas a 8 bits.
+    """
+    path = os.path.join(folder, filename)
+    flags = cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH if keep_16bit else cv2.IMREAD_COLOR
+    try:
+        img = imread_cached(path, flags)
+        if img is None:
+            print(f"ADVERTENCIA: No se pudo cargar la imagen desde {path}. ¿Archivo corrupto o formato no soportado?")
+        return img
+    except Exception as e:
+        print(f"ERROR al cargar la imagen {path}: {e}")
+        return None
+
+
+def _to_bgr(image):
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+def _freeze(artifacts):
+    """Marca como solo lectura los arrays de un resultado que va a la caché."""
+    for value in artifacts.values():
+        for array in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+    return artifacts
+
+
+def _file_version(folder, filename):
+    try:
+        return file_signature(os.path.join(folder, filename))
+    except (OSError, TypeError):
+        return None
+
+
+# --- Etapas ---
+# Cada etapa recibe los artefactos de la etapa anterior (dict de solo lectura) y los
+# parámetros, y devuelve únicamente los artefactos que crea o reemplaza.
+# Si una etapa recurre a un resultado de emergencia tras un error (que puede ser
+# pasajero, como PoolBusyError o TimeoutError del pool) añade "fallback": True, y
+# ni ese resultado ni los que dependen de él se guardan en la caché.
+
+def _stage_load(artifacts, params):
+    if params["preview_max_side"]:
+        # Vista previa: copia reducida y cacheada de la imagen (decodificada una sola vez)
+        path = os.path.join(params["image_dir"], params["filename"])
+        image = downscaled_cached(path, params["preview_max_side"])
+        if image is None:
+            print(f"ADVERTENCIA: No se pudo cargar la imagen desde {path}. ¿Archivo corrupto o formato no soportado?")
+        return {"original": image}
+    image = load_image(params["image_dir"], params["filename"], params["keep_16bit"])
+    return {"original": image}
+
+
+def _stage_background_removal(artifacts, params):
+    # La segmentación trabaja en 8 bits (HSV/LAB y GrabCut de OpenCV no admiten 16 bits)
+    original_image = to_uint8(artifacts["original"])
+    method = params["background_removal_method"]
+    bg_range = params["bg_range"] or (None, None)
+    background_range = None
+    grabcut_timings = None
+    fallback = False
+    try:
+        if method == "HSV":
+            foreground, mask = remove_background_hsv(original_image, *bg_range)
+        elif method == "LAB":
+            foreground, mask = remove_background_lab(original_image, *bg_range)
+        elif method in ("HSV (auto)", "LAB (auto)"):
+            foreground, mask, background_range = remove_background_auto(original_image, method.split()[0])
+        elif method in ("GrabCut", "GrabCut (multiescala)"):
+            foreground, mask, grabcut_timings = _grabcut_cached(original_image, params)
+        else: # Si el método es "None" no se elimina el fondo
+            foreground = original_image
+            mask = np.zeros(original_image.shape[:2], dtype=np.uint8) # Máscara vacía
+    except Exception as e:
+        print(f"ERROR en eliminación de fondo ({method}): {e}")
+        foreground = original_image # Fallback a original si falla
+        mask = np.zeros(original_image.shape[:2], dtype=np.uint8)
+        fallback = True
+    if original_image is not artifacts["original"]:
+        # Imagen de 16 bits: el primer plano se recorta de la original con la máscara de 8 bits
+        original_image = artifacts["original"]
+        if method == "None" or not np.any(mask):
+            foreground = original_image
+        else:
+            foreground = cv2.bitwise_and(original_image, original_image, mask=mask)
+    result = {"foreground": foreground, "mask": mask, "background_range": background_range,
+              "grabcut_timings": grabcut_timings}
+    if fallback:
+        result["fallback"] = True
+    return result
+
+
+def _run_grabcut(image, params):
+    """GrabCut del método elegido. Returns: (primer plano, máscara, tiempos por fase o None)."""
+    if params["background_removal_method"] == "GrabCut":
+        return offload("grabcut", grabcut, image) + (None,)
+    return offload("grabcut_multiscale", grabcut_multiscale, image, max_side=params["grabcut_max_side"])
+
+
+def _grabcut_cached(image, params):
+    """
+    GrabCut con la máscara guardada en la caché de disco (processing.disk_cache),
+    si está activa: la clave es el contenido del archivo y los parámetros de GrabCut.
+    Returns: (primer plano, máscara, tiempos por fase; None si no se ejecutó la multiescala)
+    """
+    cache = disk_cache.get_cache()
+    if cache is None:
+        return _run_grabcut(image, params)
+    try:
+        key = disk_cache.make_key("grabcut", disk_cache.file_digest(_image_path(params)),
+                                  params["background_removal_method"], params["grabcut_max_side"],
+                                  params["preview_max_side"], params["keep_16bit"])
+    except OSError:
+        return _run_grabcut(image, params)
+    stored = cache.get(key)
+    if stored is not None:
+        mask = stored["mask"]
+        if not np.any(mask):
+            return image, mask, None
+        return cv2.bitwise_and(image, image, mask=mask), mask, None
+    foreground, mask, timings = _run_grabcut(image, params) # Si falla (p. ej. PoolBusyError) no se guarda nada
+    cache.put(key, {"mask": mask})
+    return foreground, mask, timings
+
+
+def _stage_background_change(artifacts, params):
+    original_image = artifacts["original"]
+    foreground = artifacts["foreground"]
+    mask = artifacts["mask"]
+    mode = params["change_bg_mode"]
+
+    if mask is None or not np.any(mask): # La máscara está vacía
+        if params["background_removal_method"] == "None":
+            return {"composed": original_image}
+        return {"composed": foreground}
+
+    try:
+        if mode == "Color" and params["bg_color"]:
+            bgr_color = hex_to_rgb(params["bg_color"])[::-1] # Convertir RGB a BGR
+            if original_image.dtype == np.uint16:
+                bgr_color = tuple(c * 257 for c in bgr_color)
+            composed = change_background_color(original_image, mask, bgr_color, feather=params["bg_feather"])
+        elif mode == "Image" and params["bg_image_name"]:
+            # Fondo ya redimensionado al tamaño de la imagen (cacheado entre peticiones)
+            h, w = original_image.shape[:2]
+            bg_image = resized_cached(os.path.join(params["background_dir"], params["bg_image_name"]), (w, h))
+            if bg_image is not None:
+                bg_image = match_depth(bg_image, original_image.dtype)
+                composed = change_background_image(original_image, mask, bg_image, feather=params["bg_feather"])
+            else:
+                print(f"ADVERTENCIA: No se pudo cargar el fondo {params['bg_image_name']}.")
+                composed = foreground # Fallback a imagen con fondo negro
+        else:
+            composed = foreground
+    except Exception as e:
+        print(f"ERROR en cambio de fondo ({mode}): {e}")
+        return {"composed": foreground, "fallback": True} # Fallback
+    return {"composed": composed}
+
+
+def _stage_prepare(artifacts, params):
+    # Punto de partida de las transformaciones: imagen compuesta en BGR de 3 canales
+    image = artifacts["composed"]
+    if image.ndim == 3 and image.shape[2] == 4: # Si es BGRA (raro aquí, por si acaso)
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    return {"processed": _to_bgr(image), "transform_failed": False}
+
+
+def _spec_stage(step):
+    """
+    Etapa que ejecuta un paso de la especificación compilada. Si una etapa anterior
+    falló se omite, y si esta falla el resultado vuelve a ser la imagen original
+    (como hacía process_all con todo el bloque de transformaciones).
+    """
+    def run(artifacts, params):
+        if artifacts.get("transform_failed"):
+            return {}
+        try:
+            return {"processed": step(artifacts["processed"])}
+        except Exception as e:
+            print(f"ERROR durante las operaciones de procesamiento: {e}")
+            return {"processed": artifacts["original"], "transform_failed": True, "fallback": True}
+    return Stage(step.name, run, lambda params: step.key)
+
+
+def _collage(images, cols, params):
+    """
+    Collage de la interfaz: celdas con la proporción de la primera imagen dentro
+    de 300x300 px y cada imagen encajada sin deformarla.
+    """
+    if not params["collage_keep_aspect"]:
+        return stack_images(images, cols=cols)
+    height, width = images[0].shape[:2]
+    _, _, cell_width, cell_height = fit_rect((width, height), (0, 0, 300, 300))
+    return build_collage(images, cols=cols, cell_size=(cell_width, cell_height), keep_aspect=True)
+
+
+def _stage_collage(artifacts, params):
+    # Lo que se muestra es siempre de 8 bits; "result" conserva la profundidad si no hay collage
+    original_rgb = cv2.cvtColor(to_uint8(artifacts["original"]), cv2.COLOR_BGR2RGB)
+    processed = artifacts["processed"]
+    collage_mode = params["collage_mode"]
+
+    if processed is not None:
+        processed_rgb = cv2.cvtColor(_to_bgr(to_uint8(processed)), cv2.COLOR_BGR2RGB)
+    else:
+        processed_rgb = np.zeros((300, 300, 3), dtype=np.uint8) # Imagen negra si es nula
+
+    if collage_mode == "Original vs Procesada (Horizontal)":
+        result = _collage([original_rgb, processed_rgb], 2, params)
+    elif collage_mode == "Original vs Procesada (Vertical)":
+        result = _collage([original_rgb, processed_rgb], 1, params)
+    elif collage_mode == "Procesada (Horizontal)":
+        result = _collage([processed_rgb, processed_rgb], 2, params)
+    elif collage_mode == "Procesada (Vertical)":
+        result = _collage([processed_rgb, processed_rgb], 1, params)
+    else:
+        result = processed
+    return {"result": result, "original_rgb": original_rgb}
+
+
+def _stage_output(artifacts, params):
+    original_image = artifacts["original"]
+    original_rgb = artifacts["original_rgb"]
+    result = artifacts["result"]
+
+    # Máscara del primer plano para depuración
+    display_mask = artifacts["mask"]
+    if display_mask is None:
+        display_mask = np.zeros(original_image.shape[:2], dtype=np.uint8) # Máscara vacía si no hay
+    if display_mask.ndim == 3: # Si por alguna razón la máscara tiene 3 canales
+        display_mask = cv2.cvtColor(display_mask, cv2.COLOR_BGR2GRAY)
+
+    if result is not None:
+        result = to_uint8(result)
+        if result.ndim == 3 and result.shape[2] == 3:
+            return {"display": (original_rgb, cv2.cvtColor(result, cv2.COLOR_BGR2RGB), display_mask)}
+        elif result.ndim == 2:
+            return {"display": (original_rgb, cv2.cvtColor(result, cv2.COLOR_GRAY2RGB), display_mask)}
+
+    print("ADVERTENCIA: Formato de imagen final inesperado o imagen nula. Devolviendo imagen original y máscara vacía.")
+    return {"display": (original_rgb, cv2.cvtColor(to_uint8(original_image), cv2.COLOR_BGR2RGB),
+                        np.zeros(original_image.shape[:2], dtype=np.uint8))}
+
+
+def _image_path(params):
+    return os.path.join(params["image_dir"], params["filename"])
+
+
+def _preview_side(params):
+    """
+    Lado mayor de la vista previa, o None si la imagen ya cabe: en ese caso
+    downscaled_cached devuelve la original y la ejecución es idéntica a la de
+    resolución completa, así que comparte con ella las claves de la caché.
+    """
+    image = imread_cached(_image_path(params))
+    if image is not None and max(image.shape[:2]) <= params["preview_max_side"]:
+        return None
+    return params["preview_max_side"]
+
+
+def _load_key(params):
+    return (params["image_dir"], params["filename"], params["preview_max_side"], params["keep_16bit"],
+            _file_version(params["image_dir"], params["filename"]))
+
+
+def _background_removal_key(params):
+    bg_range = params["bg_range"]
+    if bg_range is not None: # Puede venir de JSON como listas
+        bg_range = tuple(tuple(bound) for bound in bg_range)
+    return (params["background_removal_method"], params["grabcut_max_side"], bg_range)
+
+
+def _background_change_key(params):
+    mode = params["change_bg_mode"]
+    if mode == "Color":
+        return (mode, params["bg_color"], params["bg_feather"])
+    if mode == "Image":
+        return (mode, params["background_dir"], params["bg_image_name"], params["bg_feather"],
+                _file_version(params["background_dir"], params["bg_image_name"]))
+    return (mode,)
+
+
+class Stage:
+    """
+    Etapa del pipeline: una función y los parámetros de los que depende.
+    `key` puede ser una lista de nombres de parámetros o una función que
+    construye la parte de la clave propia de la etapa.
+    """
+
+    def __init__(self, name, func, key=()):
+        self.name = name
+        self.func = func
+        self.key = key
+
+    def key_for(self, params):
+        if callable(self.key):
+            return self.key(params)
+        return tuple(params[name] for name in self.key)
+
+
+# Etapas fijas antes y después de las transformaciones. Entre medias van las
+# etapas de la especificación (processing.spec), una por paso compilado.
+HEAD_STAGES = [
+    Stage("load", _stage_load, _load_key),
+    Stage("background_removal", _stage_background_removal, _background_removal_key),
+    Stage("background_change", _stage_background_change, _background_change_key),
+    Stage("prepare", _stage_prepare),
+]
+TAIL_STAGES = [
+    Stage("collage", _stage_collage, ["collage_mode", "collage_keep_aspect"]),
+    Stage("output", _stage_output),
+]
+
+
+def build_stages(params):
+    """
+    Lista completa de etapas para unos parámetros. Las transformaciones salen de
+    params["ops"] si existe o, si no, de los controles de la interfaz (spec_from_params).
+    """
+    ops = params.get("ops")
+    if ops is None:
+        ops = spec_from_params(params)
+    return HEAD_STAGES + [_spec_stage(step) for step in compile_spec(ops)] + TAIL_STAGES
+
+
+def _new_bytes(artifacts, previous):
+    """Bytes de los arrays de `artifacts` que no venían ya en `previous` (compartidos entre etapas)."""
+    seen = {id(array) for value in (previous or {}).values()
+            for array in (value if isinstance(value, tuple) else (value,))}
+    total = 0
+    for value in artifacts.values():
+        for array in (value if isinstance(value, tuple) else (value,)):
+            if isinstance(array, np.ndarray) and id(array) not in seen:
+                seen.add(id(array))
+                total += array.nbytes
+    return total
+
+
+class StageCache:
+    """
+    Caché de resultados por etapa. La clave de cada etapa incluye la clave de la
+    etapa anterior, así que un cambio de parámetro sólo invalida las etapas
+    posteriores. El total está acotado a `max_bytes` (como cache.ImageCache) y
+    cada etapa conserva como máximo `max_entries` resultados.
+    Al superar el límite se expulsan primero los resultados más baratos de
+    recalcular: cada uno tiene la prioridad `edad + coste` (GreedyDual), donde el
+    coste son los segundos que tardó su etapa y la edad sube con cada expulsión,
+    para que los resultados caros que ya no se usan también acaben saliendo.
+    Nunca se expulsan los de la cadena de la ejecución en curso (`protected`).
+    Cada resultado cuenta sólo los arrays que crea su etapa: los que hereda de
+    la anterior ya se cuentan allí.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_STAGE_CACHE_BYTES, max_entries=4):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.current_bytes = 0
+        self._entries = {}      # nombre de etapa -> OrderedDict(clave -> artefactos)
+        self._costs = OrderedDict()  # (etapa, clave) -> [bytes, coste, prioridad], del menos al más usado
+        self._age = 0.0
+        self._stats = {}        # nombre de etapa -> {"hits": int, "misses": int}
+        self._lock = threading.Lock()
+
+    def get(self, stage_name, key):
+        with self._lock:
+            entries = self._entries.setdefault(stage_name, OrderedDict())
+            stats = self._stats.setdefault(stage_name, {"hits": 0, "misses": 0})
+            artifacts = entries.get(key)
+            if artifacts is None:
+                stats["misses"] += 1
+                return None
+            entries.move_to_end(key)
+            self._costs.move_to_end((stage_name, key))
+            cost = self._costs[(stage_name, key)]
+            cost[2] = self._age + cost[1]
+            stats["hits"] += 1
+            return artifacts
+
+    def put(self, stage_name, key, artifacts, previous=None, cost=0.0, protected=()):
+        """
+        Guarda el resultado de una etapa.
+        Args:
+            previous: artefactos que recibió la etapa (sus arrays no se cuentan).
+            cost (float): segundos que tardó en calcularse.
+            protected: pares (etapa, clave) que no se pueden expulsar, normalmente
+                       las etapas anteriores de la misma ejecución.
+        """
+        nbytes = _new_bytes(artifacts, previous)
+        if nbytes > self.max_bytes:
+            return # Demasiado grande para la caché, no se guarda
+        with self._lock:
+            entries = self._entries.setdefault(stage_name, OrderedDict())
+            if key in entries:
+                self._remove(stage_name, key)
+            entries[key] = artifacts
+            self._costs[(stage_name, key)] = [nbytes, cost, self._age + cost]
+            self.current_bytes += nbytes
+            while len(entries) > self.max_entries:
+                self._remove(stage_name, next(iter(entries)))
+            protected = set(protected)
+            while self.current_bytes > self.max_bytes:
+                candidates = [(value[2], entry) for entry, value in self._costs.items()
+                              if value[0] and entry not in protected]
+                if not candidates:
+                    break # Sólo queda la cadena en curso: se tolera el exceso hasta la próxima ejecución
+                priority, entry = min(candidates, key=lambda candidate: candidate[0]) # El primero es el menos usado
+                self._age = priority
+                self._remove(*entry)
+
+    def _remove(self, stage_name, key):
+        del self._entries[stage_name][key]
+        self.current_bytes -= self._costs.pop((stage_name, key))[0]
+
+    def stats(self):
+        with self._lock:
+            return {name: dict(stats, entries=len(self._entries.get(name, ())))
+                    for name, stats in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._costs.clear()
+            self._stats.clear()
+            self._age = 0.0
+            self.current_bytes = 0
+
+
+stage_cache = StageCache()
+
+
+def stage_stats():
+    """Contadores de aciertos/fallos por etapa de la caché global."""
+    return stage_cache.stats()
+
+
+# Parámetros que no cambian el resultado (o que entran en la clave por su contenido)
+_RESULT_KEY_EXCLUDED = ("image_dir", "background_dir", "filename", "bg_image_name", "filter_workers")
+# Artefactos que se guardan en la caché de disco; "original" se vuelve a cargar
+_RESULT_ARTIFACTS = ("mask", "foreground", "result")
+
+
+def _result_key(params):
+    """
+    Clave de contenido del resultado final: contenido de la imagen (y del fondo
+    si se usa), parámetros normalizados y versión del código. None si no se puede leer.
+    """
+    try:
+        background = None
+        if params["change_bg_mode"] == "Image" and params["bg_image_name"]:
+            background = disk_cache.file_digest(os.path.join(params["background_dir"], params["bg_image_name"]))
+        image = disk_cache.file_digest(_image_path(params))
+    except OSError:
+        return None
+    relevant = {name: value for name, value in params.items() if name not in _RESULT_KEY_EXCLUDED}
+    return disk_cache.make_key("result", image, background, relevant)
+
+
+def _load_result(cache, key, params):
+    stored = cache.get(key)
+    if stored is None:
+        return None
+    original = _stage_load({}, params)["original"]
+    if original is None:
+        return None
+    artifacts = {name: stored.get(name) for name in _RESULT_ARTIFACTS}
+    artifacts["original"] = original
+    artifacts["display"] = (stored["display_original"], stored["display_result"], stored["display_mask"])
+    bg_range = stored.get("background_range")
+    artifacts["background_range"] = None if bg_range is None else tuple(tuple(int(v) for v in bound) for bound in bg_range)
+    return artifacts
+
+
+def _store_result(cache, key, artifacts):
+    arrays = {name: artifacts[name] for name in _RESULT_ARTIFACTS if isinstance(artifacts.get(name), np.ndarray)}
+    arrays["display_original"], arrays["display_result"], arrays["display_mask"] = artifacts["display"]
+    if artifacts.get("background_range") is not None:
+        arrays["background_range"] = np.array(artifacts["background_range"])
+    cache.put(key, arrays)
+
+
+def run_pipeline(filename, params=None, cache=None, records=None):
+    """
+    Ejecuta el pipeline completo sobre `filename` reutilizando los resultados
+    cacheados de las etapas cuyas entradas no cambiaron.
+    Si hay una caché de disco activa (processing.disk_cache), el resultado final
+    de las ejecuciones a resolución completa se busca y se guarda también allí.
+    Si la instrumentación está activa (ver processing.instrumentation) se mide
+    cada etapa; los registros se añaden también a la lista `records` si se pasa.
+    Returns:
+        dict: artefactos de la última etapa ("original", "mask", "foreground",
+        "display", ...; "fallback" si alguna etapa falló y usó un resultado de
+        emergencia) o None si la imagen no se pudo cargar.
+    """
+    if cache is None:
+        cache = stage_cache
+    full_params = dict(DEFAULT_PARAMS)
+    if params:
+        full_params.update(params)
+    full_params["filename"] = filename
+    if full_params["preview_max_side"]:
+        full_params["preview_max_side"] = _preview_side(full_params)
+
+    result_cache = disk_cache.get_cache()
+    result_key = None
+    if result_cache is not None and not full_params["preview_max_side"]: # Las vistas previas no se guardan
+        result_key = _result_key(full_params)
+        if result_key is not None:
+            artifacts = _load_result(result_cache, result_key, full_params)
+            if artifacts is not None:
+                return artifacts
+
+    run_records = [] if instrumentation.enabled else None
+    artifacts = {}
+    key = None
+    chain = [] # Etapas de esta ejecución: la caché no las expulsa mientras se completa
+    for stage in build_stages(full_params):
+        timer = instrumentation.StageTimer(stage.name) if run_records is not None else None
+        previous = artifacts
+
+        key = (key, stage.name, stage.key_for(full_params))
+        cached = cache.get(stage.name, key)
+        if cached is not None:
+            artifacts = cached
+        else:
+            start = time.perf_counter()
+            new_artifacts = dict(artifacts)
+            new_artifacts.update(stage.func(artifacts, full_params))
+            artifacts = _freeze(new_artifacts)
+            if artifacts.get("original") is None:
+                return None # No se pudo cargar la imagen: no se cachea el fallo
+            if not artifacts.get("fallback"): # Tras un error se recalcula en la próxima petición
+                cache.put(stage.name, key, artifacts, previous, time.perf_counter() - start, chain)
+        chain.append((stage.name, key))
+
+        if timer is not None:
+            record = timer.finish(previous, artifacts, cached is not None)
+            if artifacts.get("grabcut_timings") and artifacts["grabcut_timings"] is not previous.get("grabcut_timings"):
+                record["phases"] = artifacts["grabcut_timings"] # Fases de GrabCut (multiescala)
+            run_records.append(record)
+
+    if run_records is not None:
+        instrumentation.publish(filename, run_records)
+        if records is not None:
+            records.extend(run_records)
+    if result_key is not None and not artifacts.get("fallback"): # Un resultado de emergencia no se persiste
+        _store_result(result_cache, result_key, artifacts)
+    return artifacts
@@ -0,0 +1,307 @@
+"""
+Especificación declarativa del pipeline de transformaciones.
+
+Una especificación es una lista ordenada de operaciones serializable a JSON/YAML:
+
+    [{"op": "rotate", "params": {"angle": 30}},
+     {"op": "brightness_contrast", "params": {"brightness": 20, "contrast": 10}},
+     {"op": "gamma", "params": {"gamma": 1.4}},
+     {"op": "filter", "params": {"filter_type": "median"}}]
+
+compile_spec la valida una sola vez y devuelve los pasos a ejecutar; las
+operaciones puntuales (el valor de salida de un píxel depende sólo de su valor
+de entrada) consecutivas se fusionan en una única tabla de 256 entradas que se
+aplica con un solo cv2.LUT (65536 entradas y np.take en imágenes de 16 bits; ver
+corrections.compose_point_ops).
+"""
+import json
+
+import cv2
+import numpy as np
+
+from processing.color_operations import convert_color
+from processing.corrections import (
+    rotate, flip, adjust_brightness_contrast, gamma_correction, equalize_histogram,
+    apply_point_ops
+)
+from processing.enhancements import apply_filter, FILTER_HALO
+from processing.masks import apply_threshold, adaptive_threshold, otsu_threshold, bitwise_not
+from processing.detection import detect_contours, detect_faces_haar
+from processing.utils import to_uint8
+from processing.workers import offload, OFFLOADED_FILTERS
+
+SPEC_VERSION = 1
+
+COLOR_SPACES = ["RGB", "HSV", "LAB", "GRAYSCALE"]
+FLIP_MODES = ["horizontal", "vertical", "both"]
+FILTER_TYPES = ["blur", "gaussian", "bilateral", "median", "sharpen", "sobel",
+                "laplacian", "canny", "emboss", "custom"]
+THRESHOLD_TYPES = ["Binary", "Adaptive", "Otsu"]
+
+
+def _to_bgr(image):
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+    return image
+
+
+# --- Implementación de cada operación (entrada y salida BGR) ---
+
+def _op_convert_color(image, color_space):
+    if color_space in ("HSV", "LAB"):
+        image = to_uint8(image) # Las conversiones a HSV/LAB de OpenCV no admiten 16 bits
+    return _to_bgr(convert_color(image, color_space))
+
+
+def _op_equalize(image):
+    return _to_bgr(equalize_histogram(image))
+
+
+def _op_filter(image, filter_type, workers=1):
+    if filter_type in OFFLOADED_FILTERS: # Filtros caros: al pool de procesos si está activo
+        return _to_bgr(offload("filter", apply_filter, image, filter_type=filter_type, workers=workers))
+    return _to_bgr(apply_filter(image, filter_type, workers=workers))
+
+
+def _op_threshold(image, type, value=128):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    gray = to_uint8(gray) # Umbrales en la escala de 8 bits (y adaptiveThreshold sólo admite 8 bits)
+    if type == "Binary":
+        result = apply_threshold(gray, value)
+    elif type == "Adaptive":
+        result = adaptive_threshold(gray)
+    else:
+        result = otsu_threshold(gray)
+    return _to_bgr(result)
+
+
+def _op_detect_contours(image):
+    # Dibuja sobre la imagen: trabajar sobre una copia
+    return detect_contours(image.copy())
+
+
+def _op_detect_faces(image, max_side=None):
+    return offload("detect_faces", detect_faces_haar, image.copy(), max_side=max_side)
+
+
+class Op:
+    """
+    Operación disponible en una especificación.
+    - params: parámetros admitidos con su valor por defecto.
+    - choices: valores válidos para los parámetros enumerados.
+    - point: función que, dados los parámetros, devuelve la operación puntual
+      equivalente (nombre, parámetros) de corrections.POINT_OP_TABLES, o None
+      si con esos parámetros no se puede expresar como tabla.
+    - gray: la operación puntual se aplica sobre la imagen en escala de grises.
+    - halo: margen en px que necesita la operación para procesarse por teselas
+      (entero o función de los parámetros); None si no es local (rotación,
+      ecualización, Otsu...) y por tanto no admite procesamiento por teselas.
+    """
+
+    def __init__(self, func, params=None, choices=None, point=None, gray=False, halo=None):
+        self.func = func
+        self.params = params or {}
+        self.choices = choices or {}
+        self.point = point
+        self.gray = gray
+        self.halo = halo
+
+    def halo_for(self, params):
+        return self.halo(params) if callable(self.halo) else self.halo
+
+    def point_op(self, params):
+        return self.point(params) if self.point is not None else None
+
+
+# Binario: puntual. Adaptativo: bloque de 11 px (radio 5). Otsu: umbral global.
+_THRESHOLD_HALO = {"Binary": 0, "Adaptive": 5, "Otsu": None}
+
+OPS = {
+    "convert_color": Op(_op_convert_color, {"color_space": "RGB"}, {"color_space": COLOR_SPACES}, halo=0),
+    "rotate": Op(rotate, {"angle": 0}),
+    "flip": Op(flip, {"mode": "horizontal"}, {"mode": FLIP_MODES}),
+    "brightness_contrast": Op(adjust_brightness_contrast, {"brightness": 0, "contrast": 0},
+                              point=lambda p: ("brightness_contrast", (p["brightness"], p["contrast"])), halo=0),
+    "gamma": Op(gamma_correction, {"gamma": 1.0}, point=lambda p: ("gamma", (p["gamma"],)), halo=0),
+    "equalize": Op(_op_equalize),
+    "filter": Op(_op_filter, {"filter_type": "median", "workers": 1}, {"filter_type": FILTER_TYPES},
+                 halo=lambda p: FILTER_HALO[p["filter_type"]]),
+    "threshold": Op(_op_threshold, {"type": "Binary", "value": 128}, {"type": THRESHOLD_TYPES},
+                    point=lambda p: ("threshold", (p["value"],)) if p["type"] == "Binary" else None,
+                    gray=True, halo=lambda p: _THRESHOLD_HALO[p["type"]]),
+    "bitwise_not": Op(bitwise_not, point=lambda p: ("invert", ()), halo=0),
+    "detect_contours": Op(_op_detect_contours),
+    "detect_faces": Op(_op_detect_faces, {"max_side": None}),
+}
+
+
+def validate_spec(ops):
+    """
+    Valida una lista de operaciones y la devuelve normalizada: cada elemento
+    queda como {"op": nombre, "params": {...}} con todos los parámetros completos.
+    Lanza ValueError con un mensaje descriptivo si algo no es válido.
+    """
+    if not isinstance(ops, list):
+        raise ValueError("La especificación debe ser una lista de operaciones")
+
+    normalized = []
+    for index, entry in enumerate(ops):
+        if not isinstance(entry, dict) or "op" not in entry:
+            raise ValueError(f"Operación #{index}: se esperaba un objeto con la clave 'op'")
+        name = entry["op"]
+        op = OPS.get(name)
+        if op is None:
+            raise ValueError(f"Operación #{index}: '{name}' no existe. Disponibles: {', '.join(OPS)}")
+        params = entry.get("params") or {}
+        unknown = sorted(set(params) - set(op.params))
+        if unknown:
+            raise ValueError(f"Operación #{index} ({name}): parámetros desconocidos {', '.join(unknown)}")
+        full_params = dict(op.params)
+        full_params.update(params)
+        for param, valid in op.choices.items():
+            if full_params[param] not in valid:
+                raise ValueError(f"Operación #{index} ({name}): '{full_params[param]}' no es válido para "
+                                 f"'{param}'. Usa uno de: {', '.join(valid)}")
+        normalized.append({"op": name, "params": full_params})
+    return normalized
+
+
+class Step:
+    """
+    Paso ejecutable de una especificación compilada (una operación o varias fusionadas).
+    `halo` es el margen en px que necesita para procesarse por teselas (None = no local).
+    """
+
+    def __init__(self, name, key, func, halo=None):
+        self.name = name
+        self.key = key
+        self.func = func
+        self.halo = halo
+
+    def __call__(self, image):
+        return self.func(image)
+
+
+def _single_step(entry):
+    op = OPS[entry["op"]]
+    params = entry["params"]
+    return Step(entry["op"], _entry_key(entry), lambda image: op.func(image, **params),
+                op.halo_for(params))
+
+
+def _fused_step(entries, gray):
+    point_ops = tuple(OPS[entry["op"]].point_op(entry["params"]) for entry in entries)
+
+    def run(image):
+        if image.dtype not in (np.uint8, np.uint16):
+            # Las tablas sólo existen para 8 y 16 bits: aplicar las operaciones una a una
+            for entry in entries:
+                image = OPS[entry["op"]].func(image, **entry["params"])
+            return image
+        if gray:
+            # Tras una conversión a gris los tres canales son iguales: basta con
+            # aplicar la tabla a un solo canal y volver a expandir a BGR
+            if image.ndim == 3:
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+            # Un grupo gris empieza con el umbral, que como _op_threshold trabaja
+            # en 8 bits: el resultado es de 8 bits con o sin fusión
+            return _to_bgr(apply_point_ops(to_uint8(image), point_ops))
+        return apply_point_ops(image, point_ops)
+
+    name = "+".join(entry["op"] for entry in entries)
+    return Step(name, tuple(_entry_key(entry) for entry in entries), run, halo=0)
+
+
+def _entry_key(entry):
+    return (entry["op"], tuple(sorted(entry["params"].items())))
+
+
+def compile_spec(ops):
+    """
+    Valida la especificación y la convierte en una lista de pasos, fusionando
+    las operaciones puntuales consecutivas en una única LUT.
+    """
+    steps = []
+    group = []
+    group_gray = False
+    for entry in validate_spec(ops):
+        op = OPS[entry["op"]]
+        if op.point_op(entry["params"]) is not None:
+            # Una operación que pasa a gris no conmuta con las anteriores: empieza un grupo nuevo
+            if op.gray and group:
+                steps.append(_fused_step(group, group_gray))
+                group = []
+            if not group:
+                group_gray = op.gray
+            group.append(entry)
+            continue
+        if group:
+            steps.append(_fused_step(group, group_gray))
+            group = []
+        steps.append(_single_step(entry))
+    if group:
+        steps.append(_fused_step(group, group_gray))
+    return steps
+
+
+def run_spec(image, ops):
+    """Compila y ejecuta una especificación sobre una imagen BGR."""
+    for step in compile_spec(ops):
+        image = step(image)
+    return image
+
+
+def spec_from_params(params):
+    """
+    Traduce los parámetros planos de process_all a una especificación, en el
+    mismo orden en que la interfaz aplica las operaciones.
+    """
+    ops = []
+    if params["color_space"] != "RGB":
+        ops.append({"op": "convert_color", "params": {"color_space": params["color_space"]}})
+    if params["rotate_angle"]:
+        ops.append({"op": "rotate", "params": {"angle": params["rotate_angle"]}})
+    ops.append({"op": "flip", "params": {"mode": params["flip_mode"]}})
+    if params["brightness"] or params["contrast"]:
+        ops.append({"op": "brightness_contrast",
+                    "params": {"brightness": params["brightness"], "contrast": params["contrast"]}})
+    ops.append({"op": "gamma", "params": {"gamma": params["gamma"]}})
+    if params["color_space"] == "GRAYSCALE":
+        ops.append({"op": "equalize"})
+    if params["filter_type"] != "None":
+        ops.append({"op": "filter", "params": {"filter_type": params["filter_type"],
+                                               "workers": params.get("filter_workers", 1)}})
+    if params["threshold_type"] != "None":
+        ops.append({"op": "threshold",
+                    "params": {"type": params["threshold_type"], "value": params["threshold_value"]}})
+    if params["bitwise_op"] == "NOT":
+        ops.append({"op": "bitwise_not"})
+    if params["detect_contours_flag"]:
+        ops.append({"op": "detect_contours"})
+    if params["detect_faces_flag"]:
+        ops.append({"op": "detect_faces", "params": {"max_side": params.get("face_max_side")}})
+    return ops
+
+
+def load_spec_file(path):
+    """Lee un documento JSON (o YAML si PyYAML está instalado) y lo devuelve como dict."""
+    with open(path, encoding="utf-8") as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Se necesita PyYAML para leer especificaciones YAML ('pip install pyyaml')")
+            document = yaml.safe_load(f) or {}
+        else:
+            document = json.load(f)
+    if not isinstance(document, dict):
+        raise ValueError(f"La especificación {path} debe ser un objeto")
+    return document
+
+
+def dump_spec(params, ops):
+    """Serializa parámetros y operaciones a JSON (formato aceptado por processing.batch --spec)."""
+    document = {"version": SPEC_VERSION}
+    document.update(params)
+    document["ops"] = validate_spec(ops)
+    return json.dumps(document, indent=2, ensure_ascii=False)
@@ -0,0 +1,122 @@
+"""
+Procesamiento por teselas para imágenes más grandes que la memoria.
+
+La imagen se recorre en teselas; cada una se lee con un margen ("halo") igual a
+la suma de los radios de las operaciones de la especificación, se procesa, se
+recorta el margen y se escribe en la salida. Con el halo correcto el resultado
+es idéntico al de procesar la imagen completa.
+
+La entrada debe ser un array que se pueda leer por trozos, normalmente un .npy
+abierto con np.load(mmap_mode="r"). Los formatos comprimidos (JPEG/PNG) no se
+pueden decodificar por partes con OpenCV: image_to_npy los convierte una vez.
+
+Uso:
+    python -m processing.tiling entrada.npy salida.npy --spec especificacion.json [--tile 2048]
+"""
+import argparse
+import sys
+
+import cv2
+import numpy as np
+
+from processing.spec import compile_spec, load_spec_file
+
+DEFAULT_TILE_SIZE = 2048
+
+
+def spec_halo(steps):
+    """
+    Margen total (px) que necesita una lista de pasos compilados. Las operaciones
+    encadenadas suman sus radios. Lanza ValueError si alguna no es local.
+    """
+    total = 0
+    for step in steps:
+        if step.halo is None:
+            raise ValueError(f"La operación '{step.name}' no es local y no se puede procesar por teselas")
+        total += step.halo
+    return total
+
+
+def iter_tiles(height, width, tile_size, halo):
+    """
+    Genera (ventana con halo, región útil) para cada tesela como pares de
+    slices ((y0, y1, x0, x1) leída, (y0, y1, x0, x1) escrita).
+    """
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            y1, x1 = min(y + tile_size, height), min(x + tile_size, width)
+            read = (max(0, y - halo), min(height, y1 + halo), max(0, x - halo), min(width, x1 + halo))
+            yield read, (y, y1, x, x1)
+
+
+def process_tiled(source, ops, out=None, tile_size=DEFAULT_TILE_SIZE, out_path=None):
+    """
+    Aplica una especificación (ver processing.spec) a `source` tesela a tesela.
+    - source: array (H, W[, C]) que admite slicing, p. ej. un np.memmap.
+    - out: array de salida ya creado (mismo alto y ancho). Si es None se crea al
+      procesar la primera tesela: un .npy mapeado en memoria si se indica
+      `out_path`, o un array en memoria en caso contrario.
+    Returns:
+        np.ndarray: el array de salida.
+    """
+    steps = compile_spec(ops)
+    halo = spec_halo(steps)
+    height, width = source.shape[:2]
+
+    for (ry0, ry1, rx0, rx1), (y0, y1, x0, x1) in iter_tiles(height, width, tile_size, halo):
+        tile = np.ascontiguousarray(source[ry0:ry1, rx0:rx1]) # Sólo esta tesela pasa a memoria
+        for step in steps:
+            tile = step(tile)
+        tile = tile[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0]
+
+        if out is None:
+            shape = (height, width) + tile.shape[2:]
+            if out_path is not None:
+                out = np.lib.format.open_memmap(out_path, mode="w+", dtype=tile.dtype, shape=shape)
+            else:
+                out = np.empty(shape, dtype=tile.dtype)
+        out[y0:y1, x0:x1] = tile
+
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def open_npy(path):
+    """Abre un .npy mapeado en memoria y en solo lectura."""
+    return np.load(path, mmap_mode="r")
+
+
+def image_to_npy(image_path, npy_path):
+    """Decodifica una imagen (una sola vez) y la guarda como .npy para procesarla por teselas."""
+    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"No se pudo cargar la imagen {image_path}")
+    np.save(npy_path, image)
+    return npy_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Procesa una imagen muy grande por teselas con memoria acotada.")
+    parser.add_argument("input", help="Imagen .npy (o JPEG/PNG, que se convierte primero a .npy)")
+    parser.add_argument("output", help="Archivo .npy de salida")
+    parser.add_argument("--spec", required=True, help="Archivo JSON/YAML con la lista 'ops' (ver processing.spec)")
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE_SIZE, help="Lado de la tesela en px")
+    args = parser.parse_args(argv)
+
+    document = load_spec_file(args.spec)
+    ops = document.get("ops")
+    if ops is None:
+        print("La especificación no contiene una lista 'ops'.")
+        return 1
+
+    input_path = args.input
+    if not input_path.lower().endswith(".npy"):
+        input_path = image_to_npy(input_path, input_path + ".npy")
+    process_tiled(open_npy(input_path), ops, tile_size=args.tile, out_path=args.output)
+    print(f"Resultado guardado en {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,3 +12,25 @@ def to_bgr(image):
         return image
     else:
         raise ValueError("La imagen tiene un formato no soportado")
+
+def to_uint8(image):
+    """
+    Convierte una imagen de cualquier profundidad a 8 bits para mostrarla o para
+    las funciones de OpenCV que sólo aceptan 8 bits.
+    - uint8: se devuelve sin cambios.
+    - uint16: se reescala de 0-65535 a 0-255 (con redondeo).
+    - con signo o flotante (p. ej. gradientes): valor absoluto saturado a 0-255.
+    """
+    if image.dtype == np.uint8:
+        return image
+    if image.dtype == np.uint16:
+        return cv2.convertScaleAbs(image, alpha=1 / 257.0)
+    return cv2.convertScaleAbs(image)
+
+def match_depth(image, dtype):
+    """Lleva una imagen de 8 bits a la profundidad `dtype` (uint8 o uint16) escalando sus valores."""
+    if image.dtype == dtype:
+        return image
+    if dtype == np.uint16 and image.dtype == np.uint8:
+        return image.astype(np.uint16) * 257
+    return image.astype(dtype)
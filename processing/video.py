@@ -0,0 +1,345 @@
+"""
+Modo vídeo: cambio de fondo fotograma a fotograma (p. ej. vídeos de producto en plato giratorio).
+
+Tres hilos conectados por colas acotadas:
+    decodificación (cv2.VideoCapture o secuencia de imágenes)
+    -> procesamiento (segmentación HSV/LAB + composición sobre el fondo)
+    -> codificación (cv2.VideoWriter o carpeta de imágenes)
+Los fotogramas de entrada y de salida salen de dos conjuntos de buffers
+preasignados que se reciclan, así que no se reserva memoria por fotograma.
+Si la escena apenas cambia respecto al último fotograma segmentado se reutiliza
+su máscara (fondo estático y objeto quieto).
+
+Uso:
+    python -m processing.video entrada.mp4 salida.mp4 --background fondos/estudio.jpg
+    python -m processing.video "fotogramas/*.png" salida/ --bg-color "#ffffff" --method "HSV (auto)"
+"""
+import argparse
+import glob
+import os
+import queue
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from processing.background_change import change_background_color, change_background_image
+from processing.background_removal import estimate_background_range, segment_batch
+from processing.color_operations import hex_to_rgb
+
+DEFAULT_QUEUE_SIZE = 8
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv')
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+# Lado de la miniatura en gris con la que se compara cada fotograma con el último
+# segmentado, y diferencia (0-255) a partir de la cual un píxel cuenta como cambiado
+CHANGE_THUMBNAIL_SIDE = 128
+CHANGE_PIXEL_THRESHOLD = 16
+
+
+class FrameProcessor:
+    """
+    Segmenta cada fotograma con un rango HSV/LAB y lo compone sobre un fondo.
+    - background: imagen BGR de fondo (se redimensiona una sola vez) o None.
+    - bg_color: color BGR si no hay imagen de fondo.
+    - bg_range: (inferior, superior) fijo; con auto_range=True se estima en el
+      primer fotograma y se reutiliza en todo el vídeo.
+    - reuse_threshold: fracción de píxeles de la miniatura en gris que pueden haber
+      cambiado para reutilizar la máscara anterior (0 = segmentar siempre).
+    """
+
+    def __init__(self, background=None, bg_color=(255, 255, 255), color_space="HSV", bg_range=None,
+                 auto_range=False, feather=0, reuse_threshold=0.001):
+        self.background = background
+        self.bg_color = bg_color
+        self.color_space = color_space
+        self.bg_range = bg_range
+        self.auto_range = auto_range
+        self.feather = feather
+        self.reuse_threshold = reuse_threshold
+        self.masks_computed = 0
+        self.masks_reused = 0
+        self._mask = None        # (1, alto, ancho): máscara del último fotograma segmentado
+        self._work = None        # (1, alto, ancho, 3): buffer de la conversión de color
+        self._thumbnail = None   # Miniatura del último fotograma segmentado
+        self._resized_background = None
+
+    def _prepare(self, frame):
+        h, w = frame.shape[:2]
+        self._mask = np.empty((1, h, w), np.uint8)
+        self._work = np.empty((1, h, w, 3), np.uint8)
+        if self.background is not None:
+            self._resized_background = cv2.resize(self.background, (w, h))
+        if self.bg_range is None and self.auto_range:
+            self.bg_range = estimate_background_range(frame, self.color_space)
+            print(f"Rango de fondo estimado en el primer fotograma: {self.bg_range[0]} - {self.bg_range[1]}")
+
+    def _thumbnail_of(self, frame):
+        h, w = frame.shape[:2]
+        scale = CHANGE_THUMBNAIL_SIDE / max(h, w)
+        small = cv2.resize(frame, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    def mask_for(self, frame):
+        """Máscara de primer plano del fotograma (vista de un buffer interno que se reutiliza)."""
+        if self._mask is None or self._mask.shape[1:] != frame.shape[:2]:
+            self._prepare(frame)
+            self._thumbnail = None
+        thumbnail = self._thumbnail_of(frame) if self.reuse_threshold > 0 else None
+        if thumbnail is not None and self._thumbnail is not None:
+            difference = cv2.absdiff(thumbnail, self._thumbnail)
+            changed = cv2.countNonZero(cv2.threshold(difference, CHANGE_PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)[1])
+            if changed <= self.reuse_threshold * thumbnail.size:
+                self.masks_reused += 1
+                return self._mask[0]
+        lower, upper = self.bg_range if self.bg_range is not None else (None, None)
+        segment_batch(frame[None], self.color_space, lower, upper, out=self._mask, work=self._work)
+        self._thumbnail = thumbnail
+        self.masks_computed += 1
+        return self._mask[0]
+
+    def __call__(self, frame, out):
+        mask = self.mask_for(frame)
+        if self._resized_background is not None:
+            return change_background_image(frame, mask, self._resized_background, out=out, feather=self.feather)
+        return change_background_color(frame, mask, self.bg_color, out=out, feather=self.feather)
+
+
+def _frame_paths(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class _SequenceReader:
+    """Lee una secuencia de imágenes con la misma interfaz que cv2.VideoCapture.read(image)."""
+
+    def __init__(self, paths):
+        self.paths = paths
+        self.position = 0
+
+    def read(self, image=None):
+        if self.position >= len(self.paths):
+            return False, None
+        frame = cv2.imread(self.paths[self.position], cv2.IMREAD_COLOR)
+        self.position += 1
+        if frame is None:
+            return False, None
+        if image is not None and image.shape == frame.shape:
+            np.copyto(image, frame)
+            return True, image
+        return True, frame
+
+    def release(self):
+        pass
+
+
+def open_reader(source, default_fps=25.0):
+    """Devuelve (lector, fps) para un vídeo o una secuencia de imágenes (carpeta o patrón glob)."""
+    if source.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(source):
+        capture = cv2.VideoCapture(source)
+        if not capture.isOpened():
+            raise ValueError(f"No se pudo abrir el vídeo {source}")
+        return capture, capture.get(cv2.CAP_PROP_FPS) or default_fps
+    paths = _frame_paths(source)
+    if not paths:
+        raise ValueError(f"No se encontraron fotogramas en '{source}'")
+    return _SequenceReader(paths), default_fps
+
+
+class _SequenceWriter:
+    def __init__(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.count = 0
+
+    def write(self, frame):
+        cv2.imwrite(os.path.join(self.folder, f"{self.count:06d}.png"), frame)
+        self.count += 1
+
+    def release(self):
+        pass
+
+
+def open_writer(output, fps, size, fourcc="mp4v"):
+    """cv2.VideoWriter si `output` es un archivo de vídeo; si no, una carpeta de PNG."""
+    if output.lower().endswith(VIDEO_EXTENSIONS):
+        writer = cv2.VideoWriter(output, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if not writer.isOpened():
+            raise ValueError(f"No se pudo crear el vídeo {output} (códec {fourcc})")
+        return writer
+    return _SequenceWriter(output)
+
+
+def _put(q, item, stop):
+    """put() que se rinde si otro hilo falló (evita bloqueos con las colas llenas)."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return None
+
+
+def process_video(source, output, processor, queue_size=DEFAULT_QUEUE_SIZE, fourcc="mp4v",
+                  fps=None, report_every=2.0, progress=print):
+    """
+    Procesa `source` con `processor(fotograma, out)` y escribe en `output`.
+    Returns:
+        dict: fotogramas, segundos, FPS sostenidos y segundos ocupados por hilo.
+    """
+    reader, source_fps = open_reader(source)
+    ok, first = reader.read()
+    if not ok:
+        reader.release()
+        raise ValueError(f"No se pudo leer ningún fotograma de '{source}'")
+    height, width = first.shape[:2]
+    writer = open_writer(output, fps or source_fps, (width, height), fourcc)
+
+    # Buffers reciclados: los fotogramas en cola más los que están en uso en cada hilo
+    free_inputs = queue.Queue()
+    free_outputs = queue.Queue()
+    for _ in range(queue_size + 2):
+        free_inputs.put(np.empty_like(first))
+        free_outputs.put(np.empty_like(first))
+    decoded = queue.Queue(maxsize=queue_size)
+    processed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    busy = {"decode": 0.0, "process": 0.0, "encode": 0.0}
+    counter = {"frames": 0}
+
+    def decode():
+        frame = first
+        while frame is not None:
+            if not _put(decoded, frame, stop):
+                return
+            buffer = _get(free_inputs, stop)
+            if buffer is None:
+                return
+            start = time.perf_counter()
+            ok, frame = reader.read(buffer)
+            busy["decode"] += time.perf_counter() - start
+            if not ok or frame.shape != first.shape:
+                frame = None
+        _put(decoded, None, stop)
+
+    def process():
+        while True:
+            frame = _get(decoded, stop)
+            if frame is None:
+                break
+            out = _get(free_outputs, stop)
+            if out is None:
+                return
+            start = time.perf_counter()
+            result = processor(frame, out)
+            busy["process"] += time.perf_counter() - start
+            if frame is not first:
+                free_inputs.put(frame)
+            _put(processed, (result, out), stop)
+        _put(processed, None, stop)
+
+    def encode():
+        while True:
+            item = _get(processed, stop)
+            if item is None:
+                break
+            result, out = item
+            start = time.perf_counter()
+            writer.write(result)
+            busy["encode"] += time.perf_counter() - start
+            free_outputs.put(out)
+            counter["frames"] += 1
+
+    def guarded(func):
+        def run():
+            try:
+                func()
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+        return run
+
+    threads = [threading.Thread(target=guarded(f), name=f"video-{f.__name__}", daemon=True)
+               for f in (decode, process, encode)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    last_report, last_frames = start, 0
+    while threads[-1].is_alive():
+        threads[-1].join(timeout=report_every)
+        now = time.perf_counter()
+        if progress and threads[-1].is_alive():
+            frames = counter["frames"]
+            progress(f"{frames} fotogramas, {(frames - last_frames) / (now - last_report):.1f} FPS")
+            last_report, last_frames = now, frames
+    stop.set()
+    for thread in threads:
+        thread.join()
+    reader.release()
+    writer.release()
+    if errors:
+        raise errors[0]
+
+    elapsed = time.perf_counter() - start
+    return {
+        "frames": counter["frames"],
+        "seconds": elapsed,
+        "fps": counter["frames"] / elapsed if elapsed else 0.0,
+        "busy_seconds": busy,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cambio de fondo en un vídeo o una secuencia de fotogramas.")
+    parser.add_argument("input", help="Vídeo (.mp4, .avi, ...), carpeta de fotogramas o patrón glob")
+    parser.add_argument("output", help="Vídeo de salida (.mp4, .avi, ...) o carpeta para los fotogramas PNG")
+    parser.add_argument("--background", help="Imagen de fondo")
+    parser.add_argument("--bg-color", default="#ffffff", help="Color de fondo si no hay imagen (#rrggbb)")
+    parser.add_argument("--method", default="HSV", choices=["HSV", "LAB", "HSV (auto)", "LAB (auto)"],
+                        help="Segmentación; '(auto)' estima el rango del fondo en el primer fotograma")
+    parser.add_argument("--feather", type=int, default=0, help="Radio (px) de suavizado del borde")
+    parser.add_argument("--reuse-threshold", type=float, default=0.001,
+                        help="Fracción de píxeles cambiados hasta la que se reutiliza la máscara anterior (0 = nunca)")
+    parser.add_argument("--queue", type=int, default=DEFAULT_QUEUE_SIZE, help="Fotogramas en cada cola")
+    parser.add_argument("--fourcc", default="mp4v", help="Códec del vídeo de salida")
+    parser.add_argument("--fps", type=float, default=None, help="FPS de salida (por defecto los de la entrada)")
+    args = parser.parse_args(argv)
+
+    background = None
+    if args.background:
+        background = cv2.imread(args.background, cv2.IMREAD_COLOR)
+        if background is None:
+            print(f"No se pudo cargar el fondo {args.background}.")
+            return 1
+    processor = FrameProcessor(background=background, bg_color=hex_to_rgb(args.bg_color)[::-1],
+                               color_space=args.method.split()[0], auto_range=args.method.endswith("(auto)"),
+                               feather=args.feather, reuse_threshold=args.reuse_threshold)
+    try:
+        stats = process_video(args.input, args.output, processor, args.queue, args.fourcc, args.fps)
+    except ValueError as e:
+        print(e)
+        return 1
+    busy = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in stats["busy_seconds"].items())
+    print(f"{stats['frames']} fotogramas en {stats['seconds']:.1f}s: {stats['fps']:.1f} FPS sostenidos "
+          f"(ocupación: {busy}; máscaras reutilizadas: {processor.masks_reused}/{stats['frames']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
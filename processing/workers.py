@@ -0,0 +1,254 @@
+"""
+Pool persistente de procesos para las etapas pesadas (GrabCut, filtros caros,
+detección de rostros).
+
+Las imágenes viajan por memoria compartida (multiprocessing.shared_memory): el
+proceso principal copia la entrada a un bloque compartido, el worker la usa sin
+copiarla y deja cada array del resultado en un bloque nuevo que el principal
+copia y libera. Por la tubería sólo pasan nombres, formas y tipos.
+
+- Contrapresión: como mucho `max_pending` peticiones esperando un worker; las
+  demás fallan enseguida con PoolBusyError en lugar de acumularse.
+- Tiempo límite por tarea: si un worker no responde a tiempo se mata y se
+  sustituye por uno nuevo (TimeoutError).
+- Reciclado: cada worker se reemplaza tras `max_tasks_per_worker` tareas para
+  acotar el crecimiento de memoria de OpenCV.
+
+Sin pool activo (start_pool) offload() ejecuta la función en el propio hilo, y
+multiprocessing no llega a importarse.
+"""
+import queue
+import threading
+
+import numpy as np
+
+DEFAULT_TIMEOUT = 120 # Segundos por tarea
+DEFAULT_MAX_TASKS_PER_WORKER = 50
+
+# Filtros que compensa enviar a otro proceso; los demás son más baratos que la copia
+OFFLOADED_FILTERS = {"bilateral", "median"}
+
+
+class PoolBusyError(RuntimeError):
+    """Demasiadas peticiones esperando un worker libre."""
+
+
+def _task_functions():
+    # Se importan en el worker (y sólo allí) para no crear dependencias circulares
+    from processing.background_removal import grabcut, grabcut_multiscale
+    from processing.detection import detect_faces_haar
+    from processing.enhancements import apply_filter
+    return {
+        "grabcut": grabcut,
+        "grabcut_multiscale": grabcut_multiscale,
+        "filter": apply_filter,
+        "detect_faces": detect_faces_haar,
+    }
+
+
+def _attach(name, shape, dtype):
+    from multiprocessing import shared_memory
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _share(array):
+    """Copia `array` a un bloque de memoria compartida nuevo. Devuelve (bloque, descripción)."""
+    from multiprocessing import shared_memory
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _worker_main(conn):
+    """Bucle de un worker: recibe tareas por `conn` hasta recibir None."""
+    functions = _task_functions()
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        task, (name, shape, dtype), kwargs = message
+        shm, image = _attach(name, shape, dtype)
+        try:
+            result = functions[task](image, **kwargs)
+            outputs = []
+            for value in (result if isinstance(result, tuple) else (result,)):
+                if isinstance(value, np.ndarray):
+                    out_shm, description = _share(value)
+                    out_shm.close() # El principal lo abre, lo copia y lo libera
+                    outputs.append(("array", description))
+                else:
+                    outputs.append(("value", value))
+            conn.send(("ok", isinstance(result, tuple), outputs))
+        except Exception as e:
+            conn.send(("error", None, f"{type(e).__name__}: {e}"))
+        finally:
+            del image
+            shm.close()
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.kill()
+        self.conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+
+
+def _collect(outputs):
+    """Copia los arrays de los bloques compartidos del worker y los libera."""
+    values = []
+    for kind, payload in outputs:
+        if kind == "value":
+            values.append(payload)
+            continue
+        shm, array = _attach(*payload)
+        try:
+            values.append(array.copy())
+        finally:
+            del array
+            shm.close()
+            shm.unlink()
+    return values
+
+
+class WorkerPool:
+    """Pool de procesos persistente; run() es bloqueante y seguro entre hilos."""
+
+    def __init__(self, workers, max_pending=None, timeout=DEFAULT_TIMEOUT,
+                 max_tasks_per_worker=DEFAULT_MAX_TASKS_PER_WORKER):
+        import multiprocessing
+        # "spawn": el proceso principal tiene hilos (Gradio) y fork no es seguro con ellos
+        self._context = multiprocessing.get_context("spawn")
+        self.timeout = timeout
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._idle = queue.Queue()
+        self._waiting = threading.BoundedSemaphore(max_pending or 4 * workers)
+        self._lock = threading.Lock()
+        self._workers = []
+        self.stats = {"tasks": 0, "errors": 0, "timeouts": 0, "recycled": 0, "rejected": 0}
+        for _ in range(workers):
+            self._spawn()
+
+    def _spawn(self):
+        worker = _Worker(self._context)
+        with self._lock:
+            self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _retire(self, worker, kill=False):
+        with self._lock:
+            self._workers.remove(worker)
+        if kill:
+            worker.kill()
+            worker.conn.close()
+        else:
+            worker.stop()
+
+    def run(self, task, image, timeout=None, **kwargs):
+        """
+        Ejecuta la tarea `task` (ver _task_functions) sobre `image` en un worker.
+        Lanza PoolBusyError si hay demasiadas peticiones en espera, TimeoutError
+        si el worker no termina a tiempo y RuntimeError si la tarea falla.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not self._waiting.acquire(blocking=False):
+            self._count("rejected")
+            raise PoolBusyError("Todos los workers están ocupados y la cola de espera está llena")
+        try:
+            worker = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"Ningún worker quedó libre en {timeout}s") from None
+        finally:
+            self._waiting.release()
+
+        shm, description = _share(image)
+        try:
+            worker.conn.send((task, description, kwargs))
+            finished = worker.conn.poll(timeout)
+            if finished:
+                status, is_tuple, payload = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            # El worker murió (p. ej. sin memoria): se sustituye
+            self._retire(worker, kill=True)
+            self._spawn()
+            raise RuntimeError(f"El worker terminó inesperadamente durante '{task}': {e}") from None
+        finally:
+            shm.close()
+            shm.unlink()
+
+        if not finished:
+            # El worker sigue ocupado (o colgado): se mata y se sustituye
+            self._count("timeouts")
+            self._retire(worker, kill=True)
+            self._spawn()
+            raise TimeoutError(f"La tarea '{task}' superó {timeout}s")
+
+        worker.tasks += 1
+        self._count("tasks")
+        if worker.tasks >= self.max_tasks_per_worker:
+            self._count("recycled")
+            self._retire(worker)
+            self._spawn()
+        else:
+            self._idle.put(worker)
+
+        if status == "error":
+            self._count("errors")
+            raise RuntimeError(payload)
+        values = _collect(payload)
+        return tuple(values) if is_tuple else values[0]
+
+    def shutdown(self):
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+
+
+def start_pool(workers, **kwargs):
+    """Arranca el pool global que usa offload(). Con workers=0 no se usa ningún pool."""
+    global _pool
+    stop_pool()
+    if workers > 0:
+        _pool = WorkerPool(workers, **kwargs)
+    return _pool
+
+
+def stop_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def offload(task, func, image, **kwargs):
+    """Ejecuta func(image, **kwargs) en el pool global si está activo, o aquí mismo si no."""
+    if _pool is None:
+        return func(image, **kwargs)
+    return _pool.run(task, image, **kwargs)
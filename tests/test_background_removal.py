@@ -0,0 +1,32 @@
+"""
+Estimación automática del rango de fondo (HSV/LAB) cuando el objeto toca el
+borde de la imagen, como en las fotos de estudio cortadas por abajo.
+"""
+import cv2
+import numpy as np
+import pytest
+
+from processing.background_removal import remove_background_auto
+
+
+def _subject_on_bottom_edge():
+    """Fondo rojo con algo de ruido y un objeto de muchos colores que toca el borde inferior."""
+    rng = np.random.default_rng(0)
+    image = np.empty((270, 480, 3), np.uint8)
+    image[...] = (20, 20, 230)
+    image = cv2.add(image, rng.integers(0, 12, image.shape, dtype=np.uint8))
+    subject = np.zeros(image.shape[:2], np.uint8)
+    cv2.rectangle(subject, (180, 60), (360, 269), 255, -1)
+    colors = rng.integers(0, 256, (210 // 15 + 1, 181 // 15 + 1, 3), dtype=np.uint8)
+    colors = cv2.resize(colors, (181, 210), interpolation=cv2.INTER_NEAREST)
+    image[60:270, 180:361] = colors
+    return image, subject > 0
+
+
+@pytest.mark.parametrize("color_space", ["HSV", "LAB"])
+def test_subject_touching_the_border(color_space):
+    image, subject = _subject_on_bottom_edge()
+    _, mask, _ = remove_background_auto(image, color_space)
+    kept = mask > 0
+    assert kept[subject].mean() > 0.8
+    assert kept[~subject].mean() < 0.01
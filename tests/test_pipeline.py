@@ -0,0 +1,120 @@
+"""
+Caché de etapas del pipeline: con una imagen grande, mover un control de las
+últimas etapas no expulsa los resultados caros de las primeras, y los
+resultados de emergencia tras un error no se guardan.
+"""
+import os
+
+import cv2
+import numpy as np
+
+from processing import disk_cache, pipeline
+from processing.pipeline import StageCache, run_pipeline
+from processing.workers import PoolBusyError
+
+PARAMS = {"background_removal_method": "HSV", "change_bg_mode": "Color", "bg_color": "#00ff00",
+          "filter_type": "gaussian"}
+
+
+def _large_image(folder, name="grande.jpg", size=(3000, 4000)):
+    # Objeto azul sobre fondo rojo: cada array BGR ocupa unos 36 MB
+    image = np.full(size + (3,), (40, 40, 200), np.uint8)
+    cv2.circle(image, (size[1] // 2, size[0] // 2), min(size) // 3, (200, 120, 30), -1)
+    cv2.imwrite(os.path.join(folder, name), image)
+    return name
+
+
+def test_gamma_change_keeps_background_removal(tmp_path):
+    name = _large_image(str(tmp_path))
+    # Una ejecución completa casi llena la caché, como 24 MP con el límite por defecto
+    cache = StageCache(max_bytes=256 * 1024 * 1024)
+    for gamma in (1.0, 1.2, 1.4):
+        assert run_pipeline(name, dict(PARAMS, image_dir=str(tmp_path), gamma=gamma), cache=cache) is not None
+        assert cache.current_bytes <= cache.max_bytes
+    stats = cache.stats()
+    for stage in ("load", "background_removal", "background_change"):
+        assert stats[stage] == {"hits": 2, "misses": 1, "entries": 1}, stage
+
+
+def test_cheapest_results_are_evicted_first():
+    array = lambda: np.zeros(1000, np.uint8)
+    cache = StageCache(max_bytes=2500)
+    cache.put("background_removal", "cara", {"mask": array()}, cost=2.0)
+    cache.put("gamma", "barata", {"processed": array()}, cost=0.01)
+    cache.put("filter", "nueva", {"processed": array()}, cost=0.05)
+    assert cache.get("gamma", "barata") is None
+    assert cache.get("background_removal", "cara") is not None
+
+    # La cadena en curso no se expulsa aunque sea lo más barato
+    chain = StageCache(max_bytes=2500)
+    chain.put("background_removal", "cara", {"mask": array()}, cost=2.0)
+    chain.put("gamma", "barata", {"processed": array()}, cost=0.01)
+    chain.put("filter", "nueva", {"processed": array()}, cost=0.05, protected=[("gamma", "barata")])
+    assert chain.get("gamma", "barata") is not None
+    assert chain.get("filter", "nueva") is None
+
+    # Los resultados caros que ya no se usan acaban saliendo (la edad sube con cada expulsión)
+    for i in range(1000):
+        cache.put("output", i, {"display": array()}, cost=0.01)
+    assert cache.get("background_removal", "cara") is None
+    assert cache.current_bytes <= cache.max_bytes
+
+
+def _busy_once(monkeypatch):
+    """Sustituye offload por uno que falla con PoolBusyError la primera vez. Devuelve las llamadas."""
+    calls = []
+
+    def offload(task, func, image, **kwargs):
+        calls.append(task)
+        if len(calls) == 1:
+            raise PoolBusyError("ocupado")
+        return func(image, **kwargs)
+    monkeypatch.setattr(pipeline, "offload", offload)
+    return calls
+
+
+def test_pool_error_fallback_is_not_cached(tmp_path, monkeypatch):
+    name = _large_image(str(tmp_path), "pequena.png", size=(120, 160))
+    calls = _busy_once(monkeypatch)
+    cache = StageCache()
+    params = {"image_dir": str(tmp_path), "background_removal_method": "GrabCut", "change_bg_mode": "Color",
+              "bg_color": "#00ff00"}
+
+    first = run_pipeline(name, params, cache=cache)
+    assert first["fallback"] and not np.any(first["mask"])
+    second = run_pipeline(name, params, cache=cache)
+    assert len(calls) == 2 # GrabCut se repite en lugar de servir la máscara vacía
+    assert not second.get("fallback") and np.any(second["mask"])
+
+
+def test_pool_error_fallback_is_not_stored_on_disk(tmp_path, monkeypatch):
+    name = _large_image(str(tmp_path), "pequena.png", size=(120, 160))
+    calls = _busy_once(monkeypatch)
+    monkeypatch.setattr(disk_cache, "_cache", disk_cache.DiskCache(str(tmp_path / "cache")))
+    params = {"image_dir": str(tmp_path), "background_removal_method": "GrabCut (multiescala)"}
+
+    assert run_pipeline(name, params, cache=StageCache())["fallback"]
+    second = run_pipeline(name, params, cache=StageCache())
+    assert len(calls) == 2
+    assert np.any(second["mask"])
+
+
+def test_preview_of_small_image_reuses_full_render(tmp_path, monkeypatch):
+    name = _large_image(str(tmp_path), "pequena.png", size=(120, 160))
+    calls = []
+    monkeypatch.setattr(pipeline, "offload", lambda task, func, image, **kwargs: calls.append(task) or func(image, **kwargs))
+    cache = StageCache()
+    params = {"image_dir": str(tmp_path), "background_removal_method": "GrabCut"}
+
+    run_pipeline(name, params, cache=cache)
+    run_pipeline(name, dict(params, gamma=1.4, preview_max_side=640), cache=cache) # La imagen ya cabe
+    assert calls == ["grabcut"]
+    assert cache.stats()["background_removal"]["hits"] == 1
+
+
+def test_collage_keeps_aspect_ratio(tmp_path):
+    name = _large_image(str(tmp_path), "pequena.png", size=(120, 160))
+    params = {"image_dir": str(tmp_path), "collage_mode": "Original vs Procesada (Horizontal)"}
+    assert run_pipeline(name, params, cache=StageCache())["result"].shape == (225, 600, 3)
+    old_look = run_pipeline(name, dict(params, collage_keep_aspect=False), cache=StageCache())
+    assert old_look["result"].shape == (300, 600, 3)
@@ -0,0 +1,43 @@
+"""
+Las operaciones puntuales fusionadas en una tabla dan el mismo resultado (valores
+y tipo) que aplicarlas una a una, también con imágenes de 16 bits.
+"""
+import numpy as np
+import pytest
+
+from processing.spec import OPS, run_spec, validate_spec
+
+SPECS = [
+    [{"op": "brightness_contrast", "params": {"brightness": 20, "contrast": 10}},
+     {"op": "threshold", "params": {"type": "Binary", "value": 100}}],
+    [{"op": "gamma", "params": {"gamma": 1.4}},
+     {"op": "threshold", "params": {"type": "Binary", "value": 128}},
+     {"op": "bitwise_not"},
+     {"op": "gamma", "params": {"gamma": 0.8}}],
+    [{"op": "threshold", "params": {"type": "Binary", "value": 60}},
+     {"op": "brightness_contrast", "params": {"brightness": -30, "contrast": 0}}],
+]
+
+
+def _image(dtype):
+    rng = np.random.default_rng(0)
+    maximum = np.iinfo(dtype).max
+    return rng.integers(0, maximum + 1, (64, 48, 3), dtype=dtype)
+
+
+def _unfused(image, ops):
+    for entry in validate_spec(ops):
+        image = OPS[entry["op"]].func(image, **entry["params"])
+    return image
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+@pytest.mark.parametrize("ops", SPECS)
+def test_fused_threshold_matches_unfused(ops, dtype):
+    image = _image(dtype)
+    fused = run_spec(image, ops)
+    expected = _unfused(image, ops)
+    if expected.ndim == 2:
+        expected = np.repeat(expected[..., None], 3, axis=2) # Los pasos devuelven BGR
+    assert fused.dtype == expected.dtype == np.uint8
+    np.testing.assert_array_equal(fused, expected)
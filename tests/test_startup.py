@@ -0,0 +1,29 @@
+"""
+Presupuesto de arranque (ver benchmarks/check_startup.py): cada módulo principal
+se importa en un intérprete nuevo dentro de su presupuesto y sin cargar los
+módulos que deben importarse sólo al usarse.
+
+STARTUP_BUDGET_SCALE multiplica los presupuestos en máquinas lentas (como --scale).
+"""
+import os
+
+import pytest
+
+from benchmarks.check_startup import BUDGETS, measure
+
+SCALE = float(os.environ.get("STARTUP_BUDGET_SCALE", "1.0"))
+REPEAT = 2 # Se toma el mínimo, como en check_startup
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_import_within_budget(module):
+    runs = [measure(module) for _ in range(REPEAT)]
+    seconds = min(run[0] for run in runs)
+    budget = BUDGETS[module] * SCALE
+    assert seconds <= budget, f"{module}: {seconds * 1000:.0f} ms > {budget * 1000:.0f} ms ({runs[-1][2]})"
+
+
+@pytest.mark.parametrize("module", sorted(BUDGETS))
+def test_no_lazy_modules_at_startup(module):
+    _, loaded, _ = measure(module)
+    assert loaded == [], f"{module} importa al arrancar: {', '.join(loaded)}"